@@ -2,10 +2,19 @@ import sys
 
 sys.path.insert(0, '..') # Import the files where the modules are located
 
-from Networking import Networking
+from ZeroTrustWebUI.network_config import NODE_TRANSPORT
+from ZeroTrustWebUI.topology import ACCESS_PROXY, TRUST_ENGINE, POLICY_ENGINE, WEB_UI
+
+if NODE_TRANSPORT == 'asyncio':
+    from AsyncNetworking import AsyncNetworking as Networking
+else:
+    from Networking import Networking
+
+#The id of this node in topology.yml, a replica is started with its id (python3 AccessProxy.py <id>)
+node_id = sys.argv[1] if len(sys.argv) > 1 else Networking.TOPOLOGY.nodes_with_role(ACCESS_PROXY)[0]
 
 #Create an instance of this node
-node_1 = Networking(Networking.NODE_CONNECT['1'][0], Networking.NODE_CONNECT['1'][1], 1)
+node_1 = Networking(Networking.NODE_CONNECT[node_id][0], Networking.NODE_CONNECT[node_id][1], node_id)
 
 #Start the node
 node_1.start()
@@ -14,10 +23,10 @@ debug = False
 
 node_1.debug =debug
 
-#Connect with node 2
-node_1.connect_with_node(Networking.NODE_CONNECT['2'][0], Networking.NODE_CONNECT['2'][1]) #node 2
-node_1.connect_with_node(Networking.NODE_CONNECT['3'][0], Networking.NODE_CONNECT['3'][1]) #node 3
-node_1.connect_with_node(Networking.NODE_CONNECT['4'][0], Networking.NODE_CONNECT['4'][1]) #node 4
+#Connect with the trust engines, the policy engines and the web UI
+node_1.connect_with_role(TRUST_ENGINE)
+node_1.connect_with_role(POLICY_ENGINE)
+node_1.connect_with_role(WEB_UI)
 
 try:
     #Start a loop to keep sending messages between node 1 and node 2
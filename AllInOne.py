@@ -0,0 +1,55 @@
+import sys
+
+sys.path.insert(0, '..') # Import the files where the modules are located
+
+from ZeroTrustWebUI.local_link import link_nodes
+from ZeroTrustWebUI.network_config import NODE_TRANSPORT
+from ZeroTrustWebUI.topology import ACCESS_PROXY, TRUST_ENGINE, POLICY_ENGINE, WEB_UI
+
+if NODE_TRANSPORT == 'asyncio':
+    from AsyncNetworking import AsyncNetworking as Networking
+else:
+    from Networking import Networking
+
+#Runs the access proxy, the trust engine and the policy engine in one process. They hand their messages to each other
+#over in-memory links instead of loopback sockets, the web UI and the nodes of other processes still connect over the
+#network. Use it when the roles do not need to be isolated (python3 AllInOne.py [<access proxy id> <trust engine id> <policy engine id>])
+node_ids = sys.argv[1:4] if len(sys.argv) > 3 else [Networking.TOPOLOGY.nodes_with_role(role)[0] for role in (ACCESS_PROXY, TRUST_ENGINE, POLICY_ENGINE)]
+
+#Create an instance of every node
+node_1, node_2, node_3 = [Networking(Networking.NODE_CONNECT[node_id][0], Networking.NODE_CONNECT[node_id][1], node_id) for node_id in node_ids]
+
+#Start the nodes
+for node in (node_1, node_2, node_3):
+    node.start()
+    node.debug = False
+
+#Link the nodes of this process
+link_nodes(node_1, node_2)
+link_nodes(node_1, node_3)
+link_nodes(node_2, node_3)
+
+#Connect with the web UI and with the replicas running in other processes
+node_1.connect_with_role(TRUST_ENGINE)
+node_1.connect_with_role(POLICY_ENGINE)
+node_1.connect_with_role(WEB_UI)
+node_2.connect_with_role(POLICY_ENGINE)
+node_2.connect_with_role(ACCESS_PROXY)
+node_3.connect_with_role(TRUST_ENGINE)
+node_3.connect_with_role(WEB_UI)
+node_3.connect_with_role(ACCESS_PROXY)
+
+try:
+    while(True):
+
+        userInput = input("\nType 'exit' to stop the Access Proxy, Trust Engine and Policy Engine...")
+
+        if(userInput == 'exit'):
+            break
+
+except KeyboardInterrupt:
+    print("\nKeyboard interrupt received. Exiting...")
+
+finally:
+    for node in (node_1, node_2, node_3):
+        node.stop()
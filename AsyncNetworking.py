@@ -0,0 +1,33 @@
+'''
+
+asyncio version of the Networking class, the access proxy, trust engine, and policy engine handle their messages
+with the same NetworkingHandlers as the p2pnetwork transport.
+Every node runs one event loop for all its connections, the messages are length-prefixed frames and are handled on a
+thread pool so a node can keep many requests in flight without a thread per peer.
+Both ends of a connection must use the same transport (see NODE_TRANSPORT in ZeroTrustWebUI/network_config.py)
+
+'''
+from Networking import NetworkingHandlers
+from ZeroTrustWebUI.async_node import AsyncNode
+
+class AsyncNetworking(NetworkingHandlers, AsyncNode):
+    # Python class constructor to initialize the class AsyncNetworking
+    def __init__(self, host, port, id=None, callback=None, max_connections=0, max_workers=None):
+        super(AsyncNetworking, self).__init__(host, port, id, callback, max_connections, max_workers)
+        self.init_handlers()
+        print(f"\n{self.get_node_role(self.id)} STARTED on {self.host}:{self.port}")
+
+    #send an envelope over a connection with the node, returns False when the node is not connected
+    def send_envelope(self, node_id, envelope):
+        with self.get_send_lock(node_id):
+            # Find the specific node by its ID
+            for node in self.peer_registry.get_connections(node_id):
+                if not node.closed:
+                    # Send the message to the specific node, the frame is written by the event loop of this node
+                    self.send_to_node(node, envelope)
+                    return True
+            return False
+
+    #close a connection with a peer, the disconnect hooks update the registry and the rings once it is closed
+    def drop_peer_connection(self, node):
+        node.stop()
@@ -6,67 +6,141 @@ Uses peer to peer communication without involvement of a centralized server for
 
 '''
 import datetime
+import threading
+import time
+import uuid
 from p2pnetwork.node import Node
-import yaml
 import ZeroTrustWebUI.TrustAlgorithm as ta
+from ZeroTrustWebUI.network_config import REQUEST_BATCHING, REQUEST_BATCH_SIZE, REQUEST_BATCH_DELAY, WORKER_POOL_SIZE, WORKER_QUEUE_LIMIT, BACKPRESSURE_RETRY_AFTER
+from ZeroTrustWebUI.network_config import HEARTBEAT_INTERVAL, HEARTBEAT_MISSED_LIMIT, RECONNECT_BASE_DELAY, RECONNECT_MAX_DELAY, PEER_QUEUE_LIMIT, PEER_QUEUE_TTL
+from ZeroTrustWebUI.hash_ring import HashRing
+from ZeroTrustWebUI.peer_registry import PeerRegistry
+from ZeroTrustWebUI.policy_configuration import current_policy
+from ZeroTrustWebUI.request_batcher import RequestBatcher
+from ZeroTrustWebUI.trust_score_cache import trust_score_cache
+from ZeroTrustWebUI.topology import load_topology, ROLE_NAMES, ACCESS_PROXY, TRUST_ENGINE, POLICY_ENGINE, WEB_UI
 from ZeroTrustWebUI.trust_signal_collection import *
+from ZeroTrustWebUI.worker_pool import PartitionedWorkerPool
+from ZeroTrustWebUI.Networking import socket_is_open
+
+#The message handlers of the nodes, they only rely on send_message_to_node and the node hooks so they are shared by
+#the p2pnetwork transport (Networking) and the asyncio transport (AsyncNetworking)
+class NetworkingHandlers:
+    # The nodes of the network are read from topology.yml
+    TOPOLOGY = load_topology()
 
-class Networking(Node):
     #Define a dictionary of the node roles based on their node.id attributes
-    NODE_ROLE = {
-        '1':'Access Proxy Node',
-        '2':'Trust Engine Node',
-        '3':'Policy Engine Node',
-        '4':'Web UI'
-    }
+    NODE_ROLE = TOPOLOGY.node_roles()
 
     #Define a dictionary of the node [host, port] based on their node.id attributes
-    NODE_CONNECT = {
-        '1':['127.0.0.1', 8001],
-        '2':['127.0.0.1', 8002],
-        '3':['127.0.0.1', 8003],
-        '4':['127.0.0.1', 8004]
-    }
+    NODE_CONNECT = TOPOLOGY.node_connect()
+
+    #Define a dictionary of the node types (access_proxy, trust_engine, policy_engine, web_ui) based on their node.id attributes
+    NODE_TYPE = TOPOLOGY.node_types()
+
+    #initialize the state used by the handlers, called by the constructor of the transport
+    def init_handlers(self):
+        # Batches the access requests sent to the trust engine (access proxy with REQUEST_BATCHING), created on first use
+        self.request_batcher = None
+        self.request_batcher_lock = threading.Lock()
+        # The messages are handled by a pool of workers, the messages of one user always go to the same worker
+        self.worker_pool = PartitionedWorkerPool(WORKER_POOL_SIZE, WORKER_QUEUE_LIMIT, name=f"node-{self.id}-worker")
+        # The connected nodes of every role, the messages for a role are routed over its ring by user_id
+        self.rings = {role: HashRing(virtual_nodes=self.TOPOLOGY.virtual_nodes) for role in ROLE_NAMES}
+        # All the nodes of every role in the topology, used to queue the messages for a role none of whose nodes is connected
+        self.topology_rings = {
+            role: HashRing(self.TOPOLOGY.nodes_with_role(role), self.TOPOLOGY.virtual_nodes)
+            for role in ROLE_NAMES
+        }
+        # The connections and the health of the peers by node id, with the messages queued for the disconnected peers
+        self.peer_registry = PeerRegistry(PEER_QUEUE_LIMIT, RECONNECT_BASE_DELAY, RECONNECT_MAX_DELAY, queue_ttl=PEER_QUEUE_TTL)
+        # The messages to one peer are sent under its send lock, so frames never interleave and the messages queued while
+        # it was disconnected are sent before the newer ones (reentrant: peer_connected flushes with send_envelope)
+        self.send_locks = {}
+        self.send_locks_lock = threading.Lock()
+        # The peers this node dials (connect_with_role), they are dialed again when they disconnect
+        self.dial_targets = set()
+        # Sends the heartbeats and dials the disconnected peers again
+        self.peer_monitor_stop = threading.Event()
+        self.peer_monitor = threading.Thread(target=self.monitor_peers, name=f"node-{self.id}-peer-monitor", daemon=True)
+        self.peer_monitor.start()
+
+    def get_send_lock(self, node_id):
+        with self.send_locks_lock:
+            return self.send_locks.setdefault(node_id, threading.RLock())
+
+    #send a message to a node, it is queued while the node is not connected
+    def send_message_to_node(self, node_id, message, request_id=None):
+        envelope = self.build_envelope(message, request_id)
+        # the message is sent or queued under the send lock, so it cannot overtake the queue flushed by peer_connected
+        with self.get_send_lock(node_id):
+            if self.send_envelope(node_id, envelope):
+                print(f"Message sent to: {self.get_node_role(node_id)}")
+                return True
+            self.queue_for_peer(node_id, envelope)
+            return False
 
-    # Python class constructor to initialize the class Networking
-    def __init__(self, host, port, id=None, callback=None, max_connections=0):
-        super(Networking, self).__init__(host, port, id, callback, max_connections)
-        print(f"\n{self.get_node_role(self.id)} STARTED on {self.host}:{self.port}")
-    
     #Define a function to extract the name of a node based on it's node.id attribute
     def get_node_role(self, node_id):
         return self.NODE_ROLE.get(node_id,'UNKNOWN ROLE')
 
-    def send_message_to_node(self, node_id, message):
-        # Find the specific node by its ID
-        target_node = None
-
-        for node in self.all_nodes:
-            if node.id == node_id:
-                target_node = node
-                #convert the message to a json object
-                json_message = {
-                    "senderID": self.id,
-                    "messageContent":message
-                }
-                # Send the message to the specific node
-                self.send_to_node(target_node, json_message)
-                print(f"Message sent to: {self.get_node_role(node_id)}")
-                break
-        if target_node is None:
-            print(f"Node {node_id} not found in inbound or outbound connections.")
-    
+    def get_node_type(self, node_id):
+        return self.NODE_TYPE.get(node_id)
+
+    #the connected node of the role that handles the key (the user_id), when no node of the role is connected the node of
+    #the topology that handles the key so the message is queued for it, None when the topology has no node of the role
+    def route(self, role, key):
+        return self.rings[role].get_node(key) or self.topology_rings[role].get_node(key)
+
+    #send a message to the node of the role that handles the key
+    def send_message_to_role(self, role, key, message, request_id=None):
+        node_id = self.route(role, key)
+        if node_id is None:
+            print(f"No {ROLE_NAMES[role]} in the topology, the message is not sent")
+            return
+        self.send_message_to_node(node_id, message, request_id)
+
+    #split the requests of a batch by the node of the role that handles their user
+    def partition_by_role(self, role, requests):
+        partitions = {}
+        for request in requests:
+            partitions.setdefault(self.route(role, request.get('user_id')), []).append(request)
+        return partitions
+
+    #send a batch message with its items (under items_key) split by the node of the role that handles their users
+    def send_batch_to_role(self, role, data, items_key, items):
+        for node_id, node_items in self.partition_by_role(role, items).items():
+            if node_id is None:
+                print(f"No {ROLE_NAMES[role]} in the topology, a batch of {len(node_items)} requests is not sent")
+                continue
+            batch_id = uuid.uuid4().hex
+            self.send_message_to_node(node_id, dict(data, batch_id=batch_id, **{items_key: node_items}), batch_id)
+
+    #wrap a message in the envelope sent between the nodes
+    def build_envelope(self, message, request_id=None):
+        # The request ID correlates all the messages of one access request (Web UI -> AP -> TE -> PE -> Web UI)
+        if request_id is None:
+            request_id = message.get('request_id') if isinstance(message, dict) else None
+        if request_id is None:
+            request_id = uuid.uuid4().hex
+
+        return {
+            "senderID": self.id,
+            "requestID": request_id,
+            "messageContent":message
+        }
+
     def message_is_from_access_proxy(self, sender_id):
-        return sender_id == '1'
+        return self.get_node_type(sender_id) == ACCESS_PROXY
 
     def message_is_from_trust_engine(self, sender_id):
-        return sender_id == '2'
+        return self.get_node_type(sender_id) == TRUST_ENGINE
 
     def message_is_from_policy_engine(self, sender_id):
-        return sender_id == '3'
+        return self.get_node_type(sender_id) == POLICY_ENGINE
     
     def message_is_from_web_ui(self, sender_id):
-        return sender_id == '4'
+        return self.get_node_type(sender_id) == WEB_UI
     
     def process_message_from_access_proxy(self, sender, message):
         print(f"Received a message from Access Proxy Node [{sender}]: {message}")
@@ -75,26 +149,54 @@ class Networking(Node):
             user_id = message.get('user_id')
             print(f"Received a Trust Score Request From: {user_id}")
             #get the trust score for this user_id using the trust algorithm
-            user_trust_score = ta.calculate_overall_trust_score(user_id)
+            trust_score_components = trust_score_cache.get_trust_score_components(user_id)
+            user_trust_score = trust_score_components['overall_trust_score']
             print(f"Performing Trust Evaluation for the Subject({user_id})...")
             print(f"Subject({user_id}) Trust Score: {user_trust_score}")
+            print(f"Trust Score Cache: {trust_score_cache.get_stats()}")
             print(f"Sending the subject's trust score to Policy Engine for policy validation...")
             data = {
                 'user_id': user_id,
                 'intent': 'request_access_decision',
-                'user_trust_score': user_trust_score
+                'user_trust_score': user_trust_score,
+                # the signals the score was computed from, the policy engine decides on them
+                'signals': trust_score_components['signals'],
+                'policy_version': current_policy().version,
+                'request_id': message.get('request_id')
+            }
+            self.send_message_to_role(POLICY_ENGINE, user_id, data)
+        #a batch of trust score requests coalesced by the access proxy, the users are scored together
+        elif message.get('intent') == 'request_trust_score_batch':
+            requests = message.get('requests', [])
+            print(f"Received a batch of {len(requests)} Trust Score Requests")
+            trust_score_components = trust_score_cache.get_batch_trust_score_components([request.get('user_id') for request in requests])
+            print(f"Trust Score Cache: {trust_score_cache.get_stats()}")
+            print(f"Sending the trust scores of the batch to Policy Engine for policy validation...")
+            scored_requests = []
+            for request in requests:
+                # None when a trust signal of the user is missing, the request is then denied
+                components = trust_score_components.get(request.get('user_id')) or {}
+                scored_requests.append({
+                    'user_id': request.get('user_id'),
+                    'user_trust_score': components.get('overall_trust_score'),
+                    'signals': components.get('signals'),
+                    'request_id': request.get('request_id')
+                })
+            data = {
+                'intent': 'request_access_decision_batch',
+                'policy_version': current_policy().version
             }
-            self.send_message_to_node('3',data)
+            self.send_batch_to_role(POLICY_ENGINE, data, 'requests', scored_requests)
+
     def make_access_decision(self,user_role, user_trust_score, sign_in_risk):
-    # Load policy configuration data from YAML file
-        with open('policyConfiguration.yml', 'r') as file:
-            policy_configuration = yaml.safe_load(file)
+        # Get the compiled policy configuration, it is reloaded when policyConfiguration.yml changes
+        policy = current_policy()
 
         # Access specific values from the policy configuration
-        admin_threshold = float(policy_configuration['adminThreshold'])
-        approver_threshold = float(policy_configuration['approverThreshold'])
-        security_viewer_threshold = float(policy_configuration['securityViewerThreshold'])
-        sign_in_risk_threshold = float(policy_configuration['signInRiskThreshold'])
+        admin_threshold = policy.admin_threshold
+        approver_threshold = policy.approver_threshold
+        security_viewer_threshold = policy.security_viewer_threshold
+        sign_in_risk_threshold = policy.sign_in_risk_threshold
 
         # Initialize verdict
         verdict = 1
@@ -114,83 +216,104 @@ class Networking(Node):
         return verdict
 
 
-    def process_message_from_trust_engine(self, sender, message):
-        print(f"Received a message from Trust Engine Node [{sender}]: {message}")
-        #if this node is a policy engine then check if the message intent is 'request_access_decision'
-        if message.get('intent') == 'request_access_decision':
-            user_id = message.get('user_id')
-            user_trust_score = message.get('user_trust_score')
-            print(f"Received a Request for Access Decision from Trust Engine for User {user_id}")
-            print(f"Current Subject's Trust Score: {user_trust_score}")
-            print(f"Checking against security policies...")
-            print(f"Latest Access Request for the user: {get_latest_access_request(user_id,'access_requests.json')}")
-            print(f"Latest Authentication Data for the user: {get_latest_auth_data(user_id,'auth_data.json')}")
-            print(f"User Identity Data: {get_user_identity_data_by_id(user_id,'user_data.json')}")
+    #check the policy version the trust scores were computed with against the policy of this engine
+    def check_policy_version(self, policy_version):
+        if policy_version is not None and policy_version != current_policy().version:
+            print(f"Trust score was computed with policy version {policy_version}, deciding with version {current_policy().version}")
 
-            user_identity_data = get_user_identity_data_by_id(user_id,'user_data.json')
-            user_auth_data = get_latest_auth_data(user_id, 'auth_data.json')
-            user_access_request = get_latest_access_request(user_id, 'access_requests.json')
+    #the signals of the access request: the snapshot sent by the trust engine, or read from the signal files when
+    #the trust engine did not send one (a trust engine of an earlier version)
+    def get_access_request_signals(self, user_id, signals):
+        if signals and signals.get('version') == ta.SIGNAL_SNAPSHOT_VERSION:
+            return signals
+        print(f"No signal snapshot of version {ta.SIGNAL_SNAPSHOT_VERSION} in the message, reading the signals of user {user_id}")
+        return ta.build_signal_snapshot(
+            get_user_identity_data_by_id(user_id, 'user_data.json'),
+            get_latest_access_request(user_id, 'access_requests.json'),
+            get_latest_auth_data(user_id, 'auth_data.json')
+        )
 
-            # Convert the string time to a datetime object
-            access_request_time_str = user_access_request.get('access_request_time', '')
+    #evaluate the access request of a user against the security policies and return the access decision data
+    def evaluate_access_request(self, user_id, user_trust_score, request_id, signals=None):
+        print(f"Checking against security policies...")
+        signals = self.get_access_request_signals(user_id, signals)
 
-            # Extract time components (hours, minutes, seconds)
-            time_components = access_request_time_str.split(' ')[1]
+         # Retrieving user_role from the identity data
+        user_role = signals.get('user_role')
 
-            time_without_year = ':'.join(time_components.split(':')[:-1])  # Extracting HH:MM:SS
+        print(f"User Role: {user_role}")
 
-             # Retrieving user_role from user_identity_data
-            user_role = user_identity_data.get('user_role')
+        # Retrieving sign_in_risk from the latest auth data
+        sign_in_risk = signals.get('sign_in_risk')
+        print(f"Sign In Risk: {sign_in_risk}")
 
-            print(f"User Role: {user_role}")
-
-            # Retrieving sign_in_risk from user_auth_data
-            sign_in_risk = user_auth_data.get('sign_in_risk')
-            print(f"Sign In Risk: {sign_in_risk}")
-
-            # Retrieving country from location in user_access_request
-            location = user_access_request.get('location', '')
-
-            country = location.split('/')[-1]
-
-            print(f"Country: {country}")
-
-            file_path = 'access_decision.json'
-
-            # Check if the file exists to determine the initial ID
-            if os.path.exists(file_path):
-                with open(file_path, 'r') as file:
-                    access_decisions = json.load(file)
-                    if access_decisions:
-                        last_entry = access_decisions[-1]
-                        new_id = last_entry['ID'] + 1
-                    else:
-                        new_id = 1
-            else:
-                access_decisions = []
-                new_id = 1
+        # Retrieving country from location in the latest access request
+        location = signals.get('location') or ''
 
-            # Call the access decision script /function here to return the verdict
-            verdict = self.make_access_decision(user_role,user_trust_score,sign_in_risk)
+        country = location.split('/')[-1]
 
-            print(f"Policy Engine Verdict: {verdict}")
-             # Prepare the access decision data
-            access_decision_data = {
-                'ID': new_id,
-                'user_id': user_id,
-                'intent': 'request_access_decision',
-                'user_trust_score': user_trust_score,
-                'access_decision': verdict
-            }
+        print(f"Country: {country}")
 
-            self.send_message_to_node('4',access_decision_data)
+        # Call the access decision script /function here to return the verdict
+        verdict = self.make_access_decision(user_role,user_trust_score,sign_in_risk)
 
-            # Append the new access decision data to the existing list
-            access_decisions.append(access_decision_data)
+        print(f"Policy Engine Verdict: {verdict}")
+         # Prepare the access decision data
+        return {
+            'user_id': user_id,
+            'intent': 'request_access_decision',
+            'user_trust_score': user_trust_score,
+            'access_decision': verdict,
+            'request_id': request_id
+        }
 
-            # Write the updated data to the JSON file
-            with open(file_path, 'w') as file:
-                json.dump(access_decisions, file, indent=4)
+    def process_message_from_trust_engine(self, sender, message):
+        print(f"Received a message from Trust Engine Node [{sender}]: {message}")
+        file_path = 'access_decision.json'
+        #if this node is a policy engine then check if the message intent is 'request_access_decision'
+        if message.get('intent') == 'request_access_decision':
+            user_id = message.get('user_id')
+            user_trust_score = message.get('user_trust_score')
+            print(f"Received a Request for Access Decision from Trust Engine for User {user_id}")
+            print(f"Current Subject's Trust Score: {user_trust_score}")
+            self.check_policy_version(message.get('policy_version'))
+
+            access_decision_data = self.evaluate_access_request(user_id, user_trust_score, message.get('request_id'), message.get('signals'))
+
+            # Store the access decision, the storage backend assigns its ID
+            access_decision_data = append_signal_record('access_decisions', file_path, access_decision_data)
+
+            self.send_message_to_role(WEB_UI, user_id, access_decision_data)
+        #a batch of requests scored by the trust engine, the verdicts are stored and sent back together
+        elif message.get('intent') == 'request_access_decision_batch':
+            requests = message.get('requests', [])
+            print(f"Received a batch of {len(requests)} Requests for Access Decision from Trust Engine")
+            self.check_policy_version(message.get('policy_version'))
+
+            access_decisions = []
+            for request in requests:
+                user_id = request.get('user_id')
+                user_trust_score = request.get('user_trust_score')
+                try:
+                    if user_trust_score is None:
+                        raise ValueError("no trust score")
+                    access_decision_data = self.evaluate_access_request(user_id, user_trust_score, request.get('request_id'), request.get('signals'))
+                except (AttributeError, IndexError, TypeError, ValueError) as e:
+                    # a request that cannot be evaluated (missing trust signals) is denied
+                    print(f"Denying the access request of user {user_id}, it cannot be evaluated: {e}")
+                    access_decision_data = {
+                        'user_id': user_id,
+                        'intent': 'request_access_decision',
+                        'user_trust_score': user_trust_score,
+                        'access_decision': 0,
+                        'request_id': request.get('request_id')
+                    }
+                access_decisions.append(access_decision_data)
+
+            # Store the access decisions in one write, the storage backend assigns their IDs
+            access_decisions = append_signal_records('access_decisions', file_path, access_decisions)
+
+            self.send_batch_to_role(WEB_UI, {'intent': 'request_access_decision_batch'}, 'access_decisions', access_decisions)
 
     def process_message_from_policy_engine(self, sender, message):
         print(f"Received a message from Policy Engine Node [{sender}]: {message}")
@@ -199,18 +322,108 @@ class Networking(Node):
         print(f"Received an Access Request from Web UI [{sender}]: {message}")
         # Check if the 'intent' key has the value 'Access Request'
         if message.get('intent', '').lower() == 'access request':
-            #access request received, prepare data to send to Trust Engine(node 2)
+            #access request received, prepare data to send to the Trust Engine handling the user
             user_id = message.get('user_id')
             intent = 'request_trust_score'
 
             data = {
                 'user_id': user_id,
-                'intent': intent
+                'intent': intent,
+                'request_id': message.get('request_id')
             }
-            self.send_message_to_node('2',data)
+            if REQUEST_BATCHING:
+                # sent to the trust engine with the other requests of its batch
+                self.get_request_batcher().add(data)
+            else:
+                self.send_message_to_role(TRUST_ENGINE, user_id, data)
         else:
             print("The intent is not 'Access Request'")
 
+    def get_request_batcher(self):
+        with self.request_batcher_lock:
+            if self.request_batcher is None:
+                self.request_batcher = RequestBatcher(self.send_trust_score_batch, REQUEST_BATCH_SIZE, REQUEST_BATCH_DELAY)
+            return self.request_batcher
+
+    #send a batch of trust score requests to the trust engines in one message per trust engine
+    def send_trust_score_batch(self, requests):
+        print(f"Sending a batch of {len(requests)} Trust Score Requests to Trust Engine")
+        requests = [{'user_id': request['user_id'], 'request_id': request['request_id']} for request in requests]
+        self.send_batch_to_role(TRUST_ENGINE, {'intent': 'request_trust_score_batch'}, 'requests', requests)
+
+    #connect with every node of the role listed in the topology, the nodes that cannot be reached yet are dialed
+    #again by the peer monitor
+    def connect_with_role(self, role):
+        for node_id in self.TOPOLOGY.nodes_with_role(role):
+            if node_id != self.id:
+                self.dial_targets.add(node_id)
+                self.dial_peer(node_id)
+
+    #connect with a peer of the topology, returns True when it is connected
+    def dial_peer(self, node_id):
+        # e.g. the peer dialed this node first or it is linked in memory (AllInOne.py)
+        if self.peer_registry.is_connected(node_id):
+            return True
+        host, port = self.NODE_CONNECT[node_id]
+        if self.connect_with_node(host, port) and self.peer_registry.is_connected(node_id):
+            return True
+        delay = self.peer_registry.reconnect_failed(node_id)
+        print(f"Could not connect with {self.get_node_role(node_id)}, trying again in {delay:.1f}s")
+        return False
+
+    #keep a message for a peer that is not connected, it is sent when the peer connects again
+    def queue_for_peer(self, node_id, envelope):
+        if node_id not in self.NODE_CONNECT:
+            print(f"Node {node_id} not found in inbound or outbound connections.")
+            return
+        if not self.peer_registry.enqueue(node_id, envelope):
+            print(f"Outbound queue of {self.get_node_role(node_id)} is full, the oldest message was dropped")
+        print(f"{self.get_node_role(node_id)} is not connected, the message is queued")
+
+    #send the messages queued while the peer was disconnected, called with the send lock of the peer held
+    def flush_outbound_queue(self, node_id):
+        entries = self.peer_registry.drain(node_id)
+        for index, (queued_at, envelope) in enumerate(entries):
+            if not self.send_envelope(node_id, envelope):
+                self.peer_registry.requeue(node_id, entries[index:])
+                return
+        if entries:
+            print(f"Sent {len(entries)} queued messages to {self.get_node_role(node_id)}")
+
+    #send the heartbeats and dial the disconnected peers again until the node stops
+    def monitor_peers(self):
+        next_heartbeat = time.monotonic() + HEARTBEAT_INTERVAL
+        while not self.peer_monitor_stop.wait(min(RECONNECT_BASE_DELAY, HEARTBEAT_INTERVAL)):
+            try:
+                for node_id in list(self.dial_targets):
+                    if self.peer_registry.reconnect_due(node_id) and self.dial_peer(node_id):
+                        print(f"Reconnected with {self.get_node_role(node_id)}")
+                if time.monotonic() >= next_heartbeat:
+                    next_heartbeat = time.monotonic() + HEARTBEAT_INTERVAL
+                    self.send_heartbeats()
+            except Exception as e:
+                print(f"Peer monitor failed: {type(e).__name__}: {e}")
+
+    def send_heartbeats(self):
+        for node_id in self.peer_registry.connected_peers():
+            missed = self.peer_registry.heartbeat_sent(node_id)
+            if missed >= HEARTBEAT_MISSED_LIMIT:
+                print(f"{self.get_node_role(node_id)} did not answer {missed} heartbeats, disconnecting")
+                for node in self.peer_registry.get_connections(node_id):
+                    self.drop_peer_connection(node)
+                continue
+            self.send_envelope(node_id, self.build_envelope({'intent': 'heartbeat', 'sent_at': time.monotonic()}))
+
+    #answer a heartbeat with the time it was sent, the sender measures the round trip time from it
+    def process_heartbeat(self, sender, message):
+        if message.get('intent') == 'heartbeat':
+            self.send_envelope(sender, self.build_envelope({'intent': 'heartbeat_ack', 'sent_at': message.get('sent_at')}))
+        elif isinstance(message.get('sent_at'), (int, float)):
+            self.peer_registry.record_rtt(sender, time.monotonic() - message['sent_at'])
+
+    def get_peer_stats(self):
+        return self.peer_registry.get_stats()
+
     def print_all_nodes(self):
         print("Outbound Nodes:")
         for node in self.nodes_outbound:
@@ -226,24 +439,76 @@ class Networking(Node):
     def outbound_node_connected(self, node):
         node_role = self.get_node_role(node.id)
         print(f"\n{self.get_node_role(self.id)} Connected to {node_role}")
+        self.peer_connected(node)
         
     def inbound_node_connected(self, node):
         print(f"\n{self.get_node_role(node.id)} Connected to {self.get_node_role(self.id)}")
+        self.peer_connected(node)
 
     def inbound_node_disconnected(self, node):
         print(f"\n{self.get_node_role(node.id)} DISCONNECTED from {self.get_node_role(self.id)}")
+        self.peer_disconnected(node)
 
     def outbound_node_disconnected(self, node):
         print(f"\n{self.get_node_role(self.id)} DISCONNECTED from {self.get_node_role(node.id)}")
+        self.peer_disconnected(node)
+
+    #a connected node receives the requests of its share of the users and the messages queued for it
+    def peer_connected(self, node):
+        # the queue is flushed before the node joins the rings, and the messages sent to the node in the meantime wait
+        # for the send lock, so the queued messages are sent first
+        with self.get_send_lock(node.id):
+            if not self.peer_registry.add_connection(node):
+                return
+            self.flush_outbound_queue(node.id)
+        role = self.get_node_type(node.id)
+        if role is not None:
+            self.rings[role].add_node(node.id)
+
+    #the users of a disconnected node move to the other connected nodes of its role
+    def peer_disconnected(self, node):
+        # the node can still be connected the other way (inbound and outbound)
+        if not self.peer_registry.remove_connection(node):
+            return
+        role = self.get_node_type(node.id)
+        if role is not None:
+            self.rings[role].remove_node(node.id)
 
     def node_message(self, node, data):
         sender_id = node.id  # Get the sender's ID
         message_content = data  # Get the message content
 
         if "senderID" in message_content:
+            request_id = message_content.get("requestID")
             message_content = message_content["messageContent"]
+            #make the request ID of the envelope available to the message handlers
+            if request_id is not None and isinstance(message_content, dict):
+                message_content.setdefault('request_id', request_id)
             #extract other future message atributes like unique hash, and message intent
 
+        self.peer_registry.mark_seen(sender_id)
+
+        if isinstance(message_content, dict) and message_content.get('intent') in ('heartbeat', 'heartbeat_ack'):
+            self.process_heartbeat(sender_id, message_content)
+            return
+
+        if isinstance(message_content, dict) and message_content.get('intent') == 'backpressure':
+            self.process_backpressure(sender_id, message_content)
+            return
+
+        # Hand the message to the worker of its user so a slow message does not hold up the connection
+        partition_key = self.get_partition_key(sender_id, message_content)
+        if not self.worker_pool.submit(partition_key, self.dispatch_message, sender_id, message_content):
+            print(f"Worker queue is full, asking {self.get_node_role(sender_id)} to back off")
+            self.send_backpressure(sender_id, message_content, partition_key)
+
+    #messages are partitioned by user, a batch of users by its batch ID
+    def get_partition_key(self, sender_id, message):
+        if isinstance(message, dict):
+            return message.get('user_id') or message.get('batch_id') or message.get('request_id') or sender_id
+        return sender_id
+
+    def dispatch_message(self, sender_id, message_content):
         # Process the message based on the sender's ID
         if self.message_is_from_access_proxy(sender_id):
             self.process_message_from_access_proxy(sender_id, message_content)
@@ -255,10 +520,93 @@ class Networking(Node):
             self.process_message_from_web_ui(sender_id, message_content)
         else:
             print(f"Received a message from an unknown sender ({sender_id}): {message_content}")
-        
+
+    #tell the sender that the message was rejected because this node is overloaded
+    def send_backpressure(self, sender_id, message, partition_key):
+        message = message if isinstance(message, dict) else {}
+        data = {
+            'intent': 'backpressure',
+            'rejected_intent': message.get('intent'),
+            'user_id': message.get('user_id'),
+            'request_id': message.get('request_id'),
+            # the requests of a rejected batch
+            'request_ids': [request.get('request_id') for request in message.get('requests', [])],
+            'queue_depth': self.worker_pool.queue_depth(partition_key),
+            'retry_after': BACKPRESSURE_RETRY_AFTER
+        }
+        self.send_message_to_node(sender_id, data, message.get('batch_id') or message.get('request_id'))
+
+    #pass the backpressure of the next node back towards the web UI so the requests fail fast instead of timing out
+    def process_backpressure(self, sender, message):
+        print(f"{self.get_node_role(sender)} is overloaded (queue depth {message.get('queue_depth')}), rejected: {message.get('rejected_intent')}")
+        key = message.get('user_id') or message.get('request_id')
+        if self.message_is_from_policy_engine(sender):
+            self.send_message_to_role(ACCESS_PROXY, key, message)
+        elif self.message_is_from_trust_engine(sender):
+            self.send_message_to_role(WEB_UI, key, message)
+
     def node_disconnect_with_outbound_node(self, node):
         print(f"\n{self.get_node_role(self.id)} wants to disconnect with {node.id}")   
             
     def node_request_to_stop(self):
         print(f"\nStopping the {self.get_node_role(self.id)} node")
-        
+        self.peer_monitor_stop.set()
+        self.worker_pool.close(wait=False)
+
+class Networking(NetworkingHandlers, Node):
+    # Python class constructor to initialize the class Networking
+    def __init__(self, host, port, id=None, callback=None, max_connections=0):
+        super(Networking, self).__init__(host, port, id, callback, max_connections)
+        self.init_handlers()
+        # guards nodes_inbound/nodes_outbound, changed by the workers (drop_peer_connection) and the connection threads
+        self.connection_lists_lock = threading.Lock()
+        print(f"\n{self.get_node_role(self.id)} STARTED on {self.host}:{self.port}")
+
+    #send an envelope over a connection with the node, returns False when the node is not connected
+    def send_envelope(self, node_id, envelope):
+        with self.get_send_lock(node_id):
+            # Find the specific node by its ID
+            for node in self.peer_registry.get_connections(node_id):
+                if not self.connection_is_open(node):
+                    # e.g. the connection the peer closed when both nodes dialed each other
+                    self.drop_peer_connection(node)
+                    continue
+                # Send the message to the specific node
+                self.send_to_node(node, envelope)
+                # the connection stops itself when the message could not be written to the socket
+                if not node.terminate_flag.is_set():
+                    return True
+                self.drop_peer_connection(node)
+            return False
+
+    #check that the peer did not close the connection (a closed socket is readable and returns no data)
+    @staticmethod
+    def connection_is_open(node):
+        return not node.terminate_flag.is_set() and socket_is_open(node.sock)
+
+    #close a connection with a peer, the disconnect hooks update the registry and the rings
+    def drop_peer_connection(self, node):
+        node.stop()
+        with self.connection_lists_lock:
+            connected = False
+            for nodes in (self.nodes_inbound, self.nodes_outbound):
+                if node in nodes:
+                    nodes.remove(node)
+                    connected = True
+        # the connection thread may have ended (and called the hooks) in the meantime
+        if connected:
+            self.peer_disconnected(node)
+
+    #called by the thread of a connection when it ends, the connection lists are shared with drop_peer_connection
+    def node_disconnected(self, node):
+        with self.connection_lists_lock:
+            inbound = node in self.nodes_inbound
+            if inbound:
+                self.nodes_inbound.remove(node)
+            outbound = node in self.nodes_outbound
+            if outbound:
+                self.nodes_outbound.remove(node)
+        if inbound:
+            self.inbound_node_disconnected(node)
+        if outbound:
+            self.outbound_node_disconnected(node)
@@ -2,10 +2,19 @@ import sys
 
 sys.path.insert(0, '..') # Import the files where the modules are located
 
-from Networking import Networking
+from ZeroTrustWebUI.network_config import NODE_TRANSPORT
+from ZeroTrustWebUI.topology import ACCESS_PROXY, TRUST_ENGINE, POLICY_ENGINE
+
+if NODE_TRANSPORT == 'asyncio':
+    from AsyncNetworking import AsyncNetworking as Networking
+else:
+    from Networking import Networking
+
+#The id of this node in topology.yml, a replica is started with its id (python3 TrustEngine.py <id>)
+node_id = sys.argv[1] if len(sys.argv) > 1 else Networking.TOPOLOGY.nodes_with_role(TRUST_ENGINE)[0]
 
 #Create an instance of this node
-node_2 = Networking(Networking.NODE_CONNECT['2'][0], Networking.NODE_CONNECT['2'][1], 2)
+node_2 = Networking(Networking.NODE_CONNECT[node_id][0], Networking.NODE_CONNECT[node_id][1], node_id)
 
 #Start the node2
 node_2.start()
@@ -14,9 +23,9 @@ debug = False
 
 node_2.debug = debug
 
-#Connect with node 1
-node_2.connect_with_node(Networking.NODE_CONNECT['3'][0], Networking.NODE_CONNECT['3'][1]) #node 3
-node_2.connect_with_node(Networking.NODE_CONNECT['1'][0], Networking.NODE_CONNECT['1'][0]) #node 1
+#Connect with the policy engines and the access proxies
+node_2.connect_with_role(POLICY_ENGINE)
+node_2.connect_with_role(ACCESS_PROXY)
 
 while(True):
 
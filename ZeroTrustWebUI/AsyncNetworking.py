@@ -0,0 +1,61 @@
+'''
+
+asyncio version of the web UI Networking class, the web UI node handles its messages with the same
+NetworkingHandlers as the p2pnetwork transport.
+The node runs one event loop for its connections and the request threads only queue their frames on it, so sends
+from many threads never interleave. A connection closed by the other node is removed by the event loop and made
+again by the next send.
+
+'''
+
+try:
+    from .async_node import AsyncNode
+    from .Networking import NetworkingHandlers
+except ImportError:
+    from async_node import AsyncNode
+    from Networking import NetworkingHandlers
+
+class AsyncNetworking(NetworkingHandlers, AsyncNode):
+    # Python class constructor to initialize the class AsyncNetworking
+    def __init__(self, host, port, id=None, callback=None, max_connections=0, max_workers=None):
+        super(AsyncNetworking, self).__init__(host, port, id, callback, max_connections, max_workers)
+        self.init_handlers()
+        print(f"\n{self.get_node_role(self.id)} STARTED on {self.host}:{self.port}")
+
+    def get_connection(self, node_id):
+        for node in self.peer_registry.get_connections(node_id):
+            if not node.closed:
+                return node
+        return None
+
+    #return the connection with the node, connecting (again) with it when there is none, e.g. after the node restarted
+    def ensure_connected(self, node_id):
+        node = self.get_connection(node_id)
+        if node is not None:
+            return node
+        with self.connect_lock:
+            node = self.get_connection(node_id)
+            if node is None:
+                host, port = self.NODE_CONNECT[node_id]
+                if self.connect_with_node(host, port):
+                    node = self.get_connection(node_id)
+        if node is None:
+            print(f"Could not connect with {self.get_node_role(node_id)}")
+        return node
+
+    def send_message_to_node(self, node_id, message, request_id=None):
+        if not self.send_envelope(node_id, self.build_envelope(message, request_id)):
+            print(f"Node {node_id} not found in inbound or outbound connections.")
+            return False
+        print("Message sent to node:", node_id)
+        return True
+
+    #send an envelope over the connection with the node, returns False when the node is not connected
+    def send_envelope(self, node_id, envelope):
+        # Find the specific node by its ID
+        target_node = self.get_connection(node_id)
+        if target_node is None:
+            return False
+        # Send the message to the specific node, the frame is written by the event loop of this node
+        self.send_to_node(target_node, envelope)
+        return True
@@ -0,0 +1,175 @@
+'''
+Batch version of the trust algorithm in TrustAlgorithm.py.
+
+The signals of every requested user are gathered into column arrays (one array per attribute) and the identity,
+access request, authentication and experience scores are computed with NumPy column operations instead of one
+user at a time. The weights, thresholds and the order of the floating point operations are the same as in the
+scalar functions so both paths return identical scores.
+
+'''
+
+from datetime import datetime
+
+import numpy as np
+
+from .policy_configuration import current_policy
+from .TrustAlgorithm import build_signal_snapshot
+from .signal_store import signal_store
+from .trust_signal_collection import signal_lookup
+
+# Characters of a '%Y-%m-%d %H:%M:%S' timestamp holding the hours, minutes and seconds
+HOURS, MINUTES, SECONDS = slice(11, 13), slice(14, 16), slice(17, 19)
+
+#signal tables: one array per attribute, row i belongs to user_ids[i], with the records the arrays were built from
+def build_signal_tables(user_ids, user_data_file='user_data.json', access_requests_file='access_requests.json', auth_data_file='auth_data.json'):
+    identities, access_requests, auth_data, scored_user_ids = [], [], [], []
+
+    # resolve the indexes once for the whole batch
+    get_identity_data = signal_lookup('user_identity', user_data_file)
+    get_access_request = signal_lookup('latest_access_request', access_requests_file)
+    get_auth_data = signal_lookup('latest_auth_data', auth_data_file)
+
+    for user_id in user_ids:
+        identity_data = get_identity_data(user_id)
+        access_request_data = get_access_request(user_id)
+        authentication_data = get_auth_data(user_id)
+        # users without all three signals cannot be scored (the scalar path raises for them)
+        if identity_data is None or access_request_data is None or authentication_data is None:
+            continue
+        scored_user_ids.append(user_id)
+        identities.append(identity_data)
+        access_requests.append(access_request_data)
+        auth_data.append(authentication_data)
+
+    return {
+        'user_id': scored_user_ids,
+        'records': list(zip(identities, access_requests, auth_data)),
+        'email_verified': np.array([bool(identity['email_verified']) for identity in identities], dtype=bool),
+        'totp_enabled': np.array([bool(identity['totp_enabled']) for identity in identities], dtype=bool),
+        'user_role': np.array([identity['user_role'] for identity in identities], dtype=object),
+        'created_timestamp': np.array([identity['created_timestamp'] for identity in identities], dtype=np.float64),
+        'location': np.array([request['location'] for request in access_requests], dtype=str),
+        'access_request_time': np.array([request['access_request_time'] for request in access_requests], dtype='U19'),
+        'device_OS': np.array([request['device_OS'] for request in access_requests], dtype=str),
+        'device_type': np.array([request['device_type'] for request in access_requests], dtype=object),
+        'sign_in_risk': np.array([auth['sign_in_risk'] for auth in auth_data], dtype=np.float64),
+        'auth_type': np.array([auth['auth_type'] for auth in auth_data], dtype=object)
+    }
+
+def calculate_user_identity_scores(tables):
+    email_verified_score = np.where(tables['email_verified'], 1.0, 0.0)
+    totp_enabled_score = np.where(tables['totp_enabled'], 1.0, 0.0)
+    user_role = tables['user_role']
+    user_role_score = np.select([user_role == 'Policy Administrator', user_role == 'Approver'], [0.9, 0.7], default=0.5)
+
+    return (email_verified_score * 0.4) + \
+           (totp_enabled_score * 0.4) + \
+           (user_role_score * 0.2)
+
+def calculate_authentication_data_scores(tables):
+    sign_in_risk = tables['sign_in_risk']
+    sign_in_risk_score = np.select([sign_in_risk >= 0.9, sign_in_risk >= 0.7, sign_in_risk >= 0.5], [0.9, 0.75, 0.5], default=0.3)
+    auth_type_score = np.where(tables['auth_type'] == 'code', 0.7, 0.5)
+
+    return (sign_in_risk_score * 0.6) + \
+           (auth_type_score * 0.4)
+
+def calculate_experience_scores(tables, current_timestamp):
+    tenure_ms = current_timestamp - tables['created_timestamp']
+    tenure_months = tenure_ms / (1000 * 60 * 60 * 24 * 30)
+
+    # same threshold order as calculate_experience_score
+    return np.select([tenure_months >= 0.15, tenure_months >= 1], [0.8, 0.6], default=0.4)
+
+#seconds since midnight of each '%Y-%m-%d %H:%M:%S' timestamp, parsed from the digits of the string array
+def seconds_of_day(timestamps):
+    digits = timestamps.view(np.uint32).reshape(len(timestamps), -1).astype(np.int64) - ord('0')
+    hours = digits[:, HOURS.start] * 10 + digits[:, HOURS.start + 1]
+    minutes = digits[:, MINUTES.start] * 10 + digits[:, MINUTES.start + 1]
+    seconds = digits[:, SECONDS.start] * 10 + digits[:, SECONDS.start + 1]
+    return hours * 3600 + minutes * 60 + seconds
+
+def time_to_seconds(time_of_day):
+    return time_of_day.hour * 3600 + time_of_day.minute * 60 + time_of_day.second
+
+def calculate_access_request_scores(tables, night_start=None, night_end=None, high_risk_locations=None, medium_risk_locations=None, low_risk_locations=None):
+    policy = current_policy()
+    night_start = policy.night_start_time if night_start is None else night_start
+    night_end = policy.night_end_time if night_end is None else night_end
+    high_risk_locations = policy.high_risk_locations if high_risk_locations is None else high_risk_locations
+    medium_risk_locations = policy.medium_risk_locations if medium_risk_locations is None else medium_risk_locations
+    low_risk_locations = policy.low_risk_locations if low_risk_locations is None else low_risk_locations
+
+    location = tables['location']
+    location_score = np.select(
+        [
+            np.isin(location, list(high_risk_locations)) if high_risk_locations else np.zeros(len(location), dtype=bool),
+            np.isin(location, list(medium_risk_locations)) if medium_risk_locations else np.zeros(len(location), dtype=bool),
+            np.isin(location, list(low_risk_locations)) if low_risk_locations else np.zeros(len(location), dtype=bool)
+        ],
+        [0.15, 0.4, 0.7],
+        default=0.5
+    )
+
+    access_time = seconds_of_day(tables['access_request_time'])
+    at_night = (time_to_seconds(night_start) <= access_time) & (access_time <= time_to_seconds(night_end))
+    access_time_score = np.where(at_night, 0.6, 0.8)
+
+    device_os_score = np.where(np.char.find(tables['device_OS'], 'Linux') >= 0, 0.5, 0.8)
+    device_type_score = np.where(tables['device_type'] == 'Mobile', 0.5, 0.8)
+
+    return (location_score * 0.3) + \
+           (access_time_score * 0.2) + \
+           (device_os_score * 0.25) + \
+           (device_type_score * 0.25)
+
+#score the users of the signal tables, returns the arrays of the segment scores and of the overall trust score
+def calculate_score_arrays(tables):
+    current_timestamp = datetime.now().timestamp() * 1000
+
+    user_identity_scores = calculate_user_identity_scores(tables)
+    access_request_scores = calculate_access_request_scores(tables)
+    authentication_data_scores = calculate_authentication_data_scores(tables)
+    experience_scores = calculate_experience_scores(tables, current_timestamp)
+
+    overall_trust_scores = (user_identity_scores * 0.3) + \
+                           (access_request_scores * 0.2) + \
+                           (authentication_data_scores * 0.25) + \
+                           (experience_scores * 0.25)
+
+    return {
+        'user_identity_score': user_identity_scores,
+        'access_request_score': access_request_scores,
+        'authentication_data_score': authentication_data_scores,
+        'experience_score': experience_scores,
+        'overall_trust_score': overall_trust_scores
+    }
+
+#score a list of users (all the users in user_data_file when user_ids is None), returns {user_id: trust score}
+def calculate_overall_trust_scores(user_ids=None, user_data_file='user_data.json', access_requests_file='access_requests.json', auth_data_file='auth_data.json'):
+    if user_ids is None:
+        user_ids = list(signal_store.get_index(user_data_file, 'user_identity'))
+
+    tables = build_signal_tables(user_ids, user_data_file, access_requests_file, auth_data_file)
+    if not tables['user_id']:
+        return {}
+
+    return dict(zip(tables['user_id'], calculate_score_arrays(tables)['overall_trust_score'].tolist()))
+
+#same as calculate_overall_trust_scores but returns {user_id: scores} with the scores of
+#TrustAlgorithm.calculate_trust_score_components, users without signals are left out
+def calculate_trust_score_components(user_ids, user_data_file='user_data.json', access_requests_file='access_requests.json', auth_data_file='auth_data.json'):
+    tables = build_signal_tables(user_ids, user_data_file, access_requests_file, auth_data_file)
+    if not tables['user_id']:
+        return {}
+
+    score_lists = {segment: scores.tolist() for segment, scores in calculate_score_arrays(tables).items()}
+    # the snapshot is built from the records and not from the arrays, so the values keep their types (an int
+    # sign_in_risk is not turned into a float, a missing one into NaN) and are the same as on the scalar path
+    return {
+        user_id: dict(
+            {segment: scores[row] for segment, scores in score_lists.items()},
+            signals=build_signal_snapshot(*tables['records'][row])
+        )
+        for row, user_id in enumerate(tables['user_id'])
+    }
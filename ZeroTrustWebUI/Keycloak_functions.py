@@ -5,18 +5,32 @@ This module will contain a higher level implementation of keycloak functions tha
 
 from keycloak import KeycloakAdmin
 import requests
+import threading
+from keycloak_config import CERTS_URL, ISSUER, KEYCLOAK_CLIENT_ID, JWKS_CACHE_TTL, JWKS_MIN_REFRESH_INTERVAL, TOKEN_NEGATIVE_CACHE_TTL, TOKEN_CLOCK_LEEWAY
+from token_verification import TokenVerifier
+from http_client import http_client
+
+# The token verifier of every keycloak client, the signing keys and verified tokens are cached between requests
+token_verifiers = {}
+token_verifiers_lock = threading.Lock()
+
+#return the token verifier of the keycloak client, introspection is its fallback for tokens it cannot validate locally
+def get_token_verifier(keycloak_openid):
+    with token_verifiers_lock:
+        verifier = token_verifiers.get(id(keycloak_openid))
+        if verifier is None:
+            verifier = TokenVerifier(CERTS_URL, KEYCLOAK_CLIENT_ID, issuer=ISSUER, introspect=keycloak_openid.introspect,
+                                     jwks_ttl=JWKS_CACHE_TTL, jwks_min_refresh_interval=JWKS_MIN_REFRESH_INTERVAL,
+                                     negative_cache_ttl=TOKEN_NEGATIVE_CACHE_TTL, leeway=TOKEN_CLOCK_LEEWAY)
+            token_verifiers[id(keycloak_openid)] = verifier
+        return verifier
 
 #function check if the token is valid
 def token_is_valid(oidc,keycloak_openid):
     #get the current access token from the oidc
     access_token = oidc.get_access_token()
-    #introspect the token to make sure that it is valid
-    introspection_result = keycloak_openid.introspect(access_token)
-
-    if introspection_result.get("active"):
-        return True
-    else:
-        return False
+    #validate the signature and the claims of the token against the cached keys of the realm
+    return get_token_verifier(keycloak_openid).verify(access_token) is not None
 
 # create a function to revoke an access token and check if the revocation was a success
 def revoke_token(client_id, client_secret, refresh_token, revocation_url):
@@ -26,7 +40,7 @@ def revoke_token(client_id, client_secret, refresh_token, revocation_url):
         "refresh_token": refresh_token
     }
 
-    response = requests.post(revocation_url, data=data)
+    response = http_client.post(revocation_url, endpoint='keycloak_logout', data=data)
 
     if response.status_code == 204:
         return True  # Token revocation was successful
@@ -50,11 +64,11 @@ def extract_user_role(oidc,keycloak_openid):
     #get the user's current access token
     access_token = oidc.get_access_token()
 
-    # Introspect the access token to ensure it's valid
-    introspection_result = keycloak_openid.introspect(access_token)
+    # Validate the access token, the claims of a token verified by token_is_valid are cached
+    claims = get_token_verifier(keycloak_openid).verify(access_token) or {}
 
     #From the access token, return the list of user's roles 
-    resource_access = introspection_result.get('resource_access', {}).get('ZeroTrustPlatform', {})
+    resource_access = claims.get('resource_access', {}).get('ZeroTrustPlatform', {})
     user_roles = resource_access.get('roles', [])
     return user_roles
 
@@ -78,7 +92,7 @@ def get_mac_details(mac_address):
     url = "https://api.macvendors.com/"
      
     # Use get method to fetch details
-    response = requests.get(url+mac_address)
+    response = http_client.get(url+mac_address, endpoint='macvendors')
     if response.status_code != 200:
         raise Exception("[!] Invalid MAC Address!")
     return response.content.decode()
@@ -86,7 +100,7 @@ def get_mac_details(mac_address):
 def get_public_ip():
     try:
         # Make an HTTP GET request to retrieve the public IP address
-        response = requests.get('https://api.ipify.org')
+        response = http_client.get('https://api.ipify.org', endpoint='ipify')
         
         # Check if the request was successful (status code 200)
         if response.status_code == 200:
@@ -100,7 +114,7 @@ def get_public_ip():
     return None  # Return None if unable to retrieve the public IP
 
 def get_location(ip_address):
-    response = requests.get(f'https://ipinfo.io/{ip_address}/json/').json()
+    response = http_client.get(f'https://ipinfo.io/{ip_address}/json/', endpoint='ipinfo').json()
     location_data = {
         "ip": ip_address,
         "city": response.get("city"),
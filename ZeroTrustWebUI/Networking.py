@@ -7,72 +7,147 @@ Uses peer to peer communication without involvement of a centralized server for
 '''
 
 import json
+import select
+import socket
+import threading
+import uuid
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 from p2pnetwork.node import Node
 
-class Networking(Node):
+try:
+    from .hash_ring import HashRing
+    from .peer_registry import PeerRegistry
+    from .topology import load_topology, ROLE_NAMES, ACCESS_PROXY, TRUST_ENGINE, POLICY_ENGINE, WEB_UI
+except ImportError:
+    from hash_ring import HashRing
+    from peer_registry import PeerRegistry
+    from topology import load_topology, ROLE_NAMES, ACCESS_PROXY, TRUST_ENGINE, POLICY_ENGINE, WEB_UI
+
+#The message handlers of the web UI node, they only rely on send_message_to_node and the node hooks so they are
+#shared by the p2pnetwork transport (Networking) and the asyncio transport (AsyncNetworking)
+class NetworkingHandlers:
+    # The nodes of the network are read from topology.yml
+    TOPOLOGY = load_topology()
+
     #Define a dictionary of the node roles based on their node.id attributes
-    NODE_ROLE = {
-        '1':'Access Proxy Node',
-        '2':'Trust Engine Node',
-        '3':'Policy Engine Node',
-        '4':'Web UI'
-    }
+    NODE_ROLE = TOPOLOGY.node_roles()
 
     #Define a dictionary of the node [host, port] based on their node.id attributes
-    NODE_CONNECT = {
-        '1':['127.0.0.1', 8001],
-        '2':['127.0.0.1', 8002],
-        '3':['127.0.0.1', 8003],
-        '4':['127.0.0.1', 8004]
-    }
+    NODE_CONNECT = TOPOLOGY.node_connect()
 
-    # Python class constructor to initialize the class Networking
-    def __init__(self, host, port, id=None, callback=None, max_connections=0):
-        super(Networking, self).__init__(host, port, id, callback, max_connections)
+    #Define a dictionary of the node types (access_proxy, trust_engine, policy_engine, web_ui) based on their node.id attributes
+    NODE_TYPE = TOPOLOGY.node_types()
+
+    #initialize the state used by the handlers, called by the constructor of the transport
+    def init_handlers(self):
         self.received_message = None
-        print(f"\n{self.get_node_role(self.id)} STARTED on {self.host}:{self.port}")
-    
+        # Access decisions the web UI is waiting for, keyed by request ID
+        self.pending_decisions = {}
+        self.pending_decisions_lock = threading.Lock()
+        # Connections are made by the request threads, one at a time
+        self.connect_lock = threading.Lock()
+        # The connections with the peers by node id
+        self.peer_registry = PeerRegistry()
+        # The nodes of every role in the topology, the messages for a role are routed over its ring by user_id
+        self.rings = {
+            role: HashRing(self.TOPOLOGY.nodes_with_role(role), self.TOPOLOGY.virtual_nodes)
+            for role in ROLE_NAMES
+        }
+
     #Define a function to extract the name of a node based on it's node.id attribute
     def get_node_role(self,node_id):
         return self.NODE_ROLE.get(node_id,'UNKNOWN ROLE')
+
+    def get_node_type(self, node_id):
+        return self.NODE_TYPE.get(node_id)
     
     def set_received_message(self, message):
         self.received_message = message  # Setter method to initialize the variable with the message
 
     def get_received_message(self):
         return self.received_message  # Getter method to retrieve the message set by the setter
-    
 
-    def send_message_to_node(self, node_id, message):
-        # Find the specific node by its ID
-        target_node = None
-
-        for node in self.all_nodes:
-            if node.id == node_id:
-                target_node = node
-                #convert the message to a json object
-                json_message = {
-                    "senderID": self.id,
-                    "messageContent":message
-                }
-                # Send the message to the specific node
-                self.send_to_node(target_node, json_message)
-                print("Message sent to node:", node_id)
-                break
-        if target_node is None:
-            print(f"Node {node_id} not found in inbound or outbound connections.")
+    #register a request ID before sending the request, the returned future receives its access decision
+    def expect_decision(self, request_id):
+        future = Future()
+        with self.pending_decisions_lock:
+            self.pending_decisions[request_id] = future
+        return future
+
+    #wait for the access decision of a request, returns None if it does not arrive in time
+    def wait_for_decision(self, request_id, future, timeout):
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            return None
+        finally:
+            self.cancel_decision(request_id)
+
+    def cancel_decision(self, request_id):
+        with self.pending_decisions_lock:
+            self.pending_decisions.pop(request_id, None)
+
+    def resolve_decision(self, message):
+        with self.pending_decisions_lock:
+            future = self.pending_decisions.pop(message.get('request_id'), None)
+        if future is None:
+            print(f"No pending request for the access decision: {message}")
+        elif not future.done():
+            future.set_result(message)
+
+    def resolve_backpressure(self, message):
+        request_ids = message.get('request_ids') or [message.get('request_id')]
+        for request_id in request_ids:
+            self.resolve_decision(dict(message, request_id=request_id))
     
+
+    #wrap a message in the envelope sent between the nodes
+    def build_envelope(self, message, request_id=None):
+        # The request ID correlates all the messages of one access request (Web UI -> AP -> TE -> PE -> Web UI)
+        if request_id is None:
+            request_id = message.get('request_id') if isinstance(message, dict) else None
+        if request_id is None:
+            request_id = uuid.uuid4().hex
+
+        return {
+            "senderID": self.id,
+            "requestID": request_id,
+            "messageContent":message
+        }
+
+    #thread safe send that (re)connects with the node when needed, returns True when the message was sent
+    def send_message(self, node_id, message, request_id=None):
+        for attempt in range(2):
+            if self.ensure_connected(node_id) is None:
+                return False
+            if self.send_message_to_node(node_id, message, request_id):
+                return True
+        return False
+
+    #send a message to the node of the role that handles the key (the user_id), the next nodes of the ring
+    #are tried in order when that node cannot be reached
+    def send_message_to_role(self, role, key, message, request_id=None):
+        for node_id in self.rings[role].get_nodes(key):
+            if self.send_message(node_id, message, request_id):
+                return True
+        print(f"No {ROLE_NAMES[role]} could be reached, the message is not sent")
+        return False
+
+    #connect with every node of the role, e.g. the policy engines that send the access decisions
+    def ensure_connected_to_role(self, role):
+        return [node_id for node_id in self.TOPOLOGY.nodes_with_role(role) if self.ensure_connected(node_id) is not None]
+
     def message_is_from_access_proxy(self, sender_id):
-        return sender_id == '1'
+        return self.get_node_type(sender_id) == ACCESS_PROXY
 
     def message_is_from_trust_engine(self, sender_id):
-        return sender_id == '2'
+        return self.get_node_type(sender_id) == TRUST_ENGINE
 
     def message_is_from_policy_engine(self, sender_id):
-        return sender_id == '3'
+        return self.get_node_type(sender_id) == POLICY_ENGINE
     
     def message_is_from_web_ui(self, sender_id):
-        return sender_id == '4'
+        return self.get_node_type(sender_id) == WEB_UI
     
     def process_message_from_access_proxy(self, sender, message):
         print(f"Received a message from Access Proxy Node [{sender}]: {message}")
@@ -80,6 +155,9 @@ class Networking(Node):
         if message.get('intent') == 'request_trust_score':
             user_id = message.get('user_id')
             print(f"Received a Trust Score Request From: {user_id}")
+        #the pipeline is overloaded, the requests it rejected are resolved with the backpressure message
+        elif message.get('intent') == 'backpressure':
+            self.resolve_backpressure(message)
 
     def process_message_from_trust_engine(self, sender, message):
         print(f"Received a message from Trust Engine Node [{sender}]: {message}")
@@ -88,21 +166,28 @@ class Networking(Node):
     def process_message_from_policy_engine(self, sender, message):
         print(f"Received a message from Policy Engine Node [{sender}]: {message}")
         self.set_received_message(message)
+        if message.get('intent') == 'request_access_decision':
+            self.resolve_decision(message)
+        #the verdicts of a batch of access requests, each one resolves its own request
+        elif message.get('intent') == 'request_access_decision_batch':
+            for access_decision in message.get('access_decisions', []):
+                self.resolve_decision(access_decision)
 
 
     def process_message_from_web_ui(self, sender, message):
         print(f"Received an Access Request from Web UI [{sender}]: {message}")
         # Check if the 'intent' key has the value 'Access Request'
         if message.get('intent', '').lower() == 'access request':
-            #access request received, prepare data to send to Trust Engine(node 2)
+            #access request received, prepare data to send to the Trust Engine handling the user
             user_id = message.get('user_id')
             intent = 'request_trust_score'
 
             data = {
                 'user_id': user_id,
-                'intent': intent
+                'intent': intent,
+                'request_id': message.get('request_id')
             }
-            self.send_message_to_node('2',data)
+            self.send_message_to_role(TRUST_ENGINE, user_id, data)
         else:
             print("The intent is not 'Access Request'")
 
@@ -121,24 +206,37 @@ class Networking(Node):
     def outbound_node_connected(self, node):
         node_role = self.get_node_role(node.id)
         print(f"\n{self.get_node_role(self.id)} Connected to {node_role}")
+        self.peer_registry.add_connection(node)
         
     def inbound_node_connected(self, node):
         print(f"\n{self.get_node_role(node.id)} Connected to {self.get_node_role(self.id)}")
+        self.peer_registry.add_connection(node)
 
     def inbound_node_disconnected(self, node):
         print(f"\n{self.get_node_role(node.id)} DISCONNECTED from {self.get_node_role(self.id)}")
+        self.peer_registry.remove_connection(node)
 
     def outbound_node_disconnected(self, node):
         print(f"\n{self.get_node_role(self.id)} DISCONNECTED from {self.get_node_role(node.id)}")
+        self.peer_registry.remove_connection(node)
 
     def node_message(self, node, data):
         sender_id = node.id  # Get the sender's ID
         message_content = data  # Get the message content
 
         if "senderID" in message_content:
+            request_id = message_content.get("requestID")
             message_content = message_content["messageContent"]
+            #make the request ID of the envelope available to the message handlers
+            if request_id is not None and isinstance(message_content, dict):
+                message_content.setdefault('request_id', request_id)
             #extract other future message atributes like unique hash, and message intent
 
+        # the engines measure their round trip time with the web UI with heartbeats
+        if isinstance(message_content, dict) and message_content.get('intent') == 'heartbeat':
+            self.send_envelope(sender_id, self.build_envelope({'intent': 'heartbeat_ack', 'sent_at': message_content.get('sent_at')}))
+            return
+
         # Process the message based on the sender's ID
         if self.message_is_from_access_proxy(sender_id):
             self.process_message_from_access_proxy(sender_id, message_content)
@@ -156,4 +254,108 @@ class Networking(Node):
             
     def node_request_to_stop(self):
         print(f"\nStopping the {self.get_node_role(self.id)} node")
-        
+
+#check that the peer did not close a connected socket (a closed socket is readable and returns no data), the probe
+#never blocks: when the connection thread reads the pending data first, the socket is open
+def socket_is_open(sock):
+    # in-memory link with a node of this process (local_link.py)
+    if sock is None:
+        return True
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        return not readable or sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) != b''
+    except BlockingIOError:
+        return True
+    except (OSError, ValueError):
+        return False
+
+class Networking(NetworkingHandlers, Node):
+    # Python class constructor to initialize the class Networking
+    def __init__(self, host, port, id=None, callback=None, max_connections=0):
+        super(Networking, self).__init__(host, port, id, callback, max_connections)
+        self.init_handlers()
+        # The web UI node is shared by the request threads, sends to one node are serialized so frames never interleave
+        self.send_locks = {}
+        self.send_locks_lock = threading.Lock()
+        # guards nodes_inbound/nodes_outbound, changed by the request threads (drop_connection) and the connection threads
+        self.connection_lists_lock = threading.Lock()
+        print(f"\n{self.get_node_role(self.id)} STARTED on {self.host}:{self.port}")
+
+    def get_send_lock(self, node_id):
+        with self.send_locks_lock:
+            return self.send_locks.setdefault(node_id, threading.Lock())
+
+    #check that the peer did not close the connection
+    @staticmethod
+    def connection_is_open(node):
+        return not node.terminate_flag.is_set() and socket_is_open(node.sock)
+
+    #drop a connection that is closed so that a new one can be made right away
+    def drop_connection(self, node):
+        node.stop()
+        with self.connection_lists_lock:
+            for nodes in (self.nodes_inbound, self.nodes_outbound):
+                if node in nodes:
+                    nodes.remove(node)
+        self.peer_registry.remove_connection(node)
+
+    #called by the thread of a connection when it ends, the connection lists are shared with drop_connection
+    def node_disconnected(self, node):
+        with self.connection_lists_lock:
+            inbound = node in self.nodes_inbound
+            if inbound:
+                self.nodes_inbound.remove(node)
+            outbound = node in self.nodes_outbound
+            if outbound:
+                self.nodes_outbound.remove(node)
+        if inbound:
+            self.inbound_node_disconnected(node)
+        if outbound:
+            self.outbound_node_disconnected(node)
+
+    def get_connection(self, node_id):
+        for node in self.peer_registry.get_connections(node_id):
+            if self.connection_is_open(node):
+                return node
+            print(f"Connection with {self.get_node_role(node_id)} is closed")
+            self.drop_connection(node)
+        return None
+
+    #return the connection with the node, connecting (again) with it when there is none, e.g. after the node restarted
+    def ensure_connected(self, node_id):
+        node = self.get_connection(node_id)
+        if node is not None:
+            return node
+        with self.connect_lock:
+            node = self.get_connection(node_id)
+            if node is None:
+                host, port = self.NODE_CONNECT[node_id]
+                if self.connect_with_node(host, port):
+                    node = self.get_connection(node_id)
+        if node is None:
+            print(f"Could not connect with {self.get_node_role(node_id)}")
+        return node
+
+    def send_message_to_node(self, node_id, message, request_id=None):
+        #convert the message to a json object
+        json_message = self.build_envelope(message, request_id)
+        if not self.send_envelope(node_id, json_message):
+            print(f"Failed to send the message to node: {node_id}")
+            return False
+        print("Message sent to node:", node_id)
+        return True
+
+    #send an envelope over the connection with the node, returns False when it could not be sent
+    def send_envelope(self, node_id, envelope):
+        # Find the specific node by its ID
+        target_node = self.get_connection(node_id)
+        if target_node is None:
+            return False
+        # Send the message to the specific node
+        with self.get_send_lock(node_id):
+            self.send_to_node(target_node, envelope)
+        # the connection stops itself when the message could not be written to the socket
+        if target_node.terminate_flag.is_set():
+            self.drop_connection(target_node)
+            return False
+        return True
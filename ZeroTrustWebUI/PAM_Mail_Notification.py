@@ -1,7 +1,7 @@
 import smtplib
 import ssl
 from email.message import EmailMessage
-from email_constants import email_sender,email_password,subject
+from email_constants import email_sender,email_password,subject,smtp_host,smtp_port,smtp_use_ssl
 
 def send_email(email_sender, email_password, email_receiver, subject, body):
     try:
@@ -13,7 +13,7 @@ def send_email(email_sender, email_password, email_receiver, subject, body):
 
         context = ssl.create_default_context()
 
-        with smtplib.SMTP_SSL('smtp.gmail.com', 465, context=context) as smtp:
+        with (smtplib.SMTP_SSL(smtp_host, smtp_port, context=context) if smtp_use_ssl else smtplib.SMTP(smtp_host, smtp_port)) as smtp:
             smtp.login(email_sender, email_password)
             smtp.sendmail(email_sender, email_receiver, em.as_string())
         print("Email sent successfully!")
@@ -27,8 +27,9 @@ def send_email(email_sender, email_password, email_receiver, subject, body):
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
 
-def send_email_to_approver(approver_email, requestor_id, requestor_username, reason_for_access, access_duration, secret_share):
-    body = f"""Dear Approver,
+#the body of the email asking an approver to approve a PAM request
+def approver_email_body(requestor_id, requestor_username, reason_for_access, access_duration, secret_share):
+    return f"""Dear Approver,
         
 Requestor ID: {requestor_id}
 Requestor Username: {requestor_username}
@@ -37,10 +38,21 @@ Access Duration: {access_duration} minutes
 Secret Share:  {secret_share}
                     
 Please copy the secret share and use it to approve the PAM request via this link: <a href="http://localhost:5000/testing">Approve PAM request</a>"""
+
+def send_email_to_approver(approver_email, requestor_id, requestor_username, reason_for_access, access_duration, secret_share):
+    body = approver_email_body(requestor_id, requestor_username, reason_for_access, access_duration, secret_share)
         
     # Send the email with the body to this approver
     send_email(email_sender,email_password,approver_email,subject,body)
 
+#add the email of every approver to the outbox, the emails are sent in the background by the email sender
+#approvers is a list of (approver email, secret share)
+def queue_emails_to_approvers(outbox, approvers, requestor_id, requestor_username, reason_for_access, access_duration):
+    return outbox.enqueue_many([
+        (approver_email, subject, approver_email_body(requestor_id, requestor_username, reason_for_access, access_duration, secret_share))
+        for approver_email, secret_share in approvers
+    ])
+
 
         
 
@@ -1,7 +1,7 @@
 from datetime import datetime
 import os
 
-import yaml
+from .policy_configuration import current_policy
 from .trust_signal_collection import get_latest_access_request, get_latest_auth_data, get_user_identity_data_by_id
 # Function to calculate User Identity Score
 def calculate_user_identity_score(identity_data):
@@ -89,31 +89,18 @@ def calculate_experience_score(created_timestamp):
     return experience_score
 
 #function to calculate the subject's score based on the access request and contextual information  such as location 
-# Get the parent directory path
-parent_directory = os.path.abspath(os.path.join(os.getcwd(), os.pardir))
-
-# File path to policyConfiguration.yml
-#file_path = os.path.join('policyConfiguration.yml')  # Update the path accordingly
-file_path = 'policyConfiguration.yml'
-
-# Load policyConfiguration.yml file
-with open(file_path, 'r') as file:
-    policy_configurations = yaml.safe_load(file)
-
-# Extract country lists for each risk category
-high_risk_countries = policy_configurations.get('highRiskLocations', [])
-medium_risk_countries = policy_configurations.get('mediumRiskLocations', [])
-low_risk_countries = policy_configurations.get('lowRiskLocations', [])
-
-# Extract night start and night end times and convert to datetime objects
-period_start = policy_configurations.get('periodStartInput', '00:00:00')
-period_end = policy_configurations.get('periodEndInput', '06:00:00')
-
-night_start_time = datetime.strptime(period_start, '%H:%M:%S').time()
-night_end_time = datetime.strptime(period_end, '%H:%M:%S').time()
+# The locations and night period come from the compiled policyConfiguration.yml (see policy_configuration.py),
+# it is reloaded as soon as the file changes so new policy configurations apply without a restart
 
 # Function to assign trust scores based on access request data for the user_id
-def calculate_access_request_score(access_request_data, night_start=night_start_time, night_end=night_end_time,high_risk_locations=high_risk_countries, medium_risk_locations=medium_risk_countries, low_risk_locations=low_risk_countries):
+def calculate_access_request_score(access_request_data, night_start=None, night_end=None,high_risk_locations=None, medium_risk_locations=None, low_risk_locations=None):
+    policy = current_policy()
+    night_start = policy.night_start_time if night_start is None else night_start
+    night_end = policy.night_end_time if night_end is None else night_end
+    high_risk_locations = policy.high_risk_locations if high_risk_locations is None else high_risk_locations
+    medium_risk_locations = policy.medium_risk_locations if medium_risk_locations is None else medium_risk_locations
+    low_risk_locations = policy.low_risk_locations if low_risk_locations is None else low_risk_locations
+
     location_score = 0.0
     access_time_score = 0.0
     device_os_score = 0.0
@@ -168,8 +155,8 @@ def calculate_access_request_score(access_request_data, night_start=night_start_
                            (device_type_score * weight_device_type)
     return access_request_score
 
-# Function to calculate Overall Trust Score
-def calculate_overall_trust_score(user_id):
+# Function to calculate the segment scores and the Overall Trust Score of a user
+def calculate_trust_score_components(user_id):
     #user_data_file_path = os.path.join(os.path.abspath(os.path.join(os.getcwd(), os.pardir)), 'user_data.json')
     #access_request_data_file_path = os.path.join(os.path.abspath(os.path.join(os.getcwd(), os.pardir)), 'access_requests.json')
     #auth_data_file_path = os.path.join(os.path.abspath(os.path.join(os.getcwd(), os.pardir)), 'auth_data.json')
@@ -197,4 +184,44 @@ def calculate_overall_trust_score(user_id):
                           (authentication_data_score * weight_authentication_data) + \
                           (experience_score * weight_experience)
 
-    return overall_trust_score
\ No newline at end of file
+    return {
+        'user_identity_score': user_identity_score,
+        'access_request_score': access_request_score,
+        'authentication_data_score': authentication_data_score,
+        'experience_score': experience_score,
+        'overall_trust_score': overall_trust_score,
+        'signals': build_signal_snapshot(identity_data, access_request_data, authentication_data)
+    }
+
+# Version of the signal snapshot, increased when its fields change
+SIGNAL_SNAPSHOT_VERSION = 1
+
+# Function to keep the signals the policy engine decides on, they are sent with the trust score so the
+# policy engine decides on the same data as the trust engine without reading the signal files
+def build_signal_snapshot(identity_data, access_request_data, authentication_data):
+    return {
+        'version': SIGNAL_SNAPSHOT_VERSION,
+        'user_role': identity_data.get('user_role'),
+        'sign_in_risk': authentication_data.get('sign_in_risk'),
+        'location': access_request_data.get('location'),
+        'access_request_time': access_request_data.get('access_request_time')
+    }
+
+# Function to calculate Overall Trust Score
+def calculate_overall_trust_score(user_id):
+    return calculate_trust_score_components(user_id)['overall_trust_score']
+
+# Function to summarize the signals the trust score of a user depends on, the score only
+# needs to be recomputed when this changes
+def get_trust_signal_fingerprint(user_id):
+    identity_data = get_user_identity_data_by_id(user_id,'user_data.json')
+    access_request_data = get_latest_access_request(user_id, 'access_requests.json')
+    authentication_data = get_latest_auth_data(user_id, 'auth_data.json')
+
+    return (
+        tuple(sorted(identity_data.items())) if identity_data else None,
+        (access_request_data.get('ID'), access_request_data.get('access_request_time')) if access_request_data else None,
+        (authentication_data.get('ID'), authentication_data.get('time'), authentication_data.get('sign_in_risk')) if authentication_data else None,
+        # a new version of policyConfiguration.yml affects every user
+        current_policy().version
+    )
@@ -1,6 +1,7 @@
 import json
 import os
 import sys
+import threading
 import time
 from flask import Flask,render_template, request, jsonify, session, url_for,redirect, make_response
 import logging
@@ -13,14 +14,24 @@ from datetime import datetime, timedelta
 import requests
 import yaml
 from Networking import Networking
+from AsyncNetworking import AsyncNetworking
+from network_config import NODE_TRANSPORT
+from topology import ACCESS_PROXY, POLICY_ENGINE, WEB_UI
 from keycloak import KeycloakAdmin
 from keycloak import KeycloakOpenIDConnection
 import re, uuid
 from keycloak_config import *
 from PAM import PAM
 from Keycloak_functions import *
-from PAM_Mail_Notification import send_email,send_email_to_approver
-from trust_signal_collection import store_keycloak_events,load_events_data,process_events
+from PAM_Mail_Notification import send_email,send_email_to_approver,queue_emails_to_approvers
+from email_outbox import EmailOutbox, EmailSender
+import email_constants
+from trust_signal_collection import store_keycloak_events,load_events_data,process_events,append_signal_record,load_signal_records,store_user_identity_data,process_events_incremental
+from signal_ingestion import SignalIngestionService
+from keycloak_directory import KeycloakDirectory
+from http_client import http_client
+from http_config import KEYCLOAK_TIMEOUT
+from enrichment import EnrichmentEngine, format_location
 
 sys.path.insert(0,'..')
 
@@ -44,7 +55,12 @@ app.config.update({
     'OIDC_OPENID_REALM': 'myrealm',
     'OIDC_SCOPES': ['openid', 'email', 'profile'],
     'OIDC_TOKEN_TYPE_HINT': 'access_token',
-    'OIDC_INTROSPECTION_AUTH_METHOD': 'client_secret_post'
+    'OIDC_INTROSPECTION_AUTH_METHOD': 'client_secret_post',
+    'SIGNAL_INGESTION_INTERVAL': 30,
+    'SIGN_IN_RISK_STREAMING': True,
+    'ACCESS_DECISION_TIMEOUT': 10,
+    'KEYCLOAK_DIRECTORY_TTL': 300,
+    'NODE_TRANSPORT': NODE_TRANSPORT
 })
 
 keycloak_connection = KeycloakOpenIDConnection(
@@ -55,17 +71,28 @@ keycloak_connection = KeycloakOpenIDConnection(
                         user_realm_name="master",
                         client_id="admin-cli",
                         client_secret_key=KEYCLOAK_ADMIN_CLIENT_SECRET,
-                        verify=False)
+                        verify=False,
+                        timeout=KEYCLOAK_TIMEOUT)
 
 keycloak_admin = KeycloakAdmin(connection=keycloak_connection)
 
+# Users of the realm and members of the client roles, loaded from the admin API on the first use and kept up to date
+# by the keycloak_directory ingestion job
+keycloak_directory = KeycloakDirectory(keycloak_admin, KEYCLOAK_CLIENT_ID, ttl=app.config.get('KEYCLOAK_DIRECTORY_TTL', 300))
+
 oidc = OpenIDConnect(app)
 
+# Offline location and device vendor lookups of the access requests (data/ip_locations.csv and data/oui.csv), the
+# public IP address of the web UI is fetched in the background
+enrichment_engine = EnrichmentEngine(fetch_public_ip=get_public_ip)
+enrichment_engine.get_public_ip()
+
 # Configure client using the python-kcloak library
 keycloak_openid = KeycloakOpenID(server_url=KEYCLOAK_SERVER_URL,
                                  client_id=KEYCLOAK_CLIENT_ID,
                                  realm_name=KEYCLOAK_REALM,
-                                 client_secret_key=KEYCLOAK_CLIENT_SECRET)
+                                 client_secret_key=KEYCLOAK_CLIENT_SECRET,
+                                 timeout=KEYCLOAK_TIMEOUT)
 
 # Configuration for SQLAlchemy
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///privileged_access.db' 
@@ -94,6 +121,128 @@ class Approver(db.Model):
     approver_action = db.Column(db.String(20))
 
 
+'''
+This section below contains the background ingestion of the trust signals (keycloak events, auth data and user identity data)
+'''
+
+# Roles of the users that logged in, written to user_data.json by the ingestion service and removed once written
+pending_user_roles = {}
+pending_user_roles_lock = threading.Lock()
+
+# New events returned by the keycloak event sync, waiting to be folded into the sign-in risk state
+pending_events = []
+# The events stored before this process started are folded in once by the first streaming run
+events_caught_up = False
+
+def ingest_keycloak_events():
+    new_events = store_keycloak_events(keycloak_admin)
+    if new_events:
+        pending_events.extend(new_events)
+        # registrations and profile updates of the users
+        keycloak_directory.process_user_events(new_events)
+
+def ingest_auth_data():
+    global events_caught_up
+
+    parent_directory = os.path.abspath(os.path.join(os.getcwd(), os.pardir))
+
+    # Define the path to events.json in the parent directory
+    events_file_path = os.path.join(parent_directory, 'events.json')
+
+    if app.config.get('SIGN_IN_RISK_STREAMING', True):
+        # only the events that were not processed yet are folded into the sign-in risk state, they are removed from
+        # pending_events once they were processed so a failed run tries them again (events already folded in are skipped)
+        drained = len(pending_events)
+        if events_caught_up:
+            events_data = pending_events[:drained]
+        else:
+            events_data = load_signal_records('events', events_file_path) or []
+        # a sqlite error of the auth data store is raised, the other errors are printed and return None
+        if process_events_incremental(events_data) is None:
+            raise RuntimeError(f"The sign-in risk state was not updated, {len(events_data)} events are tried again on the next run")
+        del pending_events[:drained]
+        events_caught_up = True
+        return
+
+    events_data = load_signal_records('events', events_file_path)
+    # Process event data to yield the auth_data
+    if events_data:
+        process_events(events_data)
+    else:
+        print("Failed to load events data.")
+
+def sync_keycloak_directory():
+    keycloak_directory.ensure_fresh()
+    keycloak_directory.sync_admin_events()
+
+def ingest_user_data():
+    all_users = keycloak_directory.get_users()
+
+    # Define the path to the JSON file
+    parent_directory = os.path.abspath(os.path.join(os.getcwd(), os.pardir))
+    file_path = os.path.join(parent_directory, 'user_data.json')
+
+    with pending_user_roles_lock:
+        user_roles = dict(pending_user_roles)
+    store_user_identity_data(all_users, user_roles, file_path)
+
+    # the roles of the users in the directory are in the file now, a role changed by a login in the meantime is kept
+    stored_user_ids = {user['id'] for user in all_users}
+    with pending_user_roles_lock:
+        for user_id, user_role in user_roles.items():
+            if user_id in stored_user_ids and pending_user_roles.get(user_id) == user_role:
+                del pending_user_roles[user_id]
+
+signal_ingestion_service = SignalIngestionService(interval=app.config.get('SIGNAL_INGESTION_INTERVAL', 30))
+signal_ingestion_service.add_job('keycloak_directory', sync_keycloak_directory)
+signal_ingestion_service.add_job('keycloak_events', ingest_keycloak_events)
+signal_ingestion_service.add_job('auth_data', ingest_auth_data)
+signal_ingestion_service.add_job('user_data', ingest_user_data)
+
+'''
+This section below contains the outbox of the approval emails, the emails are sent by background threads so the PAM
+requests return as soon as their emails are stored
+'''
+
+email_outbox = EmailOutbox(email_constants.email_outbox_path)
+email_sender_service = EmailSender(
+    email_outbox,
+    email_constants.smtp_host,
+    email_constants.smtp_port,
+    email_constants.smtp_use_ssl,
+    email_constants.email_sender,
+    email_constants.email_password,
+    email_constants.email_sender,
+    parallelism=email_constants.email_send_parallelism,
+    max_attempts=email_constants.email_max_attempts,
+    retry_base_delay=email_constants.email_retry_base_delay
+)
+# the messages left in the outbox by a previous run are sent right away, the debug server runs the app in a child
+# process of the reloader and only that process sends the emails (wake() also starts the sender when it is not running)
+if not app.debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+    email_sender_service.start()
+
+'''
+This section below contains the web UI node of the peer to peer network. It is created once, on the first access
+request (so the flask reloader process never binds the node port), and shared by all the request threads
+'''
+
+web_ui_node = None
+web_ui_node_lock = threading.Lock()
+
+def get_web_ui_node():
+    global web_ui_node
+    if web_ui_node is None:
+        with web_ui_node_lock:
+            if web_ui_node is None:
+                node_class = AsyncNetworking if app.config['NODE_TRANSPORT'] == 'asyncio' else Networking
+                web_ui_id = Networking.TOPOLOGY.nodes_with_role(WEB_UI)[0]
+                node = node_class(Networking.NODE_CONNECT[web_ui_id][0], Networking.NODE_CONNECT[web_ui_id][1], web_ui_id)
+                node.daemon = True  # do not keep the web UI process alive on exit
+                node.start()
+                web_ui_node = node
+    return web_ui_node
+
 RESOURCE_SECRET_KEY =''
 
 THRESHOLD = None
@@ -119,6 +268,8 @@ def index():
 def revokeToken():
     refresh_token = oidc.get_refresh_token()
     if revoke_token(KEYCLOAK_CLIENT_ID,KEYCLOAK_CLIENT_SECRET,refresh_token, REVOCATION_URL):
+        # the access token stays valid locally until it expires, reject it from now on
+        get_token_verifier(keycloak_openid).revoke(oidc.get_access_token())
         return render_template('index.html')
     else:
         return "<h1>Failed to revoke the access token!<h1>"
@@ -153,63 +304,12 @@ def home():
                     user_roles = extract_user_role(oidc,keycloak_openid)
                     user_role = user_roles[0]
 
-                    #storing keycloak events
-                    store_keycloak_events(keycloak_admin)
-
-                    parent_directory = os.path.abspath(os.path.join(os.getcwd(), os.pardir))
-
-                    # Define the path to events.json in the parent directory
-                    events_file_path = os.path.join(parent_directory, 'events.json')
-
-                    events_data = load_events_data(events_file_path)
-                    # Process event data to yield the auth_data
-                    if events_data:
-                        process_events(events_data)
-                    else:
-                        print("Failed to load events data.")
-
-                    all_users = keycloak_admin.get_users()
-
-                    # Define the path to the JSON file
-                    parent_directory = os.path.abspath(os.path.join(os.getcwd(), os.pardir))
-                    file_path = os.path.join(parent_directory, 'user_data.json')
-
-                    # Extracting user data
-                    extracted_data = []
-                    for user in all_users:
-                        user_info = {
-                            'user_id': user['id'],
-                            'username': user['username'],
-                            'email': user['email'],
-                            'created_timestamp': user['createdTimestamp'],
-                            'email_verified': user['emailVerified'],
-                            'totp_enabled': user['totp'],
-                            'user_role': user_role if user['id'] == user_id else user.get('user_role') # Assign user role if IDs match
-                        }
-                        extracted_data.append(user_info)
-
-                    # Load existing data from the file if it exists
-                    existing_data = []
-                    if os.path.exists(file_path):
-                        with open(file_path, 'r') as json_file:
-                            existing_data = json.load(json_file)
-
-                    # Update existing records without overwriting existing roles
-                    for existing_user in existing_data:
-                        for new_user in extracted_data:
-                            if existing_user['user_id'] == new_user['user_id'] and new_user['user_role'] is not None:
-                                existing_user['user_role'] = new_user['user_role']
-                                break
-
-                    # Combine existing and new data without duplicates
-                    user_ids_in_file = {user['user_id'] for user in existing_data}
-                    for new_user in extracted_data:
-                        if new_user['user_id'] not in user_ids_in_file:
-                            existing_data.append(new_user)
-
-                    # Store the updated and new data in the JSON file
-                    with open(file_path, 'w') as json_file:
-                        json.dump(existing_data, json_file, indent=4)
+                    # The signal ingestion jobs run in the background, the role of this user is
+                    # written to user_data.json by the next run which is triggered right away
+                    with pending_user_roles_lock:
+                        pending_user_roles[user_id] = user_role
+                    signal_ingestion_service.start()
+                    signal_ingestion_service.trigger()
 
                     return render_template('home.html', username=username, email=email, user_id=user_id, user_role=user_role)
                 else:
@@ -223,23 +323,20 @@ def home():
         return redirect(url_for('index'))
     
 
-# Define the path to the parent directory where the JSON file is stored
-parent_directory = os.path.abspath(os.path.join(os.getcwd(), os.pardir))
+#route to check how fresh the ingested trust signals are
+@app.route('/signal-freshness')
+def signal_freshness():
+    return jsonify(signal_ingestion_service.get_freshness())
 
-# Define the path to the access_decision.json file
-file_path = os.path.join(parent_directory, 'access_decision.json')
+#route to check the emails waiting in the outbox and the ones that were sent
+@app.route('/email-outbox')
+def email_outbox_status():
+    return jsonify(email_sender_service.get_stats())
 
-# Function to get the latest access decision data from the JSON file
-def get_latest_access_decision():
-    latest_decision = None
-    
-    if os.path.exists(file_path):
-        with open(file_path, 'r') as file:
-            access_decisions = json.load(file)
-            if access_decisions:
-                latest_decision = max(access_decisions, key=lambda x: x['ID'])
-    
-    return latest_decision
+#route to check the latency and errors of the outbound HTTP calls
+@app.route('/http-metrics')
+def http_metrics():
+    return jsonify(http_client.get_metrics())
 
 #route to receive an access request and forward it to the AP
 @app.route('/receive-access-request', methods = ['POST'])
@@ -248,22 +345,12 @@ def receive_and_process_access_request():
     data = request.json
     #Implement logic for adding the access request in the json file
     file_path = os.path.join(os.path.abspath(os.path.join(os.getcwd(), os.pardir)), 'access_requests.json')
-    existing_data = []
-    new_id = 1
 
-    try:
-        if os.path.exists(file_path):
-            with open(file_path, 'r') as file:
-                existing_data = json.load(file)
-                if existing_data:
-                    last_entry = existing_data[-1]
-                    new_id = last_entry['ID'] + 1
-
-    except(json.JSONDecodeError, FileNotFoundError) as e:
-        print(f"Error occurred while loading JSON data: {e}")
+    # ID used to match the access decision of the policy engine to this request
+    request_id = uuid.uuid4().hex
 
     access_request = {
-        'ID': new_id,
+        'request_id': request_id,
         'user_id': data.pop('userId'),
         'intent': data['intent'],
         'resource_requested': data['resource'],
@@ -277,33 +364,43 @@ def receive_and_process_access_request():
         'device_OS': data['operatingSystem']
     }
 
-    existing_data.append(access_request)
-
     try:
-        with open(file_path, 'w') as file:
-            json.dump(existing_data, file, indent=4)
+        access_request = append_signal_record('access_requests', file_path, access_request)
 
-    except IOError as e:
-        print(f"Error occured while loading the json data {e}")
+    except (json.JSONDecodeError, IOError) as e:
+        print(f"Error occured while storing the access request {e}")
     
     #send the access request data to the AP in the peer to peer network of nodes
 
-    #first create an instance of the Networking class
-    node4 = Networking(Networking.NODE_CONNECT['4'][0], Networking.NODE_CONNECT['4'][1],4)
-    node4.start()
-    node4.connect_with_node(Networking.NODE_CONNECT['1'][0],Networking.NODE_CONNECT['1'][1]) #connect with the access proxy
-    node4.connect_with_node(Networking.NODE_CONNECT['3'][0],Networking.NODE_CONNECT['3'][1]) # connect with the policy engine
-    node4.send_message_to_node('1',access_request)  #send access request to access proxy
+    #the web UI node keeps its connections with the access proxies and the policy engines open between requests
+    node4 = get_web_ui_node()
+    node4.ensure_connected_to_role(POLICY_ENGINE)  # the policy engines send the access decisions over these connections
+    decision_future = node4.expect_decision(request_id)
 
-    access_decision = get_latest_access_decision()
+    #send access request to the access proxy handling the user, a request without a verdict is denied
+    access_decision = None
+    if node4.send_message_to_role(ACCESS_PROXY, access_request['user_id'], access_request, request_id):
+        access_decision = node4.wait_for_decision(request_id, decision_future, app.config['ACCESS_DECISION_TIMEOUT'])
+    else:
+        node4.cancel_decision(request_id)
     print(access_decision)
 
-    policy_engine_verdict = access_decision.get('access_decision')
+    if access_decision is None:
+        print(f"No access decision received for request {request_id}")
+        policy_engine_verdict = 0
+    elif access_decision.get('intent') == 'backpressure':
+        # the trust pipeline is overloaded, the request is denied and the client is told when to retry
+        print(f"Access request {request_id} rejected by the overloaded trust pipeline")
+        retry_after = access_decision.get('retry_after', 1)
+        response = jsonify({'verdict': 0, 'retry_after': retry_after})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(math.ceil(retry_after))
+        return response
+    else:
+        policy_engine_verdict = access_decision.get('access_decision')
 
     print(f"Policy Engine Verdict: {policy_engine_verdict}")
 
-    node4.stop()
-
     # Communicate to the frontend that the access request has been verified
     response_data = {'verdict': policy_engine_verdict}
     return jsonify(response_data)
@@ -315,17 +412,17 @@ def resource_selection():
         auth_profile = session['oidc_auth_profile']
         user_id = auth_profile.get('sub')
 
-        #get location, public ip, device mac and device vendor
+        #get location, public ip, device mac and device vendor from the local data files, the public ip is the
+        #one fetched in the background (the address of the client until the first fetch returns)
 
-        location_info = get_location(ip_address=get_public_ip())
+        location_info = enrichment_engine.locate_ip(enrichment_engine.get_public_ip() or request.remote_addr)
         ip = location_info.get('ip')
-        city = location_info.get('city')
-        country = location_info.get('country')
-        location = f"{city}/{country}"
+        # Unknown/Unknown when the address is not in data/ip_locations.csv (see import_enrichment_data.py)
+        location = format_location(location_info)
 
         # Get the device mac and device vendor
         device_mac = ':'.join(re.findall('..', '%012x' % uuid.getnode()))
-        device_vendor = get_mac_details(device_mac)
+        device_vendor = enrichment_engine.lookup_vendor(device_mac)
 
     return render_template('resourceSelection.html',user_id=user_id,location=location,public_ip=ip,device_mac=device_mac,device_vendor=device_vendor)
 
@@ -343,8 +440,11 @@ def update_policy_configurations(data):
 
     existing_data.update(data)
 
-    with open(file_path, 'w') as file:
+    # Write to a temporary file and rename it so the engines never read a half written policy
+    temp_file_path = file_path + '.tmp'
+    with open(temp_file_path, 'w') as file:
         yaml.dump(existing_data, file)
+    os.replace(temp_file_path, file_path)
 
 @app.route('/receivePolicyConfigurations', methods=['POST'])
 def receive_policy_configurations():
@@ -381,8 +481,7 @@ def display_tokens():
 def access_requests():
     file_path = os.path.join(os.path.dirname(os.getcwd()), 'access_requests.json')
     
-    with open(file_path, 'r') as file:
-        access_requests_data = json.load(file)
+    access_requests_data = load_signal_records('access_requests', file_path)
     
     return render_template('logging_and_monitoring.html', access_requests=access_requests_data)
 
@@ -411,10 +510,9 @@ def configure_policies():
 
 @app.route('/privilegedAccess', methods=['GET', 'POST'])
 def privilegedAccess():
-    #dynamically query the keycloak API for the list of approvers to display for the requestor
-    client_id = keycloak_admin.get_client_id(KEYCLOAK_CLIENT_ID)
+    #the list of approvers to display for the requestor, from the cached keycloak directory
     role_name = "Approver"
-    email_addresses = get_client_role_members_emails(keycloak_admin,client_id, role_name)
+    email_addresses = keycloak_directory.get_role_member_emails(role_name)
 
     num_shares = len(email_addresses) #equal to the number of approvers 
 
@@ -447,10 +545,10 @@ def privilegedAccess():
         # Extract selected approvers in a list
         selected_approvers = request.form.getlist('approvers')
 
-        # loop through the approvers and Send emails containing the approval details
-        for index, approver in enumerate(selected_approvers):
-            approver_secret_share = secret_shares_list[index] #obtain the share to send for this approver
-            send_email_to_approver(approver,requestor_id,requestor_username,reason_for_access,access_duration,approver_secret_share)
+        # queue the emails containing the approval details and the share of every approver, they are sent in the background
+        approvers = [(approver, secret_shares_list[index]) for index, approver in enumerate(selected_approvers)]
+        queue_emails_to_approvers(email_outbox,approvers,requestor_id,requestor_username,reason_for_access,access_duration)
+        email_sender_service.wake()
 
         # Validate the access duration (between 1 and 100 minutes)
         if 1 <= access_duration <= 100:
@@ -469,11 +567,14 @@ def privilegedAccess():
             db.session.add(new_request)
             db.session.commit()
 
+            # resolve the IDs of all the selected approvers at once
+            approver_ids = keycloak_directory.get_user_ids_by_emails(selected_approvers)
+
              # Insert approver details to the DB (secret share not to be inserted !!!)
             for index, approver_email in enumerate(selected_approvers):
                 #approver_secret_share = secret_shares_list[index]  # Get the corresponding secret share
                 approver = Approver(
-                    approverID=get_user_id_by_email(keycloak_admin,approver_email),
+                    approverID=approver_ids[approver_email],
                     approverEmail=approver_email,
                     request_id=new_request.id,
                     #approver_secret_share=approver_secret_share  # Assign the secret share to each approverID
@@ -609,7 +710,7 @@ def process_secret_key():
         entered_secret_key = request.form.get('secret_key')
 
         if entered_secret_key:
-            response = requests.post('http://127.0.0.1:5000/hidden_resource',data={'secret_key': entered_secret_key})
+            response = http_client.post('http://127.0.0.1:5000/hidden_resource', endpoint='hidden_resource', data={'secret_key': entered_secret_key})
 
             if response.text == 'Valid':
                 return redirect('/configurePolicies')
@@ -0,0 +1,343 @@
+'''
+asyncio transport for the nodes of the peer to peer network, an alternative to p2pnetwork.node.Node.
+
+Node keeps one OS thread per connection with blocking sockets. AsyncNode runs every connection of the node on a
+single event loop (in the node thread) and frames the messages with a 4 byte big-endian length prefix. The same
+hooks as p2pnetwork are called (node_message, inbound/outbound_node_connected, ...) so the Networking handlers work
+with either transport. node_message runs on a thread pool and never blocks the event loop, the number of requests
+in flight is then bounded by the loop and not by the number of threads. The messages of one connection are handled
+one after the other in the order they arrived (one lane of the pool per connection), the messages of different
+connections in parallel.
+
+When two nodes connect, each one sends a hello frame (json) with its id, port and the message codecs it supports as
+the first frame of the connection. The messages that follow are encoded with the negotiated codec (see
+message_codec.py), a peer that sends no codecs gets plain json frames.
+
+'''
+
+import asyncio
+import collections
+import json
+import struct
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from .message_codec import MessageCodec, negotiate_codec, supported_codecs, FIELD_TABLE_VERSION
+    from .network_config import MESSAGE_CODEC, MESSAGE_COMPRESSION_THRESHOLD
+except ImportError:
+    from message_codec import MessageCodec, negotiate_codec, supported_codecs, FIELD_TABLE_VERSION
+    from network_config import MESSAGE_CODEC, MESSAGE_COMPRESSION_THRESHOLD
+
+# 4 byte big-endian length of the payload in front of every frame
+FRAME_HEADER = struct.Struct('!I')
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+HANDSHAKE_TIMEOUT = 10
+
+#encode a message (dict, str or bytes) as a length-prefixed frame
+def encode_frame(data):
+    if isinstance(data, bytes):
+        payload = data
+    elif isinstance(data, str):
+        payload = data.encode('utf-8')
+    else:
+        payload = json.dumps(data).encode('utf-8')
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+#decode the payload of a frame, like p2pnetwork json is decoded when possible and the text is returned otherwise
+def decode_payload(payload):
+    try:
+        payload = payload.decode('utf-8')
+    except UnicodeDecodeError:
+        return payload
+    try:
+        return json.loads(payload)
+    except json.JSONDecodeError:
+        return payload
+
+#read one frame, raises asyncio.IncompleteReadError when the connection is closed
+async def read_frame(reader):
+    (length,) = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+    if length > MAX_FRAME_SIZE:
+        raise ValueError(f"Frame of {length} bytes is larger than {MAX_FRAME_SIZE} bytes")
+    return await reader.readexactly(length)
+
+#the hello frame sent by both ends of a new connection
+def hello_message(node, codec=None):
+    hello = {'id': node.id, 'port': node.port, 'codecs': supported_codecs(), 'fields': FIELD_TABLE_VERSION}
+    if codec is not None:
+        hello['codec'] = codec
+    return hello
+
+class AsyncNodeConnection:
+    def __init__(self, main_node, reader, writer, id, host, port, codec=None):
+        self.main_node = main_node
+        self.reader = reader
+        self.writer = writer
+        self.id = str(id)
+        self.host = host
+        self.port = port
+        self.closed = False
+        # frames received and not handled yet, handled in order by at most one executor thread at a time
+        self.pending_frames = collections.deque()
+        self.handling_frames = False
+        self.pending_lock = threading.Lock()
+        # None for a peer that did not negotiate a codec, its frames are plain json
+        self.codec = MessageCodec(codec, main_node.compression_threshold) if codec is not None else None
+
+    def encode(self, data):
+        if self.codec is None:
+            return encode_frame(data)
+        payload = self.codec.encode(data)
+        return FRAME_HEADER.pack(len(payload)) + payload
+
+    def decode(self, payload):
+        if self.codec is None:
+            return decode_payload(payload)
+        return MessageCodec.decode(payload)
+
+    #write an encoded frame, must be called on the event loop of the node
+    def write_frame(self, frame):
+        if self.closed or self.writer.is_closing():
+            self.main_node.debug_print(f"AsyncNodeConnection: connection with {self.id} is closed, frame dropped")
+            return
+        self.writer.write(frame)
+
+    #send a message, can be called from any thread
+    def send(self, data):
+        self.main_node.call_on_loop(self.write_frame, self.encode(data))
+
+    def stop(self):
+        self.main_node.call_on_loop(self.close)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.writer.close()
+
+    def __str__(self):
+        return 'AsyncNodeConnection: {}:{} <-> {}:{} ({})'.format(self.main_node.host, self.main_node.port, self.host, self.port, self.id)
+
+class AsyncNode(threading.Thread):
+    def __init__(self, host, port, id=None, callback=None, max_connections=0, max_workers=None, codec=MESSAGE_CODEC, compression_threshold=MESSAGE_COMPRESSION_THRESHOLD):
+        super(AsyncNode, self).__init__(name=f"async-node-{id}")
+        self.host = host
+        self.port = port
+        self.id = str(id) if id is not None else uuid.uuid4().hex
+        self.callback = callback
+        self.max_connections = max_connections
+        self.nodes_inbound = []
+        self.nodes_outbound = []
+        self.message_count_send = 0
+        self.message_count_recv = 0
+        self.debug = False
+        self.codec = codec
+        self.compression_threshold = compression_threshold
+
+        # one event loop per node, it runs in the node thread; the handlers run on the executor
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"node-{self.id}")
+        self._server = None
+        self._stop_event = None
+        self._started = threading.Event()
+        self._start_error = None
+
+    @property
+    def all_nodes(self):
+        return self.nodes_inbound + self.nodes_outbound
+
+    def debug_print(self, message):
+        if self.debug:
+            print(f"DEBUG ({self.id}): {message}")
+
+    def in_loop_thread(self):
+        return threading.current_thread() is self
+
+    #run the function on the event loop, right away when already called from the loop
+    def call_on_loop(self, function, *args):
+        if self.in_loop_thread():
+            function(*args)
+        elif not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(function, *args)
+
+    #start the node thread and wait until the node is listening
+    def start(self):
+        super(AsyncNode, self).start()
+        self._started.wait()
+        if self._start_error is not None:
+            raise self._start_error
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self.serve())
+        finally:
+            self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+            self.loop.close()
+            self.executor.shutdown(wait=False)
+            print("Node stopped")
+
+    async def serve(self):
+        self._stop_event = asyncio.Event()
+        try:
+            self._server = await asyncio.start_server(self.handle_inbound_connection, self.host, self.port)
+        except OSError as e:
+            self._start_error = e
+            self._started.set()
+            return
+        self._started.set()
+
+        await self._stop_event.wait()
+
+        print("Node stopping...")
+        self._server.close()
+        for node in self.all_nodes:
+            node.close()
+        await self._server.wait_closed()
+
+    #stop the node, the thread ends once the connections are closed
+    def stop(self):
+        self.node_request_to_stop()
+        if self._stop_event is not None:
+            self.call_on_loop(self._stop_event.set)
+
+    #connect with the node running on host:port, returns True when connected (or already connected) with it
+    def connect_with_node(self, host, port, reconnect=False):
+        if self.in_loop_thread():
+            raise RuntimeError("connect_with_node blocks, use async_connect_with_node on the event loop")
+        return asyncio.run_coroutine_threadsafe(self.async_connect_with_node(host, port), self.loop).result()
+
+    async def async_connect_with_node(self, host, port):
+        if host == self.host and port == self.port:
+            print("connect_with_node: Cannot connect with yourself!!")
+            return False
+        for node in self.nodes_outbound:
+            if node.host == host and node.port == port:
+                print(f"connect_with_node: Already connected with this node ({node.id}).")
+                return True
+
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), HANDSHAKE_TIMEOUT)
+            writer.write(encode_frame(hello_message(self)))
+            hello = decode_payload(await asyncio.wait_for(read_frame(reader), HANDSHAKE_TIMEOUT))
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as e:
+            self.debug_print(f"connect_with_node: Could not connect with node. ({e})")
+            return False
+
+        connected_node_id = str(hello.get('id')) if isinstance(hello, dict) else None
+        if connected_node_id is None or connected_node_id == self.id or self.get_node(connected_node_id) is not None:
+            # the other node is ourselves or already connected with us
+            writer.close()
+            return connected_node_id is not None
+
+        # the node that accepted the connection chose the codec
+        node = AsyncNodeConnection(self, reader, writer, connected_node_id, host, port, hello.get('codec'))
+        self.nodes_outbound.append(node)
+        self.outbound_node_connected(node)
+        self.loop.create_task(self.receive_frames(node))
+        return True
+
+    async def handle_inbound_connection(self, reader, writer):
+        host, port = writer.get_extra_info('peername')[:2]
+        try:
+            hello = decode_payload(await asyncio.wait_for(read_frame(reader), HANDSHAKE_TIMEOUT))
+            connected_node_id = str(hello['id'])
+            port = hello.get('port', port)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, TypeError, KeyError) as e:
+            self.debug_print(f"Inbound connection from {host}:{port} failed the handshake ({e})")
+            writer.close()
+            return
+
+        if self.max_connections and len(self.nodes_inbound) >= self.max_connections:
+            self.debug_print(f"Inbound connection from {connected_node_id} refused, max connections reached")
+            writer.close()
+            return
+
+        codec = negotiate_codec(hello, self.codec)
+        writer.write(encode_frame(hello_message(self, codec)))
+        node = AsyncNodeConnection(self, reader, writer, connected_node_id, host, port, codec)
+        self.nodes_inbound.append(node)
+        self.inbound_node_connected(node)
+        await self.receive_frames(node)
+
+    #read the frames of a connection until it is closed, every message is decoded and handled on the executor
+    async def receive_frames(self, node):
+        try:
+            while True:
+                payload = await read_frame(node.reader)
+                self.message_count_recv += 1
+                with node.pending_lock:
+                    node.pending_frames.append(payload)
+                    start_handling = not node.handling_frames
+                    node.handling_frames = True
+                if start_handling:
+                    self.loop.run_in_executor(self.executor, self.handle_frames, node)
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            self.debug_print(f"Connection with {node.id} closed ({e})")
+        except ValueError as e:
+            print(f"Closing the connection with {node.id}: {e}")
+        finally:
+            node.close()
+            self.node_disconnected(node)
+
+    #handle the pending frames of a connection in the order they arrived, runs on the executor
+    def handle_frames(self, node):
+        while True:
+            with node.pending_lock:
+                if not node.pending_frames:
+                    node.handling_frames = False
+                    return
+                payload = node.pending_frames.popleft()
+            self.handle_message(node, payload)
+
+    #decode and handle a message, runs on the executor
+    def handle_message(self, node, payload):
+        try:
+            self.node_message(node, node.decode(payload))
+        except Exception as e:
+            print(f"Failed to handle the message from {node.id}: {type(e).__name__}: {e}")
+
+    def get_node(self, node_id):
+        for node in self.all_nodes:
+            if node.id == node_id and not node.closed:
+                return node
+        return None
+
+    #send a message to a connected node, can be called from any thread
+    def send_to_node(self, n, data):
+        self.message_count_send += 1
+        n.send(data)
+
+    def send_to_nodes(self, data, exclude=[]):
+        for n in self.all_nodes:
+            if n not in exclude:
+                self.send_to_node(n, data)
+
+    def node_disconnected(self, node):
+        if node in self.nodes_inbound:
+            self.nodes_inbound.remove(node)
+            self.inbound_node_disconnected(node)
+        if node in self.nodes_outbound:
+            self.nodes_outbound.remove(node)
+            self.outbound_node_disconnected(node)
+
+    # The methods below are the same hooks as p2pnetwork.node.Node and are overridden by the subclasses
+
+    def outbound_node_connected(self, node):
+        self.debug_print(f"outbound_node_connected: {node.id}")
+
+    def inbound_node_connected(self, node):
+        self.debug_print(f"inbound_node_connected: {node.id}")
+
+    def inbound_node_disconnected(self, node):
+        self.debug_print(f"inbound_node_disconnected: {node.id}")
+
+    def outbound_node_disconnected(self, node):
+        self.debug_print(f"outbound_node_disconnected: {node.id}")
+
+    def node_message(self, node, data):
+        self.debug_print(f"node_message from {node.id}: {data}")
+
+    def node_request_to_stop(self):
+        self.debug_print("node is requested to stop!")
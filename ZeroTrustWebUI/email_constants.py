@@ -2,3 +2,16 @@ email_sender = 'odingaleone7@gmail.com'
 email_password = 'nrdm umzl izhz qclz'
 subject = "Privileged Access Management (PAM) Request Approval"
 
+import os
+
+# SMTP server of the mail provider, ZTA_SMTP_HOST/ZTA_SMTP_PORT/ZTA_SMTP_SSL point the web UI to another server
+# (e.g. a local stand-in while testing)
+smtp_host = os.environ.get('ZTA_SMTP_HOST', 'smtp.gmail.com')
+smtp_port = int(os.environ.get('ZTA_SMTP_PORT', 465))
+smtp_use_ssl = os.environ.get('ZTA_SMTP_SSL', '1') == '1'
+
+# Outbox of the emails sent in the background (email_outbox.py)
+email_outbox_path = os.environ.get('ZTA_EMAIL_OUTBOX_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'email_outbox.db'))
+email_send_parallelism = 2 #SMTP connections sending at the same time
+email_max_attempts = 5 #attempts before a message is given up
+email_retry_base_delay = 30 #seconds before the first retry, doubled after every failed attempt
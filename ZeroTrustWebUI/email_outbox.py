@@ -0,0 +1,286 @@
+'''
+This module sends the emails of the web UI (the PAM approval requests) in the background instead of inside the
+HTTP request.
+
+The messages are written to an outbox table of an SQLite database, so a message that was accepted by a request is
+not lost when the web UI stops before it is sent. A pool of sender threads takes the pending messages from the
+outbox, each thread keeps one authenticated SMTP connection open and reuses it for the following messages until it
+has been idle for a while. A message that could not be sent is tried again later with an exponential backoff, up to
+a maximum number of attempts.
+
+The bodies of the PAM emails hold secret shares, so the body of a message is erased once it was sent or given up and
+the database file is only readable by the user running the web UI.
+
+Setting the SMTP host to a local stand-in (ZTA_SMTP_HOST=localhost ZTA_SMTP_PORT=1025 ZTA_SMTP_SSL=0, e.g.
+python3 -m aiosmtpd -n -l localhost:1025) sends the emails to it instead of the mail provider.
+
+'''
+
+import os
+import random
+import smtplib
+import sqlite3
+import ssl
+import threading
+import time
+from email.message import EmailMessage
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY,
+    recipient TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    body TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    last_error TEXT,
+    created REAL NOT NULL,
+    sent REAL
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_status_next_attempt ON outbox (status, next_attempt);
+'''
+
+class EmailOutbox:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        if not os.path.exists(db_path):
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            os.close(os.open(db_path, os.O_CREAT | os.O_WRONLY, 0o600))
+        self._connect().executescript(SCHEMA)
+        # messages that were being sent when the web UI stopped are sent again
+        self._connect().execute("UPDATE outbox SET status = 'pending' WHERE status = 'sending'")
+
+    #each thread gets its own connection, sqlite connections must not be shared between threads
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    #add the messages [(recipient, subject, body)] to the outbox in a single transaction, returns their IDs
+    def enqueue_many(self, messages):
+        connection = self._connect()
+        now = time.time()
+        ids = []
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            for recipient, subject, body in messages:
+                cursor = connection.execute(
+                    'INSERT INTO outbox (recipient, subject, body, next_attempt, created) VALUES (?, ?, ?, ?, ?)',
+                    (recipient, subject, body, now, now)
+                )
+                ids.append(cursor.lastrowid)
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return ids
+
+    def enqueue(self, recipient, subject, body):
+        return self.enqueue_many([(recipient, subject, body)])[0]
+
+    #take up to limit messages that are due, they are marked as sending so no other sender takes them
+    def claim(self, limit):
+        connection = self._connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            rows = connection.execute(
+                "SELECT id, recipient, subject, body, attempts FROM outbox WHERE status = 'pending' AND next_attempt <= ? ORDER BY next_attempt, id LIMIT ?",
+                (time.time(), limit)
+            ).fetchall()
+            connection.executemany("UPDATE outbox SET status = 'sending' WHERE id = ?", [(row[0],) for row in rows])
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return [{'id': row[0], 'recipient': row[1], 'subject': row[2], 'body': row[3], 'attempts': row[4]} for row in rows]
+
+    def mark_sent(self, message_id):
+        self._connect().execute(
+            "UPDATE outbox SET status = 'sent', attempts = attempts + 1, sent = ?, last_error = NULL, body = '' WHERE id = ?",
+            (time.time(), message_id)
+        )
+
+    #record a failed attempt, the message is tried again after retry_delay seconds or given up when it is None
+    def mark_failed(self, message_id, error, retry_delay=None):
+        if retry_delay is None:
+            self._connect().execute(
+                "UPDATE outbox SET status = 'failed', attempts = attempts + 1, last_error = ?, body = '' WHERE id = ?", (error, message_id)
+            )
+        else:
+            self._connect().execute(
+                "UPDATE outbox SET status = 'pending', attempts = attempts + 1, last_error = ?, next_attempt = ? WHERE id = ?",
+                (error, time.time() + retry_delay, message_id)
+            )
+
+    #seconds until the next pending message is due, or None when the outbox is empty
+    def next_due_in(self):
+        row = self._connect().execute("SELECT MIN(next_attempt) FROM outbox WHERE status = 'pending'").fetchone()
+        return max(0.0, row[0] - time.time()) if row[0] is not None else None
+
+    def get_stats(self):
+        rows = self._connect().execute('SELECT status, COUNT(*) FROM outbox GROUP BY status').fetchall()
+        return dict(rows)
+
+class EmailSender:
+    def __init__(self, outbox, smtp_host, smtp_port, use_ssl, username, password, sender, parallelism=2, batch_size=5,
+                 max_attempts=5, retry_base_delay=30, retry_max_delay=3600, idle_timeout=60, smtp_timeout=30):
+        self.outbox = outbox
+        self.smtp_host = smtp_host
+        self.smtp_port = smtp_port
+        self.use_ssl = use_ssl
+        self.username = username
+        self.password = password
+        self.sender = sender
+        self.parallelism = parallelism
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.idle_timeout = idle_timeout
+        self.smtp_timeout = smtp_timeout
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._threads = []
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.sent = 0
+        self.failed_attempts = 0
+        self.connections_opened = 0
+
+    #start the sender threads, calling it again once started does nothing
+    def start(self):
+        with self._start_lock:
+            if not self._threads:
+                for index in range(self.parallelism):
+                    thread = threading.Thread(target=self._run, name=f"email-sender-{index}", daemon=True)
+                    thread.start()
+                    self._threads.append(thread)
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake_event.set()
+        for thread in self._threads:
+            thread.join()
+
+    #ask the sender threads to look at the outbox now, e.g. after messages were enqueued, they are started if needed
+    def wake(self):
+        self.start()
+        self._wake_event.set()
+
+    def _open_connection(self):
+        if self.use_ssl:
+            smtp = smtplib.SMTP_SSL(self.smtp_host, self.smtp_port, timeout=self.smtp_timeout, context=ssl.create_default_context())
+        else:
+            smtp = smtplib.SMTP(self.smtp_host, self.smtp_port, timeout=self.smtp_timeout)
+        if self.username:
+            smtp.login(self.username, self.password)
+        with self._stats_lock:
+            self.connections_opened += 1
+        return smtp
+
+    @staticmethod
+    def _close_connection(smtp):
+        try:
+            smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            smtp.close()
+
+    def _build_message(self, message):
+        email_message = EmailMessage()
+        email_message['From'] = self.sender
+        email_message['To'] = message['recipient']
+        email_message['Subject'] = message['subject']
+        email_message.set_content(message['body'])
+        return email_message
+
+    #seconds before the next attempt of a message that failed attempts times, with jitter
+    def retry_delay(self, attempts):
+        delay = min(self.retry_max_delay, self.retry_base_delay * 2 ** (attempts - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _run(self):
+        smtp = None
+        idle_since = time.monotonic()
+        while not self._stop_event.is_set():
+            try:
+                messages = self.outbox.claim(self.batch_size)
+            except sqlite3.Error as e:
+                # e.g. the database is locked for longer than its timeout, the outbox is read again later
+                print(f"Failed to read the email outbox: {e}")
+                self._wake_event.wait(self.retry_base_delay)
+                self._wake_event.clear()
+                continue
+            if not messages:
+                # the connection is closed once it was not used for idle_timeout seconds
+                if smtp is not None and time.monotonic() - idle_since >= self.idle_timeout:
+                    self._close_connection(smtp)
+                    smtp = None
+                try:
+                    next_due_in = self.outbox.next_due_in()
+                except sqlite3.Error:
+                    next_due_in = None
+                timeout = min(next_due_in, self.idle_timeout) if next_due_in is not None else self.idle_timeout
+                self._wake_event.wait(max(timeout, 0.1))
+                self._wake_event.clear()
+                continue
+
+            for message in messages:
+                try:
+                    smtp = self._send(smtp, message)
+                except sqlite3.Error as e:
+                    # the message stays claimed and is sent again when the web UI restarts
+                    print(f"Failed to record the result of email {message['id']}: {e}")
+            idle_since = time.monotonic()
+
+        if smtp is not None:
+            self._close_connection(smtp)
+
+    #send one message on the connection (opened again if the server closed it), returns the connection to reuse
+    def _send(self, smtp, message):
+        email_message = self._build_message(message)
+        for retry_connection in (False, True):
+            try:
+                if smtp is None:
+                    smtp = self._open_connection()
+                smtp.send_message(email_message)
+                self.outbox.mark_sent(message['id'])
+                with self._stats_lock:
+                    self.sent += 1
+                print(f"Email {message['id']} sent to {message['recipient']}")
+                return smtp
+            except smtplib.SMTPServerDisconnected as e:
+                # the server closed the reused connection, it is opened again once for this message
+                smtp = None
+                if not retry_connection:
+                    continue
+                error = e
+            except (smtplib.SMTPException, ssl.SSLError, OSError) as e:
+                error = e
+                if not isinstance(e, (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)):
+                    # the connection may be unusable after a connection or authentication error
+                    if smtp is not None:
+                        self._close_connection(smtp)
+                    smtp = None
+            break
+
+        attempts = message['attempts'] + 1
+        # the addresses refused by the server and the messages out of attempts are not tried again
+        permanent = isinstance(error, smtplib.SMTPRecipientsRefused) or attempts >= self.max_attempts
+        retry_delay = None if permanent else self.retry_delay(attempts)
+        self.outbox.mark_failed(message['id'], f"{type(error).__name__}: {error}", retry_delay)
+        with self._stats_lock:
+            self.failed_attempts += 1
+        print(f"Failed to send email {message['id']} to {message['recipient']} (attempt {attempts}): {error}")
+        return smtp
+
+    def get_stats(self):
+        with self._stats_lock:
+            stats = {'sent': self.sent, 'failed_attempts': self.failed_attempts, 'connections_opened': self.connections_opened}
+        stats['outbox'] = self.outbox.get_stats()
+        return stats
@@ -0,0 +1,236 @@
+'''
+This module enriches the access requests offline: the location of an IP address and the vendor of a MAC address are
+looked up in local data files instead of calling third party APIs while the /resource-selection page is rendered.
+
+The IP ranges are kept sorted by their first address and searched with a binary search, the MAC address prefixes
+(24, 28 and 36 bit IEEE assignments) are kept in one dictionary per prefix length and the longest prefix wins. An LRU
+cache sits in front of both lookups. The data files are loaded again when they change on disk, so they can be
+refreshed without restarting the web UI. The files in the repository only hold a few seed entries, the full GeoIP and
+IEEE registry data is imported with import_enrichment_data.py.
+
+An address that is not in the IP ranges gets the 'Unknown/Unknown' location (UNKNOWN_LOCATION) instead of a made up
+one, it can be listed in the risk locations of policyConfiguration.yml like any other location.
+
+The public IP address of the web UI is the only value that still comes from a third party: it is fetched in a
+background thread and the cached value (or None until the first fetch returns) is served to the requests.
+
+'''
+
+import bisect
+import csv
+import ipaddress
+import os
+import threading
+import time
+from collections import OrderedDict
+
+DATA_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+IP_LOCATIONS_FILE = os.path.join(DATA_DIRECTORY, 'ip_locations.csv')
+OUI_FILE = os.path.join(DATA_DIRECTORY, 'oui.csv')
+
+# City or country of the location of an address that is not in the IP ranges
+UNKNOWN_LOCATION = 'Unknown'
+
+# Lengths in hex digits of the IEEE assignments (MA-S, MA-M, MA-L), the longest is looked up first
+OUI_PREFIX_LENGTHS = (9, 7, 6)
+
+#return the rows of a csv data file as dictionaries, the lines starting with # are comments
+def read_data_file(file_path):
+    with open(file_path, 'r', newline='', encoding='utf-8') as file:
+        return list(csv.DictReader(line for line in file if not line.startswith('#')))
+
+class IpLocationTable:
+    def __init__(self, rows=()):
+        # one table per IP version: first addresses (sorted), last addresses and locations at the same index
+        self._tables = {}
+        ranges = {4: [], 6: []}
+        for row in rows:
+            try:
+                start = ipaddress.ip_address(row['start_ip'].strip())
+                end = ipaddress.ip_address(row['end_ip'].strip())
+            except (KeyError, ValueError, AttributeError):
+                continue
+            ranges[start.version].append((int(start), int(end), {'city': row.get('city') or None, 'country': row.get('country') or None}))
+        for version, version_ranges in ranges.items():
+            version_ranges.sort(key=lambda ip_range: ip_range[0])
+            self._tables[version] = (
+                [ip_range[0] for ip_range in version_ranges],
+                [ip_range[1] for ip_range in version_ranges],
+                [ip_range[2] for ip_range in version_ranges]
+            )
+
+    def __len__(self):
+        return sum(len(starts) for starts, _, _ in self._tables.values())
+
+    #return {'city', 'country'} of the range holding the address, or None
+    def lookup(self, ip_address):
+        try:
+            address = ipaddress.ip_address(ip_address)
+        except ValueError:
+            return None
+        starts, ends, locations = self._tables[address.version]
+        index = bisect.bisect_right(starts, int(address)) - 1
+        if index >= 0 and int(address) <= ends[index]:
+            return locations[index]
+        return None
+
+class OuiIndex:
+    def __init__(self, rows=()):
+        self._prefixes = {length: {} for length in OUI_PREFIX_LENGTHS}
+        for row in rows:
+            prefix = normalize_mac(row.get('Assignment') or '')
+            vendor = (row.get('Organization Name') or '').strip()
+            if len(prefix) in self._prefixes and vendor:
+                self._prefixes[len(prefix)][prefix] = vendor
+
+    def __len__(self):
+        return sum(len(prefixes) for prefixes in self._prefixes.values())
+
+    #return the vendor of the longest assignment matching the MAC address, or None
+    def lookup(self, mac_address):
+        mac = normalize_mac(mac_address)
+        for length in OUI_PREFIX_LENGTHS:
+            vendor = self._prefixes[length].get(mac[:length])
+            if vendor is not None:
+                return vendor
+        return None
+
+#return the 'city/country' location of a locate_ip result, the parts that are not known are UNKNOWN_LOCATION
+def format_location(location_info):
+    return f"{location_info.get('city') or UNKNOWN_LOCATION}/{location_info.get('country') or UNKNOWN_LOCATION}"
+
+#return the hex digits of a MAC address or prefix in upper case (e4:aa:ea:.., E4-AA-EA, e4aa.ea.. -> E4AAEA..)
+def normalize_mac(mac_address):
+    return ''.join(character for character in mac_address.upper() if character in '0123456789ABCDEF')
+
+class LRUCache:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    #return (found, value)
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+class EnrichmentEngine:
+    def __init__(self, ip_locations_file=IP_LOCATIONS_FILE, oui_file=OUI_FILE, cache_size=4096, reload_interval=60,
+                 fetch_public_ip=None, public_ip_ttl=3600):
+        self.ip_locations_file = ip_locations_file
+        self.oui_file = oui_file
+        self.reload_interval = reload_interval
+        # callable returning the public IP address of the web UI, called in a background thread
+        self.fetch_public_ip = fetch_public_ip
+        self.public_ip_ttl = public_ip_ttl
+        self.ip_locations = IpLocationTable()
+        self.oui_index = OuiIndex()
+        self.location_cache = LRUCache(cache_size)
+        self.vendor_cache = LRUCache(cache_size)
+        self._file_versions = {}
+        self._checked_at = None
+        self._reload_lock = threading.Lock()
+        self._public_ip = None
+        self._public_ip_fetched_at = None
+        self._public_ip_thread = None
+        self._public_ip_lock = threading.Lock()
+        self.reload()
+
+    def get_file_version(self, file_path):
+        try:
+            stat = os.stat(file_path)
+            return stat.st_mtime_ns, stat.st_size
+        except FileNotFoundError:
+            return None
+
+    #load the data files that changed since they were loaded, a file that is missing leaves its lookup empty
+    def reload(self):
+        with self._reload_lock:
+            self._checked_at = time.monotonic()
+            for file_path, table_class, attribute, cache in (
+                (self.ip_locations_file, IpLocationTable, 'ip_locations', self.location_cache),
+                (self.oui_file, OuiIndex, 'oui_index', self.vendor_cache)
+            ):
+                version = self.get_file_version(file_path)
+                if version == self._file_versions.get(file_path):
+                    continue
+                try:
+                    table = table_class(read_data_file(file_path)) if version is not None else table_class()
+                except (OSError, csv.Error, UnicodeDecodeError) as e:
+                    print(f"Failed to load the enrichment data file {file_path}: {e}")
+                    continue
+                setattr(self, attribute, table)
+                self._file_versions[file_path] = version
+                cache.clear()
+                print(f"Loaded {len(table)} entries from {file_path}")
+
+    def reload_if_changed(self):
+        if time.monotonic() - self._checked_at >= self.reload_interval:
+            self.reload()
+
+    #return {'ip', 'city', 'country'} of an IP address, city and country are None when it is not in the table
+    def locate_ip(self, ip_address):
+        self.reload_if_changed()
+        found, location = self.location_cache.get(ip_address)
+        if not found:
+            location = self.ip_locations.lookup(ip_address) if ip_address else None
+            self.location_cache.put(ip_address, location)
+        location = location or {'city': None, 'country': None}
+        return {'ip': ip_address, 'city': location['city'], 'country': location['country']}
+
+    #return the vendor of a MAC address, or None when its prefix is not in the index
+    def lookup_vendor(self, mac_address):
+        self.reload_if_changed()
+        found, vendor = self.vendor_cache.get(mac_address)
+        if not found:
+            vendor = self.oui_index.lookup(mac_address) if mac_address else None
+            self.vendor_cache.put(mac_address, vendor)
+        return vendor
+
+    #return the cached public IP address, starting a background fetch when it is missing or expired
+    def get_public_ip(self):
+        with self._public_ip_lock:
+            expired = self._public_ip_fetched_at is None or time.monotonic() - self._public_ip_fetched_at >= self.public_ip_ttl
+            if expired and self.fetch_public_ip is not None and (self._public_ip_thread is None or not self._public_ip_thread.is_alive()):
+                self._public_ip_thread = threading.Thread(target=self.refresh_public_ip, name='public-ip', daemon=True)
+                self._public_ip_thread.start()
+            return self._public_ip
+
+    def refresh_public_ip(self):
+        try:
+            public_ip = self.fetch_public_ip()
+        except Exception as e:
+            print(f"Failed to fetch the public IP address: {e}")
+            public_ip = None
+        with self._public_ip_lock:
+            if public_ip:
+                self._public_ip = public_ip
+            # a failed fetch is tried again on the next request after a minute
+            self._public_ip_fetched_at = time.monotonic() if public_ip else time.monotonic() - self.public_ip_ttl + 60
+
+    def get_stats(self):
+        return {
+            'ip_ranges': len(self.ip_locations),
+            'oui_prefixes': len(self.oui_index),
+            'location_cache': {'hits': self.location_cache.hits, 'misses': self.location_cache.misses},
+            'vendor_cache': {'hits': self.vendor_cache.hits, 'misses': self.vendor_cache.misses},
+            'public_ip': self._public_ip
+        }
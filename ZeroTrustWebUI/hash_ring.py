@@ -0,0 +1,85 @@
+'''
+Consistent hash ring used to spread the requests over the replicas of a role (e.g. the trust engines) by user_id.
+
+Every node is placed on the ring at virtual_nodes points and a key belongs to the first point at or after its hash.
+A user is then always routed to the same replica (so its cached trust score stays hot), and adding or removing a
+replica only moves the keys of the ring segments it owns. The ring is rebuilt and swapped in one assignment when a
+node is added or removed, lookups never take a lock.
+
+'''
+
+import bisect
+import hashlib
+import threading
+
+def ring_hash(value):
+    return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+class HashRing:
+    def __init__(self, nodes=(), virtual_nodes=100):
+        self.virtual_nodes = virtual_nodes
+        self._nodes = set()
+        self._lock = threading.Lock()
+        # sorted points of the ring and the node owning each point
+        self._ring = ((), ())
+        for node_id in nodes:
+            self.add_node(node_id)
+
+    @property
+    def nodes(self):
+        return set(self._nodes)
+
+    def __contains__(self, node_id):
+        return node_id in self._nodes
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def _rebuild(self):
+        points = sorted(
+            (ring_hash(f"{node_id}#{replica}"), node_id)
+            for node_id in self._nodes
+            for replica in range(self.virtual_nodes)
+        )
+        self._ring = (tuple(point for point, _ in points), tuple(node_id for _, node_id in points))
+
+    #add a node to the ring, returns False if it was already on it
+    def add_node(self, node_id):
+        with self._lock:
+            if node_id in self._nodes:
+                return False
+            self._nodes.add(node_id)
+            self._rebuild()
+            return True
+
+    #remove a node from the ring, its keys move to the next nodes of the ring
+    def remove_node(self, node_id):
+        with self._lock:
+            if node_id not in self._nodes:
+                return False
+            self._nodes.discard(node_id)
+            self._rebuild()
+            return True
+
+    #the node owning the key, None when the ring is empty
+    def get_node(self, key):
+        points, owners = self._ring
+        if not points:
+            return None
+        index = bisect.bisect_left(points, ring_hash(str(key)))
+        return owners[index % len(owners)]
+
+    #the distinct nodes in ring order starting at the owner of the key, used to fail over to the next replica
+    def get_nodes(self, key):
+        points, owners = self._ring
+        if not points:
+            return []
+        start = bisect.bisect_left(points, ring_hash(str(key)))
+        preference = []
+        for offset in range(len(owners)):
+            node_id = owners[(start + offset) % len(owners)]
+            if node_id not in preference:
+                preference.append(node_id)
+                if len(preference) == len(self._nodes):
+                    break
+        return preference
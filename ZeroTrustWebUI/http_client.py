@@ -0,0 +1,111 @@
+'''
+This module is the HTTP client shared by the outbound calls of the web UI (token revocation, the signing keys of the
+realm, the MAC vendor, public IP and location lookups).
+
+Every host gets its own requests session, so its connections are kept alive and reused by the following calls
+instead of paying the DNS lookup, TCP and TLS handshakes on every request. Every call has a timeout and a bounded
+number of retries, and its latency is recorded under the name of its endpoint.
+
+'''
+
+import collections
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from http_config import HTTP_POOL_SIZE, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_RETRIES, HTTP_RETRY_BACKOFF, HTTP_METRICS_WINDOW
+
+class EndpointMetrics:
+    def __init__(self, window):
+        self.calls = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.latencies = collections.deque(maxlen=window)
+
+    def record(self, seconds, failed):
+        self.calls += 1
+        self.total_seconds += seconds
+        self.latencies.append(seconds)
+        if failed:
+            self.errors += 1
+
+    def get_stats(self):
+        latencies = sorted(self.latencies)
+        def percentile(fraction):
+            return round(latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] * 1000, 3) if latencies else None
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'mean_ms': round(self.total_seconds / self.calls * 1000, 3) if self.calls else None,
+            'p50_ms': percentile(0.50),
+            'p95_ms': percentile(0.95),
+            'p99_ms': percentile(0.99)
+        }
+
+class HttpClient:
+    def __init__(self, pool_size=HTTP_POOL_SIZE, timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT), retries=HTTP_RETRIES,
+                 retry_backoff=HTTP_RETRY_BACKOFF, metrics_window=HTTP_METRICS_WINDOW):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.metrics_window = metrics_window
+        self._sessions = {}
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    #return the session of the host of the url, creating it with its connection pool on the first call
+    def get_session(self, url):
+        parts = urlsplit(url)
+        host = f"{parts.scheme}://{parts.netloc}"
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                retry = Retry(total=self.retries, backoff_factor=self.retry_backoff, status_forcelist=(502, 503, 504), raise_on_status=False)
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry)
+                session = requests.Session()
+                session.mount(host, adapter)
+                self._sessions[host] = session
+            return session
+
+    #send a request, endpoint names the call in the metrics (the path of the url by default)
+    def request(self, method, url, endpoint=None, timeout=None, **kwargs):
+        endpoint = endpoint or f"{method} {urlsplit(url).netloc}{urlsplit(url).path}"
+        session = self.get_session(url)
+        started = time.perf_counter()
+        failed = True
+        try:
+            response = session.request(method, url, timeout=timeout or self.timeout, **kwargs)
+            failed = response.status_code >= 500
+            return response
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                metrics = self._metrics.get(endpoint)
+                if metrics is None:
+                    metrics = self._metrics[endpoint] = EndpointMetrics(self.metrics_window)
+                metrics.record(elapsed, failed)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    #return the latency and error metrics of every endpoint
+    def get_metrics(self):
+        with self._lock:
+            return {endpoint: metrics.get_stats() for endpoint, metrics in self._metrics.items()}
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+# Client shared by the web UI
+http_client = HttpClient()
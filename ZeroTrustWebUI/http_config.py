@@ -0,0 +1,20 @@
+#This file contains the constants for the outbound HTTP calls of the web UI
+
+# http_config.py
+
+import os
+
+# Connections kept open per host by the shared HTTP client (http_client.py)
+HTTP_POOL_SIZE = int(os.environ.get('ZTA_HTTP_POOL_SIZE', 10))
+# Seconds to wait for a connection and for a response, a call can override them with timeout=
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('ZTA_HTTP_CONNECT_TIMEOUT', 3))
+HTTP_READ_TIMEOUT = float(os.environ.get('ZTA_HTTP_READ_TIMEOUT', 10))
+# Retries of a failed call (connection errors and 502/503/504 responses of idempotent requests), the delay between
+# two retries is HTTP_RETRY_BACKOFF * 2^(retry - 1) seconds
+HTTP_RETRIES = int(os.environ.get('ZTA_HTTP_RETRIES', 2))
+HTTP_RETRY_BACKOFF = float(os.environ.get('ZTA_HTTP_RETRY_BACKOFF', 0.2))
+# Latencies kept per endpoint for the percentiles of the metrics
+HTTP_METRICS_WINDOW = int(os.environ.get('ZTA_HTTP_METRICS_WINDOW', 1000))
+
+# Seconds the keycloak admin and openid clients wait for keycloak (python-keycloak defaults to 60)
+KEYCLOAK_TIMEOUT = float(os.environ.get('ZTA_KEYCLOAK_TIMEOUT', 10))
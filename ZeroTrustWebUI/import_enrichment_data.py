@@ -0,0 +1,90 @@
+'''
+Import step of the offline enrichment data (enrichment.py): converts the exports of a GeoIP city database and of the
+IEEE MAC address registries into data/ip_locations.csv and data/oui.csv.
+
+The GeoIP input is the DB-IP "IP to City Lite" csv (https://db-ip.com/db/download/ip-to-city-lite, CC BY 4.0), one
+range per line without a header: first address, last address, continent, country code, region, city, latitude,
+longitude. The MAC inputs are the registry exports of the IEEE (https://standards-oui.ieee.org/oui/oui.csv, mam/mam.csv
+and oui36/oui36.csv), their Assignment and Organization Name columns are kept.
+
+The files are written next to the running ones and moved in place, the web UI loads them again within a minute.
+
+    python3 import_enrichment_data.py --geoip dbip-city-lite-2024-06.csv --oui oui.csv mam.csv oui36.csv
+
+'''
+
+import argparse
+import csv
+import ipaddress
+import os
+
+try:
+    from .enrichment import IP_LOCATIONS_FILE, OUI_FILE, normalize_mac, OUI_PREFIX_LENGTHS
+except ImportError:
+    from enrichment import IP_LOCATIONS_FILE, OUI_FILE, normalize_mac, OUI_PREFIX_LENGTHS
+
+IP_LOCATIONS_HEADER = '''# IP ranges and their location used by the offline enrichment (enrichment.py): first address, last address,
+# country code, city. Imported from {source} by import_enrichment_data.py.
+'''
+
+OUI_HEADER = '''# MAC address prefixes (OUI, MA-M and MA-S assignments) and their vendor used by the offline enrichment
+# (enrichment.py). Imported from {source} by import_enrichment_data.py.
+'''
+
+#write the rows to a temporary file and move it over the data file, so the web UI never loads a partial file
+def write_data_file(file_path, header, fieldnames, rows):
+    temporary_path = f"{file_path}.tmp"
+    count = 0
+    with open(temporary_path, 'w', newline='', encoding='utf-8') as file:
+        file.write(header)
+        writer = csv.writer(file)
+        writer.writerow(fieldnames)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    os.replace(temporary_path, file_path)
+    return count
+
+#(start_ip, end_ip, country, city) of the ranges of a DB-IP city lite csv, the ranges without a country are skipped
+def read_geoip_ranges(file_path):
+    with open(file_path, 'r', newline='', encoding='utf-8') as file:
+        for row in csv.reader(file):
+            if len(row) < 6 or not row[3] or row[3] == 'ZZ':
+                continue
+            try:
+                ipaddress.ip_address(row[0])
+                ipaddress.ip_address(row[1])
+            except ValueError:
+                continue
+            yield row[0], row[1], row[3], row[5]
+
+#(assignment, vendor) of the IEEE registry exports, an assignment found in several files keeps its first vendor
+def read_oui_assignments(file_paths):
+    assignments = set()
+    for file_path in file_paths:
+        with open(file_path, 'r', newline='', encoding='utf-8') as file:
+            for row in csv.DictReader(file):
+                assignment = normalize_mac(row.get('Assignment') or '')
+                vendor = (row.get('Organization Name') or '').strip()
+                if len(assignment) in OUI_PREFIX_LENGTHS and vendor and assignment not in assignments:
+                    assignments.add(assignment)
+                    yield assignment, vendor
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import the GeoIP and MAC vendor data of the offline enrichment')
+    parser.add_argument('--geoip', help='DB-IP IP to City Lite csv')
+    parser.add_argument('--oui', nargs='+', help='IEEE registry csv exports (oui.csv, mam.csv, oui36.csv)')
+    parser.add_argument('--ip-locations-file', default=IP_LOCATIONS_FILE)
+    parser.add_argument('--oui-file', default=OUI_FILE)
+    args = parser.parse_args()
+    if not args.geoip and not args.oui:
+        parser.error('nothing to import, give --geoip and/or --oui')
+
+    if args.geoip:
+        count = write_data_file(args.ip_locations_file, IP_LOCATIONS_HEADER.format(source=os.path.basename(args.geoip)),
+                                ['start_ip', 'end_ip', 'country', 'city'], read_geoip_ranges(args.geoip))
+        print(f"Wrote {count} IP ranges to {args.ip_locations_file}")
+    if args.oui:
+        count = write_data_file(args.oui_file, OUI_HEADER.format(source=', '.join(os.path.basename(path) for path in args.oui)),
+                                ['Assignment', 'Organization Name'], read_oui_assignments(args.oui))
+        print(f"Wrote {count} MAC address prefixes to {args.oui_file}")
@@ -14,4 +14,12 @@ API_BASE_URL = f"{KEYCLOAK_SERVER_URL}/realms/{KEYCLOAK_REALM}/protocol/openid-c
 AUTHORIZATION_URL = f"{API_BASE_URL}/auth"
 REGISTRATION_URL = f"{API_BASE_URL}/registrations"
 TOKEN_URL = f"{API_BASE_URL}/token"
-REVOCATION_URL = f"{API_BASE_URL}/logout"
\ No newline at end of file
+REVOCATION_URL = f"{API_BASE_URL}/logout"
+CERTS_URL = f"{API_BASE_URL}/certs"
+ISSUER = f"{KEYCLOAK_SERVER_URL.rstrip('/')}/realms/{KEYCLOAK_REALM}" #iss claim of the tokens of the realm
+
+# Local validation of the access tokens (token_verification.py)
+JWKS_CACHE_TTL = 300 #seconds the signing keys of the realm are cached
+JWKS_MIN_REFRESH_INTERVAL = 10 #seconds between two fetches of the keys for unknown keys, and before retrying a failed fetch
+TOKEN_NEGATIVE_CACHE_TTL = 30 #seconds a token that failed validation is rejected without checking it again
+TOKEN_CLOCK_LEEWAY = 30 #seconds of clock skew allowed on exp and nbf
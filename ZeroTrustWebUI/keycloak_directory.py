@@ -0,0 +1,205 @@
+'''
+This module keeps an in-process copy of the keycloak users of the realm and of the members of the client roles, so
+the web UI does not call the keycloak admin API on every request.
+
+The users are indexed by ID and by email, and the members of every role of the client by role name. The directory is
+loaded with paginated calls (warm-up) and loaded again once its TTL expired. Between two loads, the users changed in
+keycloak are reloaded one by one from the admin events of the realm (user created, updated or deleted, role mapping
+changed) and from the user events of the event sync (registration, profile or email update), so a change shows up
+without waiting for the TTL. Admin events must be enabled in the realm settings for the first part.
+
+'''
+
+import threading
+import time
+from datetime import datetime, timezone
+
+from keycloak.exceptions import KeycloakError
+
+# User events of the event sync after which the user is loaded again
+USER_UPDATE_EVENTS = ('REGISTER', 'UPDATE_PROFILE', 'UPDATE_EMAIL', 'VERIFY_EMAIL', 'UPDATE_TOTP', 'REMOVE_TOTP')
+# Admin events that change a user or its role mappings
+ADMIN_EVENT_RESOURCES = ('USER', 'CLIENT_ROLE_MAPPING', 'REALM_ROLE_MAPPING', 'GROUP_MEMBERSHIP')
+
+class KeycloakDirectory:
+    def __init__(self, keycloak_admin, client_id, ttl=300, page_size=100, min_refresh_interval=10):
+        self.keycloak_admin = keycloak_admin
+        # client id of the client whose roles are indexed (e.g. ZeroTrustPlatform), not its internal id
+        self.client_id = client_id
+        self.ttl = ttl
+        self.page_size = page_size
+        self.min_refresh_interval = min_refresh_interval
+        self._client_uuid = None
+        self._users_by_id = {}
+        self._user_ids_by_email = {}
+        self._role_members = {}
+        self._loaded_at = None
+        self._admin_events_from = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self.refreshes = 0
+        self.user_reloads = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get_client_uuid(self):
+        if self._client_uuid is None:
+            self._client_uuid = self.keycloak_admin.get_client_id(self.client_id)
+        return self._client_uuid
+
+    #load every user page by page, and the members of every role of the client
+    def refresh(self):
+        with self._refresh_lock:
+            started = time.time()
+            users = []
+            first = 0
+            while True:
+                page = self.keycloak_admin.get_users({'first': first, 'max': self.page_size})
+                users.extend(page)
+                if len(page) < self.page_size:
+                    break
+                first += self.page_size
+
+            client_uuid = self.get_client_uuid()
+            role_members = {}
+            for role in self.keycloak_admin.get_client_roles(client_uuid):
+                members = self.keycloak_admin.get_client_role_members(client_uuid, role['name'])
+                role_members[role['name']] = [member['id'] for member in members]
+
+            with self._lock:
+                self._users_by_id = {user['id']: user for user in users}
+                self._user_ids_by_email = {user['email'].lower(): user['id'] for user in users if user.get('email')}
+                self._role_members = role_members
+                self._loaded_at = time.monotonic()
+                if self._admin_events_from is None:
+                    self._admin_events_from = int(started * 1000)
+                self.refreshes += 1
+
+    #load the directory when it was never loaded or its TTL expired
+    def ensure_fresh(self):
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl:
+            return
+        self.refresh_or_keep()
+
+    #load the directory again, a failed reload keeps serving the loaded copy (it raises when nothing was loaded yet)
+    def refresh_or_keep(self):
+        try:
+            self.refresh()
+        except KeycloakError as e:
+            if self._loaded_at is None:
+                raise
+            print(f"Failed to refresh the keycloak directory, serving the cached users: {e}")
+
+    #load the given users again, with their client role mappings (users that no longer exist are removed)
+    def reload_users(self, user_ids):
+        client_uuid = self.get_client_uuid()
+        for user_id in set(user_ids):
+            try:
+                user = self.keycloak_admin.get_user(user_id)
+                roles = {role['name'] for role in self.keycloak_admin.get_client_roles_of_user(user_id, client_uuid)}
+            except KeycloakError as e:
+                if getattr(e, 'response_code', None) != 404:
+                    raise
+                user, roles = None, set()
+
+            with self._lock:
+                previous = self._users_by_id.pop(user_id, None)
+                if previous is not None and previous.get('email'):
+                    self._user_ids_by_email.pop(previous['email'].lower(), None)
+                if user is not None:
+                    self._users_by_id[user_id] = user
+                    if user.get('email'):
+                        self._user_ids_by_email[user['email'].lower()] = user_id
+                for role, members in self._role_members.items():
+                    if role in roles and user_id not in members:
+                        members.append(user_id)
+                    elif role not in roles and user_id in members:
+                        members.remove(user_id)
+                self.user_reloads += 1
+
+    #reload the users named by the user events of the event sync (clean_keycloak_event records)
+    def process_user_events(self, events):
+        user_ids = [event['user_id'] for event in events if event.get('type') in USER_UPDATE_EVENTS and event.get('user_id')]
+        if user_ids and self._loaded_at is not None:
+            self.reload_users(user_ids)
+
+    #reload the users changed by the admin events since the last sync
+    def sync_admin_events(self):
+        if self._loaded_at is None or self._admin_events_from is None:
+            return
+        # keycloak filters the events by day (UTC dates), the events of that day that were already applied are skipped
+        date_from = datetime.fromtimestamp(self._admin_events_from / 1000, tz=timezone.utc).strftime('%Y-%m-%d')
+        query = {'dateFrom': date_from, 'max': self.page_size}
+        user_ids = []
+        latest = self._admin_events_from
+        first = 0
+        applied = False
+        # the events come newest first, the pages are read until the first event that was already applied
+        while not applied:
+            page = self.keycloak_admin.get_admin_events(dict(query, first=first))
+            for event in page:
+                if event.get('time', 0) <= self._admin_events_from:
+                    applied = True
+                    break
+                latest = max(latest, event['time'])
+                if event.get('resourceType') not in ADMIN_EVENT_RESOURCES:
+                    continue
+                # resourcePath is users/<user id>[/role-mappings/...]
+                path = event.get('resourcePath', '').split('/')
+                if len(path) >= 2 and path[0] == 'users':
+                    user_ids.append(path[1])
+            if len(page) < self.page_size:
+                break
+            first += self.page_size
+
+        if user_ids:
+            self.reload_users(user_ids)
+        self._admin_events_from = latest
+
+    #return every user of the realm as returned by the admin API
+    def get_users(self):
+        self.ensure_fresh()
+        with self._lock:
+            return list(self._users_by_id.values())
+
+    def get_user(self, user_id):
+        self.ensure_fresh()
+        with self._lock:
+            return self._users_by_id.get(user_id)
+
+    #return {email: user ID} for a batch of emails, the emails that are not in the directory are mapped to None
+    #a miss reloads the directory once for the whole batch (e.g. a user created since the last load), unless it was
+    #loaded less than min_refresh_interval seconds ago
+    def get_user_ids_by_emails(self, email_addresses):
+        self.ensure_fresh()
+        with self._lock:
+            user_ids = {email: self._user_ids_by_email.get(email.lower()) for email in email_addresses}
+        missing = [email for email, user_id in user_ids.items() if user_id is None]
+        self.hits += len(user_ids) - len(missing)
+        self.misses += len(missing)
+        if missing and time.monotonic() - self._loaded_at >= self.min_refresh_interval:
+            self.refresh_or_keep()
+            with self._lock:
+                user_ids.update({email: self._user_ids_by_email.get(email.lower()) for email in missing})
+        return user_ids
+
+    def get_user_id_by_email(self, email_address):
+        return self.get_user_ids_by_emails([email_address])[email_address]
+
+    #return the emails of the members of a client role, in the order keycloak returned them
+    def get_role_member_emails(self, role_name):
+        self.ensure_fresh()
+        with self._lock:
+            return [self._users_by_id.get(user_id, {}).get('email', 'N/A') for user_id in self._role_members.get(role_name, [])]
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'users': len(self._users_by_id),
+                'roles': {role: len(members) for role, members in self._role_members.items()},
+                'age': time.monotonic() - self._loaded_at if self._loaded_at is not None else None,
+                'refreshes': self.refreshes,
+                'user_reloads': self.user_reloads,
+                'hits': self.hits,
+                'misses': self.misses
+            }
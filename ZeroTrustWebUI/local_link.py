@@ -0,0 +1,78 @@
+'''
+In-memory links between nodes running in the same process (see AllInOne.py).
+
+A link has one LocalConnection at each node. It stands in for the socket connection of the transport (p2pnetwork or
+asyncio): it is registered in nodes_inbound/nodes_outbound and passed to the same hooks. A message sent on one end
+is put on the queue of the other end, whose thread calls node_message of its node with the envelope itself, without
+encoding it or a socket hop. The nodes keep their listening sockets for the nodes of other processes (e.g. the web UI).
+
+The envelopes are passed by reference, a node must not change a message after sending it.
+
+'''
+
+import queue
+import threading
+
+class LocalConnection(threading.Thread):
+    def __init__(self, main_node, id, host, port):
+        super(LocalConnection, self).__init__(name=f"local-link-{main_node.id}-{id}", daemon=True)
+        self.main_node = main_node
+        # the node at the other end of the link
+        self.id = str(id)
+        self.host = host
+        self.port = port
+        # no socket, the transports check for it before probing a connection
+        self.sock = None
+        self.remote = None
+        self.inbox = queue.SimpleQueue()
+        self.terminate_flag = threading.Event()
+        self.closed = False
+
+    #hand the message to the node at the other end of the link
+    def send(self, data, *args, **kwargs):
+        if self.closed or self.remote is None:
+            self.main_node.debug_print(f"LocalConnection: link with {self.id} is closed, message dropped")
+            return
+        self.remote.inbox.put(data)
+
+    def run(self):
+        while True:
+            data = self.inbox.get()
+            if data is None:
+                break
+            try:
+                self.main_node.node_message(self, data)
+            except Exception as e:
+                print(f"LocalConnection: failed to handle a message from {self.id}: {type(e).__name__}: {e}")
+        self.main_node.node_disconnected(self)
+
+    #close both ends of the link
+    def stop(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.terminate_flag.set()
+        self.inbox.put(None)
+        if self.remote is not None:
+            self.remote.stop()
+
+    # the asyncio transport closes its connections with close()
+    close = stop
+
+    def __str__(self):
+        return 'LocalConnection: {}:{} <-> {}:{} ({})'.format(self.main_node.host, self.main_node.port, self.host, self.port, self.id)
+
+#link two nodes of this process, node_a sees the link as an outbound connection and node_b as an inbound one
+def link_nodes(node_a, node_b):
+    end_a = LocalConnection(node_a, node_b.id, node_b.host, node_b.port)
+    end_b = LocalConnection(node_b, node_a.id, node_a.host, node_a.port)
+    end_a.remote = end_b
+    end_b.remote = end_a
+    end_a.start()
+    end_b.start()
+
+    node_a.nodes_outbound.append(end_a)
+    node_a.outbound_node_connected(end_a)
+    node_b.nodes_inbound.append(end_b)
+    node_b.inbound_node_connected(end_b)
+    return end_a, end_b
@@ -0,0 +1,132 @@
+'''
+Encoding of the messages exchanged by the nodes over the asyncio transport.
+
+The payload of every frame starts with a flags byte: the low bits hold the codec and FLAG_ZLIB marks a payload that
+was compressed with zlib (only payloads larger than the compression threshold are compressed, and only when that
+makes them smaller). The 'msgpack' codec replaces the known field names (FIELD_NAMES) by their index in the table,
+so the int keys of a msgpack map are always field indexes: an int key of a message is sent as a string, as the 'json'
+codec does.
+The 'json' codec is always available and is used with peers that do not support msgpack.
+
+Peers that do not negotiate a codec in their hello frame (older versions of the transport) get plain JSON frames
+without the flags byte.
+
+'''
+
+import json
+import zlib
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+CODEC_JSON = 'json'
+CODEC_MSGPACK = 'msgpack'
+
+CODEC_IDS = {CODEC_JSON: 0, CODEC_MSGPACK: 1}
+CODEC_NAMES = {codec_id: codec for codec, codec_id in CODEC_IDS.items()}
+CODEC_MASK = 0x0f
+FLAG_ZLIB = 0x80
+
+# Field names sent as their index in this table by the msgpack codec. Peers only use the table when they have the
+# same FIELD_TABLE_VERSION, so names are only ever appended and the version is increased when the table changes.
+FIELD_TABLE_VERSION = 2
+FIELD_NAMES = (
+    'senderID', 'requestID', 'messageContent',
+    'ID', 'user_id', 'intent', 'request_id',
+    'resource_requested', 'access_request_time', 'public_ip_address', 'location', 'device_type', 'browser',
+    'device_mac', 'device_vendor', 'device_OS',
+    'user_trust_score', 'policy_version', 'access_decision',
+    # version 2: the signal snapshot of the trust engine
+    'signals', 'version', 'user_role', 'sign_in_risk'
+)
+FIELD_IDS = {name: field_id for field_id, name in enumerate(FIELD_NAMES)}
+
+# Compact json (no spaces after the separators), created once as json.dumps builds an encoder for every call with options
+JSON_ENCODER = json.JSONEncoder(separators=(',', ':'))
+
+#the codecs this process can encode and decode, in order of preference
+def supported_codecs():
+    return [CODEC_MSGPACK, CODEC_JSON] if msgpack is not None else [CODEC_JSON]
+
+#choose the codec used with a peer from the hello frame it sent, None for peers that do not negotiate a codec
+def negotiate_codec(hello, preferred_codec=CODEC_MSGPACK):
+    peer_codecs = hello.get('codecs')
+    if peer_codecs is None:
+        return None
+    if hello.get('fields') != FIELD_TABLE_VERSION:
+        peer_codecs = [codec for codec in peer_codecs if codec != CODEC_MSGPACK]
+    local_codecs = supported_codecs()
+    if preferred_codec in local_codecs and preferred_codec in peer_codecs:
+        return preferred_codec
+    for codec in local_codecs:
+        if codec in peer_codecs:
+            return codec
+    return CODEC_JSON
+
+# Only these values are walked by intern_fields and restore_fields, other values are copied as they are
+CONTAINER_TYPES = (dict, list)
+
+#replace the known field names of the (nested) dicts by their index in FIELD_NAMES, the int keys are sent as strings
+def intern_fields(data):
+    if type(data) is dict:
+        return {intern_key(key): intern_fields(value) if type(value) in CONTAINER_TYPES else value for key, value in data.items()}
+    return [intern_fields(value) if type(value) in CONTAINER_TYPES else value for value in data]
+
+def intern_key(key):
+    if type(key) is int:
+        return str(key)
+    return FIELD_IDS.get(key, key)
+
+def restore_fields(data):
+    if type(data) is dict:
+        return {restore_key(key): restore_fields(value) if type(value) in CONTAINER_TYPES else value for key, value in data.items()}
+    return [restore_fields(value) if type(value) in CONTAINER_TYPES else value for value in data]
+
+def restore_key(key):
+    if type(key) is not int:
+        return key
+    if not 0 <= key < len(FIELD_NAMES):
+        raise ValueError(f"Unknown field index {key}")
+    return FIELD_NAMES[key]
+
+class MessageCodec:
+    def __init__(self, codec=CODEC_JSON, compression_threshold=1024, compression_level=1):
+        if codec == CODEC_MSGPACK and msgpack is None:
+            raise ValueError("The msgpack codec requires the msgpack package")
+        self.codec = codec
+        self.codec_id = CODEC_IDS[codec]
+        self.compression_threshold = compression_threshold
+        self.compression_level = compression_level
+
+    def encode(self, data):
+        if self.codec == CODEC_MSGPACK:
+            body = msgpack.packb(intern_fields(data) if type(data) in CONTAINER_TYPES else data, use_bin_type=True)
+        else:
+            body = JSON_ENCODER.encode(data).encode('utf-8')
+
+        flags = self.codec_id
+        if self.compression_threshold is not None and len(body) > self.compression_threshold:
+            compressed_body = zlib.compress(body, self.compression_level)
+            if len(compressed_body) < len(body):
+                body = compressed_body
+                flags |= FLAG_ZLIB
+        return bytes((flags,)) + body
+
+    #decode a payload of any codec, the flags byte tells how it was encoded
+    @staticmethod
+    def decode(payload):
+        flags = payload[0]
+        body = payload[1:]
+        if flags & FLAG_ZLIB:
+            body = zlib.decompress(body)
+        codec = CODEC_NAMES.get(flags & CODEC_MASK)
+        if codec == CODEC_MSGPACK:
+            if msgpack is None:
+                raise ValueError("Received a msgpack message but the msgpack package is not installed")
+            data = msgpack.unpackb(body, raw=False, strict_map_key=False)
+            return restore_fields(data) if type(data) in CONTAINER_TYPES else data
+        if codec == CODEC_JSON:
+            return json.loads(body)
+        raise ValueError(f"Unknown message codec {flags & CODEC_MASK}")
@@ -0,0 +1,41 @@
+#This file contains the constants for the peer to peer network of the nodes
+
+# network_config.py
+
+import os
+
+# 'p2pnetwork' runs the nodes on p2pnetwork (a thread per connection), 'asyncio' runs them on the asyncio
+# transport (one event loop per node). All the nodes of the network must use the same transport.
+NODE_TRANSPORT = os.environ.get('ZTA_NODE_TRANSPORT', 'p2pnetwork')
+
+# Codec preferred for the messages of the asyncio transport ('msgpack' or 'json'), the codec of a connection is
+# negotiated with the other node and falls back to json when msgpack is not installed on both nodes
+MESSAGE_CODEC = os.environ.get('ZTA_MESSAGE_CODEC', 'msgpack')
+# Messages larger than this number of bytes are compressed with zlib
+MESSAGE_COMPRESSION_THRESHOLD = int(os.environ.get('ZTA_MESSAGE_COMPRESSION_THRESHOLD', 1024))
+
+# Micro-batching of the access requests: the access proxy sends the requests that arrive within
+# REQUEST_BATCH_DELAY seconds (at most REQUEST_BATCH_SIZE of them) to the trust engine in one message
+REQUEST_BATCHING = os.environ.get('ZTA_REQUEST_BATCHING', '0') == '1'
+REQUEST_BATCH_SIZE = int(os.environ.get('ZTA_REQUEST_BATCH_SIZE', 64))
+REQUEST_BATCH_DELAY = float(os.environ.get('ZTA_REQUEST_BATCH_DELAY', 0.005))
+
+# Workers handling the messages of a node (one per core by default) and the number of messages each worker can
+# queue before the node answers with a backpressure message asking the sender to retry after
+# BACKPRESSURE_RETRY_AFTER seconds
+WORKER_POOL_SIZE = int(os.environ.get('ZTA_WORKER_POOL_SIZE', os.cpu_count() or 1))
+WORKER_QUEUE_LIMIT = int(os.environ.get('ZTA_WORKER_QUEUE_LIMIT', 1000))
+BACKPRESSURE_RETRY_AFTER = float(os.environ.get('ZTA_BACKPRESSURE_RETRY_AFTER', 1))
+
+# The nodes send a heartbeat to their peers every HEARTBEAT_INTERVAL seconds to measure the round trip time, a peer
+# that does not answer HEARTBEAT_MISSED_LIMIT heartbeats in a row is disconnected
+HEARTBEAT_INTERVAL = float(os.environ.get('ZTA_HEARTBEAT_INTERVAL', 5))
+HEARTBEAT_MISSED_LIMIT = int(os.environ.get('ZTA_HEARTBEAT_MISSED_LIMIT', 3))
+# A peer that disconnected is dialed again after RECONNECT_BASE_DELAY seconds, the delay doubles after every failed
+# attempt up to RECONNECT_MAX_DELAY seconds
+RECONNECT_BASE_DELAY = float(os.environ.get('ZTA_RECONNECT_BASE_DELAY', 0.5))
+RECONNECT_MAX_DELAY = float(os.environ.get('ZTA_RECONNECT_MAX_DELAY', 30))
+# Messages kept for a peer while it is disconnected, they are sent when it connects again unless they were queued more
+# than PEER_QUEUE_TTL seconds before (the web UI gives up on an access decision after ACCESS_DECISION_TIMEOUT, 10s)
+PEER_QUEUE_LIMIT = int(os.environ.get('ZTA_PEER_QUEUE_LIMIT', 1000))
+PEER_QUEUE_TTL = float(os.environ.get('ZTA_PEER_QUEUE_TTL', 10))
@@ -0,0 +1,176 @@
+'''
+Registry of the peers of a node, keyed by node id.
+
+The connections of a peer (inbound and/or outbound) are found with one dictionary lookup instead of a scan of all the
+connections of the node. The registry also keeps the health of every peer: the round trip time measured with the
+heartbeats, the heartbeats that were not answered, and the backoff before the next reconnect attempt. Messages for a
+peer that is not connected are kept in a bounded outbound queue and are sent when the peer connects again, the
+messages that were queued longer than the queue TTL are dropped instead.
+
+'''
+
+import collections
+import random
+import threading
+import time
+
+class PeerState:
+    def __init__(self, node_id, queue_limit):
+        self.node_id = node_id
+        self.connections = []
+        # round trip time of the last heartbeat and its moving average, in seconds
+        self.rtt = None
+        self.rtt_average = None
+        self.last_seen = None
+        self.missed_heartbeats = 0
+        self.reconnect_attempts = 0
+        self.next_reconnect = 0.0
+        # (queued_at, message), the oldest message is dropped when the queue is full, it is the most likely to have
+        # timed out already
+        self.outbound = collections.deque(maxlen=queue_limit)
+        self.dropped = 0
+        self.expired = 0
+
+class PeerRegistry:
+    def __init__(self, queue_limit=1000, reconnect_base_delay=0.5, reconnect_max_delay=30, rtt_smoothing=0.2, queue_ttl=None):
+        self.queue_limit = queue_limit
+        # seconds a queued message is kept, None keeps it until the peer connects
+        self.queue_ttl = queue_ttl
+        self.reconnect_base_delay = reconnect_base_delay
+        self.reconnect_max_delay = reconnect_max_delay
+        self.rtt_smoothing = rtt_smoothing
+        self._peers = {}
+        self._lock = threading.Lock()
+
+    def _peer(self, node_id):
+        peer = self._peers.get(node_id)
+        if peer is None:
+            peer = self._peers[node_id] = PeerState(node_id, self.queue_limit)
+        return peer
+
+    #register a connection with a peer, returns True when it is the first connection with that peer
+    def add_connection(self, node):
+        with self._lock:
+            peer = self._peer(node.id)
+            if node not in peer.connections:
+                peer.connections.append(node)
+            peer.last_seen = time.monotonic()
+            peer.missed_heartbeats = 0
+            peer.reconnect_attempts = 0
+            peer.next_reconnect = 0.0
+            return len(peer.connections) == 1
+
+    #unregister a connection with a peer, returns True when no connection with that peer is left
+    def remove_connection(self, node):
+        with self._lock:
+            peer = self._peers.get(node.id)
+            if peer is None:
+                return True
+            if node in peer.connections:
+                peer.connections.remove(node)
+            return not peer.connections
+
+    #the connections with the peer, the most recent one first
+    def get_connections(self, node_id):
+        peer = self._peers.get(node_id)
+        if peer is None:
+            return ()
+        return tuple(reversed(peer.connections))
+
+    def is_connected(self, node_id):
+        peer = self._peers.get(node_id)
+        return peer is not None and bool(peer.connections)
+
+    def connected_peers(self):
+        with self._lock:
+            return [node_id for node_id, peer in self._peers.items() if peer.connections]
+
+    #any message of a peer shows that it is alive
+    def mark_seen(self, node_id):
+        peer = self._peers.get(node_id)
+        if peer is not None:
+            peer.last_seen = time.monotonic()
+            peer.missed_heartbeats = 0
+
+    #count a heartbeat sent to the peer, returns the number of heartbeats in a row it did not answer
+    def heartbeat_sent(self, node_id):
+        with self._lock:
+            peer = self._peer(node_id)
+            missed = peer.missed_heartbeats
+            peer.missed_heartbeats += 1
+            return missed
+
+    def record_rtt(self, node_id, rtt):
+        with self._lock:
+            peer = self._peer(node_id)
+            peer.rtt = rtt
+            if peer.rtt_average is None:
+                peer.rtt_average = rtt
+            else:
+                peer.rtt_average += self.rtt_smoothing * (rtt - peer.rtt_average)
+            peer.last_seen = time.monotonic()
+            peer.missed_heartbeats = 0
+
+    #True when the peer is not connected and its backoff has passed
+    def reconnect_due(self, node_id, now=None):
+        with self._lock:
+            peer = self._peer(node_id)
+            return not peer.connections and (now or time.monotonic()) >= peer.next_reconnect
+
+    #schedule the next reconnect attempt, the delay doubles after every failed attempt up to reconnect_max_delay
+    def reconnect_failed(self, node_id):
+        with self._lock:
+            peer = self._peer(node_id)
+            delay = min(self.reconnect_base_delay * 2 ** peer.reconnect_attempts, self.reconnect_max_delay)
+            # jitter so the nodes that lost the same peer do not all dial it at the same time
+            delay *= random.uniform(0.5, 1.0)
+            peer.reconnect_attempts += 1
+            peer.next_reconnect = time.monotonic() + delay
+            return delay
+
+    #queue a message until the peer connects again, returns False when an older message had to be dropped for it
+    def enqueue(self, node_id, message):
+        with self._lock:
+            peer = self._peer(node_id)
+            full = len(peer.outbound) == peer.outbound.maxlen
+            if full:
+                peer.dropped += 1
+            peer.outbound.append((time.monotonic(), message))
+            return not full
+
+    #take the queued (queued_at, message) entries of the peer in the order they were queued, the expired ones are dropped
+    def drain(self, node_id):
+        with self._lock:
+            peer = self._peers.get(node_id)
+            if peer is None:
+                return []
+            entries = list(peer.outbound)
+            peer.outbound.clear()
+            if self.queue_ttl is not None:
+                expires_before = time.monotonic() - self.queue_ttl
+                fresh_entries = [entry for entry in entries if entry[0] >= expires_before]
+                peer.expired += len(entries) - len(fresh_entries)
+                entries = fresh_entries
+            return entries
+
+    #put back entries (from drain) that could not be sent, in front of the messages queued in the meantime
+    def requeue(self, node_id, entries):
+        with self._lock:
+            peer = self._peer(node_id)
+            peer.outbound.extendleft(reversed(entries[-self.queue_limit:]))
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                node_id: {
+                    'connected': bool(peer.connections),
+                    'rtt_ms': None if peer.rtt is None else round(peer.rtt * 1000, 3),
+                    'rtt_average_ms': None if peer.rtt_average is None else round(peer.rtt_average * 1000, 3),
+                    'missed_heartbeats': peer.missed_heartbeats,
+                    'reconnect_attempts': peer.reconnect_attempts,
+                    'queued': len(peer.outbound),
+                    'dropped': peer.dropped,
+                    'expired': peer.expired
+                }
+                for node_id, peer in self._peers.items()
+            }
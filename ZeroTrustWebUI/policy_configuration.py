@@ -0,0 +1,99 @@
+'''
+This module compiles policyConfiguration.yml into an immutable policy object shared by the trust algorithm and the
+policy engine.
+
+The yaml values are converted once (thresholds and weights to floats, the night period to time objects and the
+location lists to frozensets). The file is checked with a stat() call whenever the policy is requested and is
+recompiled when its mtime or size changes, the new policy then replaces the old one in a single assignment so
+readers never need a lock and never see a half updated policy. A file that fails to compile (e.g. while it is
+being written) keeps the previous policy in place.
+
+'''
+
+import hashlib
+import os
+import threading
+from dataclasses import dataclass
+from datetime import datetime, time
+
+import yaml
+
+# policyConfiguration.yml lives in the root directory of the project, next to the engines
+POLICY_FILE_PATH = os.environ.get(
+    'ZTA_POLICY_FILE',
+    os.path.join(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)), 'policyConfiguration.yml')
+)
+
+#the version of a policy is a digest of the file content, so every process loading the same file agrees on it
+def policy_version(content):
+    return hashlib.sha256(content).hexdigest()[:12]
+
+@dataclass(frozen=True)
+class CompiledPolicy:
+    version: str
+    admin_threshold: float
+    approver_threshold: float
+    security_viewer_threshold: float
+    sign_in_risk_threshold: float
+    high_risk_locations: frozenset
+    medium_risk_locations: frozenset
+    low_risk_locations: frozenset
+    night_start_time: time
+    night_end_time: time
+
+def compile_policy(policy_configurations, version):
+    return CompiledPolicy(
+        version=version,
+        admin_threshold=float(policy_configurations['adminThreshold']),
+        approver_threshold=float(policy_configurations['approverThreshold']),
+        security_viewer_threshold=float(policy_configurations['securityViewerThreshold']),
+        sign_in_risk_threshold=float(policy_configurations['signInRiskThreshold']),
+        high_risk_locations=frozenset(policy_configurations.get('highRiskLocations') or []),
+        medium_risk_locations=frozenset(policy_configurations.get('mediumRiskLocations') or []),
+        low_risk_locations=frozenset(policy_configurations.get('lowRiskLocations') or []),
+        night_start_time=datetime.strptime(policy_configurations.get('periodStartInput', '00:00:00'), '%H:%M:%S').time(),
+        night_end_time=datetime.strptime(policy_configurations.get('periodEndInput', '06:00:00'), '%H:%M:%S').time()
+    )
+
+class PolicyProvider:
+    def __init__(self, file_path=POLICY_FILE_PATH):
+        self.file_path = file_path
+        self._policy = None
+        self._stamp = None
+        self._reload_lock = threading.Lock()
+
+    @staticmethod
+    def _file_stamp(file_path):
+        stat = os.stat(file_path)
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def _reload(self, stamp):
+        with self._reload_lock:
+            if stamp == self._stamp:
+                return
+            try:
+                with open(self.file_path, 'rb') as file:
+                    content = file.read()
+                policy_configurations = yaml.safe_load(content) or {}
+                policy = compile_policy(policy_configurations, policy_version(content))
+            except (yaml.YAMLError, KeyError, TypeError, ValueError) as e:
+                if self._policy is None:
+                    raise
+                print(f"Failed to reload {self.file_path}, keeping policy version {self._policy.version}: {e}")
+                return
+            self._policy = policy
+            self._stamp = stamp
+            print(f"Loaded policy version {policy.version} from {self.file_path}")
+
+    #return the current policy, recompiling it first if the file changed
+    def current(self):
+        stamp = self._file_stamp(self.file_path)
+        if stamp != self._stamp:
+            self._reload(stamp)
+        return self._policy
+
+# Policy shared by the trust algorithm and the policy engine of this process
+policy_provider = PolicyProvider()
+
+def current_policy():
+    return policy_provider.current()
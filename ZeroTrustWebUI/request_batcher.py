@@ -0,0 +1,60 @@
+'''
+Micro-batching of the access requests handled by the access proxy.
+
+Requests are queued by the message handlers and a single flusher thread hands them over in batches: a batch is
+flushed when it holds max_batch_size requests or when max_batch_delay seconds passed since its first request,
+whichever comes first. Under a burst of logins the trust engine and policy engine then handle one message per batch
+instead of one message per request, while a lone request waits at most max_batch_delay.
+
+'''
+
+import queue
+import threading
+import time
+
+class RequestBatcher:
+    def __init__(self, flush, max_batch_size=64, max_batch_delay=0.005, name='request-batcher'):
+        self.flush = flush
+        self.max_batch_size = max_batch_size
+        self.max_batch_delay = max_batch_delay
+        self._queue = queue.Queue()
+        self._flusher = threading.Thread(target=self._flush_loop, name=name, daemon=True)
+        self._flusher.start()
+
+    #queue a request, it is passed to flush with the other requests of its batch
+    def add(self, request):
+        self._queue.put(request)
+
+    def _flush_loop(self):
+        while True:
+            request = self._queue.get()
+            if request is None:
+                break
+            batch = [request]
+            stop = False
+
+            # collect the requests that arrive within the batch window of the first one
+            deadline = time.monotonic() + self.max_batch_delay
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if request is None:
+                    stop = True
+                    break
+                batch.append(request)
+
+            try:
+                self.flush(batch)
+            except Exception as e:
+                print(f"Failed to flush a batch of {len(batch)} requests: {type(e).__name__}: {e}")
+
+            if stop:
+                break
+
+    #flush the queued requests and stop the flusher thread
+    def close(self):
+        self._queue.put(None)
+        self._flusher.join()
@@ -0,0 +1,86 @@
+'''
+This module runs the trust signal ingestion jobs (keycloak events, auth data, user identity data) in a background
+thread so that they are kept off the request path of the web UI.
+
+The jobs run one after the other on a fixed interval, or as soon as trigger() is called (e.g. after a login event).
+The freshness of every dataset (last attempt, last success, duration and last error) can be read at any time.
+
+'''
+
+import threading
+import time
+
+class SignalIngestionService:
+    def __init__(self, interval=30):
+        self.interval = interval
+        self._jobs = []
+        self._freshness = {}
+        self._freshness_lock = threading.Lock()
+        self._trigger_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    #register a job, jobs run in the order they were added
+    def add_job(self, name, job):
+        self._jobs.append((name, job))
+        self._freshness[name] = {
+            'last_attempt': None,
+            'last_success': None,
+            'last_duration': None,
+            'last_error': None,
+            'runs': 0
+        }
+
+    #start the background thread, calling it again once started does nothing
+    def start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='signal-ingestion', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._trigger_event.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    #ask the background thread to run the jobs now instead of waiting for the next interval
+    def trigger(self):
+        self._trigger_event.set()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            # cleared before the run, so a trigger() during the run makes the jobs run again right after it
+            self._trigger_event.clear()
+            self.run_once()
+            self._trigger_event.wait(self.interval)
+
+    #run every job once, a failing job is recorded and does not stop the others
+    def run_once(self):
+        for name, job in self._jobs:
+            started = time.time()
+            error = None
+            try:
+                job()
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                print(f"Signal ingestion job '{name}' failed: {error}")
+
+            with self._freshness_lock:
+                freshness = self._freshness[name]
+                freshness['last_attempt'] = started
+                freshness['last_duration'] = time.time() - started
+                freshness['last_error'] = error
+                freshness['runs'] += 1
+                if error is None:
+                    freshness['last_success'] = started
+
+    #return how fresh each dataset is, including the age in seconds of the last successful run
+    def get_freshness(self):
+        now = time.time()
+        with self._freshness_lock:
+            freshness = {name: dict(values) for name, values in self._freshness.items()}
+        for values in freshness.values():
+            values['age'] = now - values['last_success'] if values['last_success'] is not None else None
+        return freshness
@@ -0,0 +1,271 @@
+'''
+This module implements an append-only journal for trust signal records stored as JSON Lines (one record per line).
+
+A single writer thread per journal drains the queued records and writes them in batches, calling fsync once per
+batch (group commit), so every append costs O(1) instead of a full rewrite of the json file. IDs are allocated
+in memory from the last ID found in the journal when it is opened, so only one process can write to a journal: it
+holds an exclusive lock (flock) on the file while the journal is open, and opening it in a second process raises
+JournalError instead of handing out the same IDs twice (see the jsonl backend note in topology.yml).
+
+When a journal is opened, a torn or corrupt tail left behind by a crash is truncated back to the last
+complete record.
+
+A record that cannot be serialized fails only the append it belongs to. A failed write or fsync (disk full, I/O
+error) fails every append of the batch and the journal: the file may end with a partial batch, so the appends that
+follow raise JournalError right away instead of writing after it. The journal is opened again (and its tail
+recovered) by the next process.
+
+'''
+
+import json
+import os
+import queue
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    # no flock on Windows, the single writer is not enforced there
+    fcntl = None
+
+# Size of the blocks read backwards from the end of the file when looking for the last record
+TAIL_BLOCK_SIZE = 64 * 1024
+# Seconds an append waits for its batch to be written before it raises JournalError
+COMMIT_TIMEOUT = 30
+
+class JournalError(Exception):
+    pass
+
+#an append waiting for the writer thread, error is set when its records could not be written
+class PendingCommit:
+    def __init__(self):
+        self.done = threading.Event()
+        self.error = None
+
+    def resolve(self, error=None):
+        self.error = error
+        self.done.set()
+
+#return the offsets of the last complete line of the file as (start, end), or None if there is none
+def _last_line_bounds(file, end):
+    position = end
+    tail = b''
+    while position > 0:
+        read_size = min(TAIL_BLOCK_SIZE, position)
+        position -= read_size
+        file.seek(position)
+        tail = file.read(read_size) + tail
+        # the line ends at the last newline, it starts after the newline before it
+        last_newline = tail.rfind(b'\n')
+        if last_newline == -1:
+            continue
+        previous_newline = tail.rfind(b'\n', 0, last_newline)
+        if previous_newline != -1 or position == 0:
+            return position + previous_newline + 1, position + last_newline + 1
+    return None
+
+#return the last complete record of the journal file, or None if it is empty
+def read_last_record(file_path):
+    if not os.path.exists(file_path):
+        return None
+
+    with open(file_path, 'rb') as file:
+        end = os.fstat(file.fileno()).st_size
+        while end > 0:
+            bounds = _last_line_bounds(file, end)
+            if bounds is None:
+                return None
+            start, end = bounds
+            file.seek(start)
+            try:
+                return json.loads(file.read(end - start))
+            except ValueError:
+                # skip a corrupt line and keep looking further back
+                end = start
+    return None
+
+#load every complete record of the journal file
+def read_journal_records(file_path):
+    records = []
+    if not os.path.exists(file_path):
+        return records
+
+    with open(file_path, 'rb') as file:
+        for line in file:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+class SignalJournal:
+    def __init__(self, file_path, max_batch_size=512, max_batch_delay=0.002, commit_timeout=COMMIT_TIMEOUT):
+        self.file_path = file_path
+        self.max_batch_size = max_batch_size
+        self.max_batch_delay = max_batch_delay
+        self.commit_timeout = commit_timeout
+        # set by the writer thread when a write failed, the journal takes no more appends
+        self.failed = None
+        self._id_lock = threading.Lock()
+        # locked before the tail is recovered, a torn tail may be the batch another process is writing
+        self._file = open(self.file_path, 'ab')
+        self._lock_file()
+        self._next_id = self._recover() + 1
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name=f"journal-writer:{os.path.basename(file_path)}", daemon=True)
+        self._writer.start()
+
+    #take the exclusive lock of the journal file, it is released when the file is closed (or the process exits)
+    def _lock_file(self):
+        if fcntl is None:
+            return
+        try:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._file.close()
+            raise JournalError(f"Journal {self.file_path} is written by another process, only one process can write to a journal")
+
+    #truncate a torn tail left by a crash and return the last ID stored in the journal
+    def _recover(self):
+        if not os.path.exists(self.file_path):
+            return 0
+
+        with open(self.file_path, 'r+b') as file:
+            size = os.fstat(file.fileno()).st_size
+            end = size
+            last_record = None
+            while end > 0 and last_record is None:
+                bounds = _last_line_bounds(file, end)
+                if bounds is None:
+                    end = 0
+                    break
+                start, line_end = bounds
+                file.seek(start)
+                try:
+                    last_record = json.loads(file.read(line_end - start))
+                    end = line_end
+                except ValueError:
+                    end = start
+
+            if end < size:
+                print(f"Recovered journal {self.file_path}: truncated {size - end} bytes of incomplete records")
+                file.truncate(end)
+                file.flush()
+                os.fsync(file.fileno())
+
+        return last_record.get('ID', 0) if last_record else 0
+
+    #queue records for the writer thread, returns the records with their IDs placed first
+    #raises JournalError when the records could not be written or were not written within commit_timeout seconds
+    def append_many(self, records, wait=True):
+        committed = PendingCommit() if wait else None
+        stored_records = []
+        with self._id_lock:
+            if self.failed is not None:
+                raise JournalError(f"Journal {self.file_path} failed: {self.failed}")
+            for record in records:
+                stored_record = {'ID': self._next_id, **{key: value for key, value in record.items() if key != 'ID'}}
+                self._next_id += 1
+                stored_records.append(stored_record)
+            # queue while holding the lock so the journal lines stay in ID order
+            self._queue.put((stored_records, committed))
+
+        if committed is not None:
+            if not committed.done.wait(self.commit_timeout):
+                raise JournalError(f"Journal {self.file_path}: records not written within {self.commit_timeout}s")
+            if committed.error is not None:
+                raise JournalError(f"Journal {self.file_path}: {committed.error}")
+        return stored_records
+
+    #queue a record and (by default) wait until the batch it was written in is fsynced
+    def append(self, record, wait=True):
+        return self.append_many([record], wait)[0]
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            stop = False
+
+            # group commit: collect whatever else arrives within the batch window
+            while len(batch) < self.max_batch_size:
+                try:
+                    item = self._queue.get(timeout=self.max_batch_delay)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                # the writer thread must keep running, otherwise the appends would wait for it until they time out
+                self.failed = f"{type(e).__name__}: {e}"
+                for _, committed in batch:
+                    self._resolve(committed, self.failed)
+            if stop:
+                break
+
+    #write and fsync a batch, then tell the waiting appends whether their records were written
+    def _write_batch(self, batch):
+        if self.failed is not None:
+            # appends queued before the journal failed
+            for _, committed in batch:
+                self._resolve(committed, self.failed)
+            return
+
+        lines = []
+        written = []
+        for records, committed in batch:
+            try:
+                lines.extend(json.dumps(record) for record in records)
+            except (TypeError, ValueError) as e:
+                # the records of this append are dropped (their IDs are skipped), the other appends are written
+                self._resolve(committed, f"{type(e).__name__}: {e}")
+                continue
+            written.append(committed)
+
+        error = None
+        if lines:
+            try:
+                self._file.write(('\n'.join(lines) + '\n').encode('utf-8'))
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            except (OSError, ValueError) as e:
+                error = f"{type(e).__name__}: {e}"
+                self.failed = error
+                print(f"Journal {self.file_path} failed, no more records are appended: {error}")
+
+        for committed in written:
+            self._resolve(committed, error)
+
+    @staticmethod
+    def _resolve(committed, error):
+        if committed is not None:
+            committed.resolve(error)
+        elif error is not None:
+            print(f"Failed to append records that were not waited for: {error}")
+
+    def close(self):
+        self._queue.put(None)
+        self._writer.join()
+        self._file.close()
+
+_journals = {}
+_journals_lock = threading.Lock()
+
+#return the shared journal for the file
+def get_signal_journal(file_path):
+    file_path = os.path.abspath(file_path)
+    with _journals_lock:
+        journal = _journals.get(file_path)
+        if journal is None:
+            journal = SignalJournal(file_path)
+            _journals[file_path] = journal
+    return journal
@@ -0,0 +1,207 @@
+'''
+This module stores the trust signals (access requests, auth data, keycloak events and access decisions) in an
+embedded SQLite database instead of rewriting the json files on every append.
+
+Every record is kept as a json document next to indexed user_id/time columns so that inserts and
+"latest record for a user" queries stay flat as the history grows. The database runs in WAL mode so the web UI
+and the engine processes can read and write it concurrently.
+
+Run this file directly to import the existing json files into the database:
+    python3 signal_repository.py import [directory containing the json files]
+
+'''
+
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+# dataset name -> (table name, json file name, name of the record field stored in the time column)
+DATASETS = {
+    'access_requests': ('access_requests', 'access_requests.json', 'access_request_time'),
+    'auth_data': ('auth_data', 'auth_data.json', 'time'),
+    'events': ('events', 'events.json', 'time'),
+    'access_decisions': ('access_decisions', 'access_decision.json', None)
+}
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS access_requests (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT,
+    time TEXT,
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_access_requests_user_time ON access_requests (user_id, time);
+
+CREATE TABLE IF NOT EXISTS auth_data (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT,
+    time INTEGER,
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_auth_data_user_time ON auth_data (user_id, time);
+
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT,
+    time INTEGER,
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_events_user_time ON events (user_id, time);
+
+CREATE TABLE IF NOT EXISTS access_decisions (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT,
+    time REAL,
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_access_decisions_user_time ON access_decisions (user_id, time);
+'''
+
+class SignalRepository:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._connect().executescript(SCHEMA)
+
+    #each thread gets its own connection, sqlite connections must not be shared between threads
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    @staticmethod
+    def _row_values(dataset, record):
+        time_field = DATASETS[dataset][2]
+        record_time = record.get(time_field) if time_field else time.time()
+        return record.get('user_id'), record_time
+
+    #insert the records of a dataset in a single transaction and return them with their assigned IDs
+    def insert_many(self, dataset, records):
+        table = DATASETS[dataset][0]
+        connection = self._connect()
+        stored = []
+        # BEGIN IMMEDIATE takes the write lock, so the IDs allocated below cannot be taken by another writer
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            new_id = connection.execute(f'SELECT COALESCE(MAX(id), 0) + 1 FROM {table}').fetchone()[0]
+            for record in records:
+                # The ID goes first so the stored record matches the layout of the json files
+                stored_record = {'ID': new_id, **{key: value for key, value in record.items() if key != 'ID'}}
+                user_id, record_time = self._row_values(dataset, stored_record)
+                connection.execute(
+                    f'INSERT INTO {table} (id, user_id, time, record) VALUES (?, ?, ?, ?)',
+                    (new_id, user_id, record_time, json.dumps(stored_record))
+                )
+                stored.append(stored_record)
+                new_id += 1
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return stored
+
+    def insert(self, dataset, record):
+        return self.insert_many(dataset, [record])[0]
+
+    #the record with the greatest time for the user, ties are resolved in favour of the first inserted record
+    def latest_for_user(self, dataset, user_id):
+        table = DATASETS[dataset][0]
+        row = self._connect().execute(
+            f'SELECT record FROM {table} WHERE user_id = ? ORDER BY time DESC, id ASC LIMIT 1', (user_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    #the most recently inserted record of the dataset
+    def latest(self, dataset):
+        table = DATASETS[dataset][0]
+        row = self._connect().execute(f'SELECT record FROM {table} ORDER BY id DESC LIMIT 1').fetchone()
+        return json.loads(row[0]) if row else None
+
+    def all_records(self, dataset):
+        table = DATASETS[dataset][0]
+        rows = self._connect().execute(f'SELECT record FROM {table} ORDER BY id').fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def has_user(self, dataset, user_id):
+        table = DATASETS[dataset][0]
+        row = self._connect().execute(f'SELECT 1 FROM {table} WHERE user_id = ? LIMIT 1', (user_id,)).fetchone()
+        return row is not None
+
+    def has_record_at(self, dataset, user_id, record_time):
+        table = DATASETS[dataset][0]
+        row = self._connect().execute(
+            f'SELECT 1 FROM {table} WHERE user_id IS ? AND time = ? LIMIT 1', (user_id, record_time)
+        ).fetchone()
+        return row is not None
+
+    def count(self, dataset):
+        table = DATASETS[dataset][0]
+        return self._connect().execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+
+    #one-shot import of the existing json files, records whose ID is already stored are skipped
+    def import_json_files(self, directory):
+        imported = {}
+        for dataset, (table, file_name, _) in DATASETS.items():
+            file_path = os.path.join(directory, file_name)
+            if not os.path.exists(file_path):
+                imported[dataset] = 0
+                continue
+
+            with open(file_path, 'r') as file:
+                records = json.load(file)
+
+            connection = self._connect()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                count = 0
+                for record in records:
+                    user_id, record_time = self._row_values(dataset, record)
+                    cursor = connection.execute(
+                        f'INSERT OR IGNORE INTO {table} (id, user_id, time, record) VALUES (?, ?, ?, ?)',
+                        (record.get('ID'), user_id, record_time, json.dumps(record))
+                    )
+                    count += cursor.rowcount
+                connection.execute('COMMIT')
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+            imported[dataset] = count
+        return imported
+
+_repositories = {}
+_repositories_lock = threading.Lock()
+
+#return the shared repository for the database file
+def get_signal_repository(db_path):
+    db_path = os.path.abspath(db_path)
+    with _repositories_lock:
+        repository = _repositories.get(db_path)
+        if repository is None:
+            repository = SignalRepository(db_path)
+            _repositories[db_path] = repository
+    return repository
+
+if __name__ == '__main__':
+    from storage_config import SIGNAL_DATA_DIR, SIGNAL_DB_PATH
+
+    if len(sys.argv) < 2 or sys.argv[1] != 'import':
+        print("Usage: python3 signal_repository.py import [directory]")
+        sys.exit(1)
+
+    source_directory = sys.argv[2] if len(sys.argv) > 2 else SIGNAL_DATA_DIR
+    results = get_signal_repository(SIGNAL_DB_PATH).import_json_files(source_directory)
+    for dataset, count in results.items():
+        print(f"Imported {count} {dataset} records into {SIGNAL_DB_PATH}")
@@ -0,0 +1,132 @@
+'''
+This module keeps the trust signal files (access requests, auth data, user identity data) resident in memory.
+
+Each file is parsed once and reduced to per-user hash indexes so that the trust engine and policy engine can
+look up the latest record for a subject in O(1). A json file is only re-parsed when its size/mtime changes on disk,
+a journal (.jsonl) file that grew is read from the last offset and only the new records are folded into the indexes.
+
+'''
+
+import json
+import os
+import threading
+
+#build an index that keeps the record with the greatest value of time_key for every user_id
+def latest_record_index(time_key):
+    def update(index, records):
+        for record in records:
+            user_id = record['user_id']
+            latest = index.get(user_id)
+            # a strictly greater time replaces the current record so ties keep the first record seen
+            if latest is None or record[time_key] > latest[time_key]:
+                index[user_id] = record
+    return update
+
+#build an index that keeps the first record seen for every user_id
+def first_record_index(index, records):
+    for record in records:
+        index.setdefault(record['user_id'], record)
+
+# The indexes that can be requested from the store, keyed by name
+INDEX_BUILDERS = {
+    'latest_access_request': latest_record_index('access_request_time'),
+    'latest_auth_data': latest_record_index('time'),
+    'user_identity': first_record_index
+}
+
+class SignalStore:
+    def __init__(self):
+        self._files = {}
+        self._lock = threading.Lock()
+
+    #the stamp used to detect that a file changed since it was last loaded
+    @staticmethod
+    def _file_stamp(file_path):
+        stat = os.stat(file_path)
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    @staticmethod
+    def _is_journal(file_path):
+        return file_path.endswith('.jsonl')
+
+    #read the complete journal lines starting at offset, returns the records and the offset after the last line
+    @staticmethod
+    def _read_journal(file_path, offset):
+        records = []
+        with open(file_path, 'rb') as file:
+            file.seek(offset)
+            for line in file:
+                if not line.endswith(b'\n'):
+                    break  # a record that is still being written
+                offset += len(line)
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+        return records, offset
+
+    def _load_entry(self, file_path, stamp):
+        if self._is_journal(file_path):
+            records, offset = self._read_journal(file_path, 0)
+        else:
+            with open(file_path, 'r') as file:
+                records = json.load(file)
+            offset = None
+        return {'stamp': stamp, 'records': records, 'offset': offset, 'indexes': {}}
+
+    #fold the records appended to a journal into the existing entry
+    def _extend_entry(self, file_path, entry, stamp):
+        new_records, entry['offset'] = self._read_journal(file_path, entry['offset'])
+        entry['records'].extend(new_records)
+        for index_name, index in entry['indexes'].items():
+            INDEX_BUILDERS[index_name](index, new_records)
+        entry['stamp'] = stamp
+
+    #return the (refreshed if needed) cache entry for the file
+    def _get_entry(self, file_path):
+        file_path = os.path.abspath(file_path)
+        stamp = self._file_stamp(file_path)
+        entry = self._files.get(file_path)
+        if entry is not None and entry['stamp'] == stamp:
+            return entry
+
+        with self._lock:
+            entry = self._files.get(file_path)
+            if entry is None:
+                entry = self._load_entry(file_path, stamp)
+                self._files[file_path] = entry
+            elif entry['stamp'] != stamp:
+                # journals only ever grow, anything else (replaced or truncated file) is reloaded
+                if entry['offset'] is not None and stamp[0] == entry['stamp'][0] and stamp[1] >= entry['offset']:
+                    self._extend_entry(file_path, entry, stamp)
+                else:
+                    entry = self._load_entry(file_path, stamp)
+                    self._files[file_path] = entry
+        return entry
+
+    #return the named index over the file, building it the first time it is requested
+    def get_index(self, file_path, index_name):
+        entry = self._get_entry(file_path)
+        index = entry['indexes'].get(index_name)
+        if index is None:
+            with self._lock:
+                index = entry['indexes'].get(index_name)
+                if index is None:
+                    index = {}
+                    INDEX_BUILDERS[index_name](index, entry['records'])
+                    entry['indexes'][index_name] = index
+        return index
+
+    def lookup(self, file_path, index_name, user_id):
+        return self.get_index(file_path, index_name).get(user_id)
+
+    #drop cached data so the next lookup reloads from disk
+    def invalidate(self, file_path=None):
+        with self._lock:
+            if file_path is None:
+                self._files.clear()
+            else:
+                self._files.pop(os.path.abspath(file_path), None)
+
+# Process wide store shared by the trust engine and policy engine lookups
+signal_store = SignalStore()
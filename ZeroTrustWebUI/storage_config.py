@@ -0,0 +1,14 @@
+#This file contains the constants for the trust signal storage backend
+
+# storage_config.py
+
+import os
+
+# Directory that holds the trust signal files shared by the web UI, trust engine and policy engine
+SIGNAL_DATA_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+# 'json' keeps the signals in the json files, 'sqlite' stores them in the signal repository database,
+# 'jsonl' appends the datasets listed in JOURNAL_DATASETS to append-only journals (<name>.jsonl)
+SIGNAL_BACKEND = os.environ.get('ZTA_SIGNAL_BACKEND', 'json')
+JOURNAL_DATASETS = ('access_requests', 'access_decisions')
+SIGNAL_DB_PATH = os.environ.get('ZTA_SIGNAL_DB_PATH', os.path.join(SIGNAL_DATA_DIR, 'signals.db'))
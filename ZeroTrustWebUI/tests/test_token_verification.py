@@ -0,0 +1,181 @@
+'''
+Tests of the local validation of the access tokens (token_verification.py) against the keys served by a local JWKS
+endpoint standing in for keycloak's certs endpoint.
+
+Run from the ZeroTrustWebUI directory: python -m unittest discover tests
+
+'''
+
+import base64
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jwcrypto import jwk, jws
+
+from token_verification import TokenVerifier
+
+AUDIENCE = 'ZeroTrustPlatform'
+ISSUER = 'http://localhost:8080/realms/myrealm'
+
+#serves the keys of jwks_server.keys, or an error when jwks_server.status is not 200
+class JwksHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests += 1
+        if self.server.status != 200:
+            self.send_response(self.server.status)
+            self.end_headers()
+            return
+        body = json.dumps({'keys': [key.export_public(as_dict=True) for key in self.server.keys]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def base64url(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+def make_claims(**overrides):
+    now = int(time.time())
+    claims = {'iss': ISSUER, 'aud': 'account', 'azp': AUDIENCE, 'sub': 'user-1', 'iat': now, 'exp': now + 300}
+    claims.update(overrides)
+    return claims
+
+#return a compact JWS of the claims signed with the key
+def sign(key, claims, alg='RS256'):
+    token = jws.JWS(json.dumps(claims))
+    token.add_signature(key, alg=alg, protected=json.dumps({'alg': alg, 'kid': key.get('kid'), 'typ': 'JWT'}))
+    return token.serialize(compact=True)
+
+class TokenVerifierTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.key = jwk.JWK.generate(kty='RSA', size=2048, kid='key-1')
+        cls.rotated_key = jwk.JWK.generate(kty='RSA', size=2048, kid='key-2')
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), JwksHandler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.jwks_url = f"http://127.0.0.1:{cls.server.server_address[1]}/realms/myrealm/protocol/openid-connect/certs"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.keys = [self.key]
+        self.server.status = 200
+        self.server.requests = 0
+        self.introspected = []
+        self.introspection_result = {'active': False}
+
+    def introspect(self, access_token):
+        self.introspected.append(access_token)
+        return self.introspection_result
+
+    def make_verifier(self, **kwargs):
+        kwargs.setdefault('jwks_min_refresh_interval', 0)
+        return TokenVerifier(self.jwks_url, AUDIENCE, issuer=ISSUER, introspect=self.introspect, **kwargs)
+
+    def test_valid_token(self):
+        verifier = self.make_verifier()
+        claims = verifier.verify(sign(self.key, make_claims()))
+        self.assertEqual(claims['sub'], 'user-1')
+        self.assertEqual(self.introspected, [])
+
+    def test_valid_token_is_verified_once(self):
+        verifier = self.make_verifier()
+        token = sign(self.key, make_claims())
+        verifier.verify(token)
+        verifier.verify(token)
+        self.assertEqual(verifier.get_stats()['local_verifications'], 1)
+        self.assertEqual(verifier.get_stats()['cache_hits'], 1)
+
+    def test_expired_token(self):
+        verifier = self.make_verifier(leeway=0)
+        now = int(time.time())
+        self.assertIsNone(verifier.verify(sign(self.key, make_claims(iat=now - 600, exp=now - 300))))
+
+    def test_wrong_audience(self):
+        verifier = self.make_verifier()
+        self.assertIsNone(verifier.verify(sign(self.key, make_claims(aud='other-client', azp='other-client'))))
+
+    def test_audience_in_aud(self):
+        verifier = self.make_verifier()
+        self.assertIsNotNone(verifier.verify(sign(self.key, make_claims(aud=['account', AUDIENCE], azp='other-client'))))
+
+    def test_wrong_issuer(self):
+        verifier = self.make_verifier()
+        self.assertIsNone(verifier.verify(sign(self.key, make_claims(iss='http://localhost:8080/realms/other'))))
+
+    def test_unknown_key_fetches_the_rotated_keys(self):
+        verifier = self.make_verifier()
+        self.assertIsNotNone(verifier.verify(sign(self.key, make_claims())))
+        self.server.keys = [self.key, self.rotated_key]
+        self.assertIsNotNone(verifier.verify(sign(self.rotated_key, make_claims(sub='user-2'))))
+        self.assertEqual(verifier.get_stats()['jwks_refreshes'], 2)
+
+    def test_unknown_key_does_not_refetch_within_min_interval(self):
+        verifier = self.make_verifier(jwks_min_refresh_interval=60)
+        self.assertIsNotNone(verifier.verify(sign(self.key, make_claims())))
+        self.server.keys = [self.key, self.rotated_key]
+        self.assertIsNone(verifier.verify(sign(self.rotated_key, make_claims(sub='user-2'))))
+        self.assertEqual(self.server.requests, 1)
+
+    def test_cached_keys_are_served_when_the_refresh_fails(self):
+        verifier = self.make_verifier(jwks_ttl=0)
+        self.assertIsNotNone(verifier.verify(sign(self.key, make_claims())))
+        self.server.status = 500
+        self.assertIsNotNone(verifier.verify(sign(self.key, make_claims(sub='user-2'))))
+        self.assertEqual(verifier.get_stats()['jwks_refresh_failures'], 1)
+
+        # the failed fetch is tried again after the minimum refresh interval
+        self.server.status = 200
+        self.assertIsNotNone(verifier.verify(sign(self.key, make_claims(sub='user-3'))))
+        self.assertEqual(verifier.get_stats()['jwks_refreshes'], 2)
+
+    def test_hs256_token_is_rejected(self):
+        verifier = self.make_verifier()
+        # signed with the public key of the realm as an HMAC secret
+        secret = jwk.JWK(kty='oct', kid=self.key.get('kid'), k=base64url(self.key.export_to_pem()))
+        self.assertIsNone(verifier.verify(sign(secret, make_claims(), alg='HS256')))
+
+    def test_unsigned_token_is_rejected(self):
+        verifier = self.make_verifier()
+        header = base64url(json.dumps({'alg': 'none', 'kid': self.key.get('kid')}).encode())
+        payload = base64url(json.dumps(make_claims()).encode())
+        self.assertIsNone(verifier.verify(f"{header}.{payload}."))
+
+    def test_opaque_token_is_introspected(self):
+        verifier = self.make_verifier()
+        self.introspection_result = dict(make_claims(), active=True)
+        claims = verifier.verify('opaque-access-token')
+        self.assertEqual(claims['sub'], 'user-1')
+        self.assertEqual(self.introspected, ['opaque-access-token'])
+
+    def test_inactive_opaque_token_is_rejected(self):
+        verifier = self.make_verifier()
+        self.assertIsNone(verifier.verify('opaque-access-token'))
+        self.assertIsNone(verifier.verify('opaque-access-token'))
+        # the rejected token is kept in the negative cache
+        self.assertEqual(self.introspected, ['opaque-access-token'])
+
+    def test_revoked_token_is_rejected(self):
+        verifier = self.make_verifier()
+        token = sign(self.key, make_claims())
+        self.assertIsNotNone(verifier.verify(token))
+        verifier.revoke(token)
+        self.assertIsNone(verifier.verify(token))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,218 @@
+'''
+This module validates the keycloak access tokens locally instead of introspecting them on every request.
+
+The signature of a token is checked against the signing keys of the realm (the JWKS of the certs endpoint), which are
+cached and fetched again when they expire or when a token is signed with a key that is not in the cache (key
+rotation). When keycloak cannot be reached the cached keys keep being used and the fetch is tried again after the
+minimum refresh interval. The exp, nbf, iss and aud claims are enforced, and the claims of a verified token are cached until it expires
+so the checks of one page view (token_is_valid, extract_user_role) verify the token once.
+
+Keycloak's introspection endpoint is only called for tokens that cannot be validated locally (opaque tokens) and
+when a caller asks for a revocation check. Tokens that failed validation or were revoked are kept in a short
+negative cache so they are not validated again on every request.
+
+'''
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from jwcrypto import jwk, jws
+from jwcrypto.common import JWException
+
+from http_client import http_client
+
+# Algorithms keycloak signs the access tokens with, tokens with any other algorithm (e.g. none) are rejected
+ALLOWED_ALGORITHMS = ['RS256', 'RS384', 'RS512', 'PS256', 'PS384', 'PS512', 'ES256', 'ES384', 'ES512']
+
+class OpaqueTokenError(Exception):
+    pass
+
+class InvalidTokenError(Exception):
+    pass
+
+class TokenVerifier:
+    def __init__(self, jwks_url, audience, issuer=None, introspect=None, jwks_ttl=300, jwks_min_refresh_interval=10,
+                 negative_cache_ttl=30, leeway=30, max_entries=10000):
+        self.jwks_url = jwks_url
+        self.audience = audience
+        # iss claim of the tokens of the realm, not checked when None
+        self.issuer = issuer
+        # callable returning the introspection result of a token, e.g. keycloak_openid.introspect
+        self.introspect = introspect
+        self.jwks_ttl = jwks_ttl
+        self.jwks_min_refresh_interval = jwks_min_refresh_interval
+        self.negative_cache_ttl = negative_cache_ttl
+        self.leeway = leeway
+        self.max_entries = max_entries
+        self._jwks = None
+        self._jwks_expires_at = 0
+        self._jwks_fetched_at = None
+        self._jwks_lock = threading.Lock()
+        # sha256 of the token -> (expires_at, claims), claims is None for the tokens that are not valid
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.local_verifications = 0
+        self.introspections = 0
+        self.jwks_refreshes = 0
+        self.jwks_refresh_failures = 0
+        self.cache_hits = 0
+
+    #return the cached signing keys of the realm, fetching them when they expired or force is set
+    #the keys that expired are still returned when the fetch fails, it is tried again after jwks_min_refresh_interval
+    def get_jwks(self, force=False):
+        with self._jwks_lock:
+            now = time.monotonic()
+            # a token signed with an unknown key must not make every request fetch the keys again
+            if force and self._jwks_fetched_at is not None and now - self._jwks_fetched_at < self.jwks_min_refresh_interval:
+                force = False
+            if self._jwks is None or force or now >= self._jwks_expires_at:
+                self._jwks_fetched_at = now
+                try:
+                    response = http_client.get(self.jwks_url, endpoint='keycloak_certs')
+                    response.raise_for_status()
+                    jwks = jwk.JWKSet.from_json(response.text)
+                except (requests.RequestException, JWException, ValueError) as e:
+                    self.jwks_refresh_failures += 1
+                    if self._jwks is None:
+                        raise
+                    print(f"Failed to refresh the signing keys of the realm, using the cached keys: {e}")
+                    self._jwks_expires_at = now + self.jwks_min_refresh_interval
+                    return self._jwks
+                self._jwks = jwks
+                self._jwks_expires_at = now + self.jwks_ttl
+                self.jwks_refreshes += 1
+            return self._jwks
+
+    def get_signing_key(self, key_id):
+        key = self.get_jwks().get_key(key_id)
+        if key is None:
+            # the realm keys were rotated since the keys were cached
+            key = self.get_jwks(force=True).get_key(key_id)
+        if key is None:
+            raise InvalidTokenError(f"Unknown signing key {key_id}")
+        return key
+
+    #check the signature and the claims of a token, returns its claims
+    def verify_locally(self, access_token):
+        token = jws.JWS()
+        token.allowed_algs = ALLOWED_ALGORITHMS
+        try:
+            token.deserialize(access_token)
+        except JWException as e:
+            raise OpaqueTokenError(str(e))
+
+        try:
+            token.verify(self.get_signing_key(token.jose_header.get('kid')))
+            claims = json.loads(token.payload)
+        except (JWException, ValueError) as e:
+            raise InvalidTokenError(str(e))
+        self.local_verifications += 1
+        self.check_claims(claims)
+        return claims
+
+    def check_claims(self, claims):
+        now = time.time()
+        if 'exp' not in claims or now > claims['exp'] + self.leeway:
+            raise InvalidTokenError('The token expired')
+        if now < claims.get('nbf', 0) - self.leeway:
+            raise InvalidTokenError('The token is not valid yet')
+        if self.issuer is not None and claims.get('iss') != self.issuer:
+            raise InvalidTokenError(f"The token was not issued by {self.issuer}")
+
+        audience = claims.get('aud', [])
+        if isinstance(audience, str):
+            audience = [audience]
+        # keycloak only adds the client to aud with an audience mapper, the client a token was issued to is in azp
+        if self.audience not in audience and claims.get('azp') != self.audience:
+            raise InvalidTokenError(f"The token was not issued for {self.audience}")
+
+    #introspect a token with keycloak, returns its claims
+    def verify_remotely(self, access_token):
+        if self.introspect is None:
+            raise InvalidTokenError('The token cannot be validated locally')
+        self.introspections += 1
+        claims = self.introspect(access_token)
+        if not claims.get('active'):
+            raise InvalidTokenError('The token is not active')
+        self.check_claims(claims)
+        return claims
+
+    #return the claims of a valid token, or None when the token is not valid
+    #check_revoked also asks keycloak whether the session of the token was ended (logout, revoked by an admin)
+    def verify(self, access_token, check_revoked=False):
+        if isinstance(access_token, dict):
+            access_token = access_token.get('access_token')
+        if not access_token:
+            return None
+
+        token_key = hashlib.sha256(access_token.encode()).hexdigest()
+        found, claims = self.get_cached(token_key)
+        if found and (claims is None or not check_revoked):
+            return claims
+
+        try:
+            if check_revoked:
+                claims = self.verify_remotely(access_token)
+            else:
+                try:
+                    claims = self.verify_locally(access_token)
+                except OpaqueTokenError:
+                    claims = self.verify_remotely(access_token)
+        except InvalidTokenError as e:
+            print(f"Access token rejected: {e}")
+            self.put(token_key, None, time.monotonic() + self.negative_cache_ttl)
+            return None
+        except requests.RequestException as e:
+            # keycloak is not reachable, the token is checked again on the next request
+            print(f"Access token could not be validated: {e}")
+            return None
+
+        self.put(token_key, claims, time.monotonic() + max(0, claims['exp'] - time.time()))
+        return claims
+
+    #reject a token until it expires, e.g. after the user logged out
+    def revoke(self, access_token):
+        if isinstance(access_token, dict):
+            access_token = access_token.get('access_token')
+        if not access_token:
+            return
+        token_key = hashlib.sha256(access_token.encode()).hexdigest()
+        found, claims = self.get_cached(token_key)
+        expires_in = claims['exp'] - time.time() + self.leeway if claims else self.negative_cache_ttl
+        self.put(token_key, None, time.monotonic() + max(self.negative_cache_ttl, expires_in))
+
+    #return (found, claims) of a cached token that did not expire
+    def get_cached(self, token_key):
+        with self._lock:
+            entry = self._entries.get(token_key)
+            if entry is None:
+                return False, None
+            expires_at, claims = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[token_key]
+                return False, None
+            self._entries.move_to_end(token_key)
+            self.cache_hits += 1
+            return True, claims
+
+    def put(self, token_key, claims, expires_at):
+        with self._lock:
+            self._entries[token_key] = (expires_at, claims)
+            self._entries.move_to_end(token_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'cache_hits': self.cache_hits,
+                'local_verifications': self.local_verifications,
+                'introspections': self.introspections,
+                'jwks_refreshes': self.jwks_refreshes,
+                'jwks_refresh_failures': self.jwks_refresh_failures
+            }
@@ -0,0 +1,84 @@
+'''
+This module loads the topology of the peer to peer network (topology.yml): the id, role, host and port of every node.
+
+The Networking classes build their NODE_ROLE / NODE_CONNECT tables from it and decide where messages come from by
+the role of the sender, so trust engine and policy engine replicas can be added to the file without code changes.
+
+'''
+
+import os
+from dataclasses import dataclass
+
+import yaml
+
+# topology.yml lives in the root directory of the project, next to the engines
+TOPOLOGY_FILE_PATH = os.environ.get(
+    'ZTA_TOPOLOGY_FILE',
+    os.path.join(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)), 'topology.yml')
+)
+
+ACCESS_PROXY = 'access_proxy'
+TRUST_ENGINE = 'trust_engine'
+POLICY_ENGINE = 'policy_engine'
+WEB_UI = 'web_ui'
+
+# The name of every role used in the logs
+ROLE_NAMES = {
+    ACCESS_PROXY: 'Access Proxy Node',
+    TRUST_ENGINE: 'Trust Engine Node',
+    POLICY_ENGINE: 'Policy Engine Node',
+    WEB_UI: 'Web UI'
+}
+
+@dataclass(frozen=True)
+class NodeAddress:
+    id: str
+    role: str
+    host: str
+    port: int
+
+@dataclass(frozen=True)
+class Topology:
+    nodes: tuple
+    virtual_nodes: int
+
+    def get(self, node_id):
+        for node in self.nodes:
+            if node.id == node_id:
+                return node
+        return None
+
+    def nodes_with_role(self, role):
+        return [node.id for node in self.nodes if node.role == role]
+
+    #{node id: role}
+    def node_types(self):
+        return {node.id: node.role for node in self.nodes}
+
+    #{node id: name of the node}, replicas of a role get their id appended to the role name
+    def node_roles(self):
+        names = {}
+        for node in self.nodes:
+            name = ROLE_NAMES[node.role]
+            names[node.id] = name if len(self.nodes_with_role(node.role)) == 1 else f"{name} {node.id}"
+        return names
+
+    #{node id: [host, port]}
+    def node_connect(self):
+        return {node.id: [node.host, node.port] for node in self.nodes}
+
+def load_topology(file_path=TOPOLOGY_FILE_PATH):
+    with open(file_path, 'r') as file:
+        topology_configuration = yaml.safe_load(file) or {}
+
+    nodes = []
+    for node in topology_configuration.get('nodes', []):
+        if node['role'] not in ROLE_NAMES:
+            raise ValueError(f"Unknown role '{node['role']}' of node {node['id']} in {file_path}")
+        nodes.append(NodeAddress(str(node['id']), node['role'], node['host'], int(node['port'])))
+
+    node_ids = [node.id for node in nodes]
+    if len(set(node_ids)) != len(node_ids):
+        raise ValueError(f"The node ids in {file_path} are not unique")
+
+    return Topology(tuple(nodes), int(topology_configuration.get('virtualNodes', 100)))
@@ -0,0 +1,111 @@
+'''
+This module caches the trust scores computed by the trust engine.
+
+Every entry keeps the segment scores and the overall trust score of a user together with the fingerprint of the
+signals they were computed from (latest access request, latest auth data, identity data and the policy file).
+An entry is only served while that fingerprint is unchanged and its TTL has not expired, so a new access request,
+auth record, identity update or policy change of a user invalidates exactly that user's entry.
+The cache is bounded and evicts the least recently used entries.
+
+'''
+
+import threading
+import time
+from collections import OrderedDict
+
+from . import BatchTrustAlgorithm as bta
+from . import TrustAlgorithm as ta
+
+class TrustScoreCache:
+    def __init__(self, max_entries=10000, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    #return the cached scores if they were computed from the given fingerprint and did not expire
+    def get(self, user_id, fingerprint):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                entry_fingerprint, expires_at, scores = entry
+                if entry_fingerprint == fingerprint and time.monotonic() < expires_at:
+                    self._entries.move_to_end(user_id)
+                    self.hits += 1
+                    return scores
+                # the signals of the user changed or the entry expired
+                del self._entries[user_id]
+                self.invalidations += 1
+            self.misses += 1
+            return None
+
+    def put(self, user_id, fingerprint, scores):
+        with self._lock:
+            self._entries[user_id] = (fingerprint, time.monotonic() + self.ttl, scores)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    #drop the entry of a user, or every entry when user_id is None
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self.invalidations += len(self._entries)
+                self._entries.clear()
+            elif self._entries.pop(user_id, None) is not None:
+                self.invalidations += 1
+
+    def get_stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / requests if requests else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
+
+    #return the segment scores and overall trust score of the user, computing them on a miss
+    def get_trust_score_components(self, user_id):
+        fingerprint = ta.get_trust_signal_fingerprint(user_id)
+        scores = self.get(user_id, fingerprint)
+        if scores is None:
+            scores = ta.calculate_trust_score_components(user_id)
+            self.put(user_id, fingerprint, scores)
+        return scores
+
+    def get_trust_score(self, user_id):
+        return self.get_trust_score_components(user_id)['overall_trust_score']
+
+    #return {user_id: scores} for a batch of users, the cache misses are scored together by the batch algorithm
+    #(users that cannot be scored because a signal is missing are left out)
+    def get_batch_trust_score_components(self, user_ids):
+        components = {}
+        missed_fingerprints = {}
+        for user_id in dict.fromkeys(user_ids):
+            fingerprint = ta.get_trust_signal_fingerprint(user_id)
+            scores = self.get(user_id, fingerprint)
+            if scores is None:
+                missed_fingerprints[user_id] = fingerprint
+            else:
+                components[user_id] = scores
+
+        if missed_fingerprints:
+            for user_id, scores in bta.calculate_trust_score_components(list(missed_fingerprints)).items():
+                self.put(user_id, missed_fingerprints[user_id], scores)
+                components[user_id] = scores
+        return components
+
+    #return {user_id: trust score} for a batch of users
+    def get_trust_scores(self, user_ids):
+        return {user_id: scores['overall_trust_score'] for user_id, scores in self.get_batch_trust_score_components(user_ids).items()}
+
+# Cache shared by the trust engine
+trust_score_cache = TrustScoreCache()
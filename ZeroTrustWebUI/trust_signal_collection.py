@@ -9,6 +9,20 @@ HANDLING PROCESSING OF AUTH_DATA
 
 import json
 import os
+import threading
+from datetime import datetime
+
+try:
+    from .signal_store import signal_store
+    from .signal_repository import get_signal_repository
+    from .signal_journal import get_signal_journal, read_journal_records, read_last_record
+    from .storage_config import SIGNAL_BACKEND, SIGNAL_DB_PATH, JOURNAL_DATASETS
+except ImportError:
+    # imported as a top level module from within the ZeroTrustWebUI directory
+    from signal_store import signal_store
+    from signal_repository import get_signal_repository
+    from signal_journal import get_signal_journal, read_journal_records, read_last_record
+    from storage_config import SIGNAL_BACKEND, SIGNAL_DB_PATH, JOURNAL_DATASETS
 
 def calculate_sign_in_risk(auth_data):
     user_dict = {}
@@ -61,24 +75,32 @@ def predict_sign_in_risk(user_chain, current_sign_in_risk):
 
     return predicted_sign_in_risk
 
+#reduce a stored keycloak event to an auth data entry, returns None for events that are not sign-in attempts
+def clean_auth_event(event):
+    if event['user_id'] is None:  # Skip entries with null user_id
+        return None
+
+    cleaned_event = {
+        'time': event.get('time', None),
+        'type': event.get('type', None),
+        'user_id': event.get('user_id', None),
+        'ip_address': event.get('ip_address', None),
+        'auth_type': event.get('auth_type', None),
+        'auth_status': 1 if event.get('type') == 'LOGIN' else 0
+    }
+
+    # Skip records not matching criteria
+    if cleaned_event['auth_status'] == 0 and event.get('type') != 'LOGIN_ERROR':
+        return None
+
+    return cleaned_event
+
 def process_events(events_data):
     cleaned_data = []
 
     for event in events_data:
-        if event['user_id'] is not None:  # Skip entries with null user_id
-            cleaned_event = {
-                'time': event.get('time', None),
-                'type': event.get('type', None),
-                'user_id': event.get('user_id', None),
-                'ip_address': event.get('ip_address', None),
-                'auth_type': event.get('auth_type', None),
-                'auth_status': 1 if event.get('type') == 'LOGIN' else 0
-            }
-
-            # Skip records not matching criteria
-            if cleaned_event['auth_status'] == 0 and event.get('type') != 'LOGIN_ERROR':
-                continue
-
+        cleaned_event = clean_auth_event(event)
+        if cleaned_event is not None:
             cleaned_data.append(cleaned_event)
 
     # Update auth_data with calculated sign-in risk
@@ -99,6 +121,13 @@ def process_events(events_data):
         if user_id in predicted_sign_in_risk:
             entry['sign_in_risk'] = (entry['sign_in_risk'] + predicted_sign_in_risk[user_id]) / 2
 
+    if SIGNAL_BACKEND == 'sqlite':
+        repository = signal_repository()
+        # Filter out events of users that already have auth data stored
+        auth_data_to_add = [event for event in auth_data if not repository.has_user('auth_data', event['user_id'])]
+        repository.insert_many('auth_data', auth_data_to_add)
+        return
+
     # File handling to store events in a JSON file
     file_path = os.path.join(os.path.abspath(os.path.join(os.getcwd(), os.pardir)), 'auth_data.json')
 
@@ -131,6 +160,108 @@ def process_events(events_data):
         print(f"Error occurred while writing JSON data: {e}")
 
 
+'''
+STREAMING PROCESSING OF AUTH_DATA
+
+Instead of rebuilding the sign-in risk chains from the whole event history, the per-user success/failure counts
+and the last two values of each chain are kept in a persisted state and only events with an ID greater than the
+last processed one are folded in. The resulting sign-in risks are the same as the ones process_events computes.
+
+'''
+
+def load_sign_in_risk_state(state_file_path, auth_file_path):
+    if os.path.exists(state_file_path):
+        with open(state_file_path, 'r') as file:
+            state = json.load(file)
+        state['auth_data_users'] = set(state['auth_data_users'])
+        return state
+
+    # First run: the users that already have auth data are not added again
+    state = {'last_event_id': 0, 'last_auth_id': 0, 'users': {}, 'auth_data_users': set()}
+    existing_data = load_signal_records('auth_data', auth_file_path) if SIGNAL_BACKEND == 'sqlite' or os.path.exists(auth_file_path) else []
+    for entry in existing_data or []:
+        state['auth_data_users'].add(entry.get('user_id'))
+        state['last_auth_id'] = max(state['last_auth_id'], entry.get('ID', 0))
+    return state
+
+def save_sign_in_risk_state(state_file_path, state):
+    serializable_state = dict(state, auth_data_users=list(state['auth_data_users']))
+    temp_file_path = state_file_path + '.tmp'
+    with open(temp_file_path, 'w') as file:
+        json.dump(serializable_state, file)
+    os.replace(temp_file_path, state_file_path)
+
+#the current sign-in risk of a user blended with its prediction, same as process_events
+def blended_sign_in_risk(user_state):
+    chain = user_state['chain']
+    current_sign_in_risk = chain[-1]
+    if len(chain) > 1:
+        transition_prob = chain[-1] - chain[-2]
+        predicted_sign_in_risk = current_sign_in_risk + transition_prob
+        return (current_sign_in_risk + predicted_sign_in_risk) / 2
+    return current_sign_in_risk
+
+#fold the events newer than the last processed event ID into the sign-in risk state and store the new auth data
+def process_events_incremental(events_data):
+    parent_directory = os.path.abspath(os.path.join(os.getcwd(), os.pardir))
+    file_path = os.path.join(parent_directory, 'auth_data.json')
+    state_file_path = os.path.join(parent_directory, 'sign_in_risk_state.json')
+
+    try:
+        state = load_sign_in_risk_state(state_file_path, file_path)
+        users = state['users']
+        new_entries = []
+
+        for event in events_data:
+            event_id = event.get('ID', 0)
+            if event_id <= state['last_event_id']:
+                continue
+            state['last_event_id'] = event_id
+
+            cleaned_event = clean_auth_event(event)
+            if cleaned_event is None:
+                continue
+
+            user_id = cleaned_event['user_id']
+            user_state = users.setdefault(user_id, {'success_count': 0, 'failure_count': 0, 'chain': [0]})
+
+            # Update success or failure count for the user
+            if cleaned_event['auth_status'] == 1:
+                user_state['success_count'] += 1
+            else:
+                user_state['failure_count'] += 1
+
+            # Update the Markov chain, only the last two values are needed for the prediction
+            total_count = user_state['success_count'] + user_state['failure_count']
+            user_state['chain'] = [user_state['chain'][-1], user_state['success_count'] / total_count]
+
+            if user_id not in state['auth_data_users']:
+                new_entries.append(cleaned_event)
+
+        # Every new entry of a user carries the user's sign-in risk after this batch
+        for entry in new_entries:
+            entry['sign_in_risk'] = blended_sign_in_risk(users[entry['user_id']])
+
+        if new_entries:
+            if SIGNAL_BACKEND == 'sqlite':
+                new_entries = signal_repository().insert_many('auth_data', new_entries)
+            else:
+                for i, entry in enumerate(new_entries, start=state['last_auth_id'] + 1):
+                    entry['ID'] = i
+                append_to_json_array_file(file_path, new_entries)
+
+            state['last_auth_id'] = max(entry['ID'] for entry in new_entries)
+            state['auth_data_users'].update(entry['user_id'] for entry in new_entries)
+
+        save_sign_in_risk_state(state_file_path, state)
+        return new_entries
+
+    except (json.JSONDecodeError, FileNotFoundError) as e:
+        print(f"Error occurred while handling the JSON file: {e}")
+
+    except IOError as e:
+        print(f"Error occurred while writing JSON data: {e}")
+
 def load_events_data(file_path):
     try:
         with open(file_path, 'r') as file:
@@ -149,59 +280,153 @@ HANDLING PROCESSING AND STORAGE OF EVENTS DATA
 
 '''
 
-def store_keycloak_events(keycloak_admin):
-    query_params = {
-        "dateFrom": "2023-01-01",
-        "dateTo": "2023-12-31",
-        "max": 10000,
-    }
+# Number of events requested from keycloak per page
+EVENTS_PAGE_SIZE = 500
 
-    events_data = keycloak_admin.get_events(query=query_params)
-    cleaned_data = []
+# keycloak filters events by date only, so every sync re-reads this much history before the cursor
+# and events inside this window are deduplicated against the keys kept in the sync state
+EVENTS_SYNC_OVERLAP_MS = 2 * 24 * 60 * 60 * 1000
 
-    for event in events_data:
-        cleaned_event = {
-            'time': event.get('time', None),
-            'type': event.get('type', None),
-            'user_id': event.get('userId', None),
-            'ip_address': event.get('ipAddress', None)
-        }
-
-        if 'details' in event:
-            details = event['details']
-            cleaned_event['auth_type'] = details.get('auth_type', None)
-            cleaned_event['token_id'] = details.get('token_id', None)
-
-        cleaned_event['session_id'] = event.get('sessionId', None)
-
-        cleaned_data.append(cleaned_event)
+def clean_keycloak_event(event):
+    cleaned_event = {
+        'time': event.get('time', None),
+        'type': event.get('type', None),
+        'user_id': event.get('userId', None),
+        'ip_address': event.get('ipAddress', None)
+    }
 
-    file_path = os.path.join(os.path.abspath(os.path.join(os.getcwd(), os.pardir)), 'events.json')
+    if 'details' in event:
+        details = event['details']
+        cleaned_event['auth_type'] = details.get('auth_type', None)
+        cleaned_event['token_id'] = details.get('token_id', None)
+
+    cleaned_event['session_id'] = event.get('sessionId', None)
+
+    return cleaned_event
+
+#the key used to detect events that were already stored
+def event_key(event):
+    return (event['time'], event['user_id'], event['session_id'])
+
+#load the sync cursor, the first sync bootstraps it from the events that are already stored
+def load_events_sync_state(state_file_path, events_file_path):
+    if os.path.exists(state_file_path):
+        with open(state_file_path, 'r') as file:
+            state = json.load(file)
+        state['seen_keys'] = {tuple(key) for key in state['seen_keys']}
+        return state
+
+    state = {'last_time': None, 'last_id': 0, 'seen_keys': set()}
+    if SIGNAL_BACKEND == 'sqlite' or os.path.exists(events_file_path):
+        existing_data = load_signal_records('events', events_file_path) or []
+        for event in existing_data:
+            if event['time'] is not None and (state['last_time'] is None or event['time'] > state['last_time']):
+                state['last_time'] = event['time']
+            state['last_id'] = max(state['last_id'], event.get('ID', 0))
+        if state['last_time'] is not None:
+            window_start = state['last_time'] - EVENTS_SYNC_OVERLAP_MS
+            state['seen_keys'] = {event_key(event) for event in existing_data if event['time'] is not None and event['time'] >= window_start}
+    return state
+
+def save_events_sync_state(state_file_path, state):
+    serializable_state = dict(state, seen_keys=[list(key) for key in state['seen_keys']])
+    temp_file_path = state_file_path + '.tmp'
+    with open(temp_file_path, 'w') as file:
+        json.dump(serializable_state, file)
+    os.replace(temp_file_path, state_file_path)
+
+#append records to a json array file written with indent=4 without rewriting the existing records
+def append_to_json_array_file(file_path, records):
+    if not records:
+        return
+
+    items = ',\n'.join('\n'.join('    ' + line for line in json.dumps(record, indent=4).split('\n')) for record in records)
+
+    if not os.path.exists(file_path) or os.path.getsize(file_path) == 0:
+        with open(file_path, 'w') as file:
+            json.dump(records, file, indent=4)
+        return
+
+    with open(file_path, 'r+b') as file:
+        # find the closing bracket of the array, skipping trailing whitespace
+        position = file.seek(0, os.SEEK_END)
+        while position > 0:
+            position -= 1
+            file.seek(position)
+            character = file.read(1)
+            if not character.isspace():
+                break
+        if character != b']':
+            raise json.JSONDecodeError("Expected a json array", file_path, position)
+
+        # check if the array is empty to decide whether a separator is needed
+        previous = position
+        while previous > 0:
+            previous -= 1
+            file.seek(previous)
+            previous_character = file.read(1)
+            if not previous_character.isspace():
+                break
+
+        separator = '\n' if previous_character == b'[' else ',\n'
+        file.seek(previous + 1)
+        file.truncate()
+        file.write((separator + items + '\n]').encode('utf-8'))
+
+#fetch only the keycloak events newer than the persisted cursor and append the new ones
+def store_keycloak_events(keycloak_admin):
+    parent_directory = os.path.abspath(os.path.join(os.getcwd(), os.pardir))
+    file_path = os.path.join(parent_directory, 'events.json')
+    state_file_path = os.path.join(parent_directory, 'events_sync_state.json')
 
     try:
-        existing_data = []
-        new_id = 1
+        state = load_events_sync_state(state_file_path, file_path)
+
+        query_params = {"max": EVENTS_PAGE_SIZE}
+        window_start_ms = None
+        if state['last_time'] is not None:
+            window_start_ms = state['last_time'] - EVENTS_SYNC_OVERLAP_MS
+            query_params["dateFrom"] = datetime.fromtimestamp(window_start_ms / 1000).strftime('%Y-%m-%d')
+
+        # keycloak returns the newest events first, page through until a short page is returned
+        new_events = []
+        seen_keys = state['seen_keys']
+        first = 0
+        while True:
+            events_page = keycloak_admin.get_events(query=dict(query_params, first=first))
+            for event in events_page:
+                cleaned_event = clean_keycloak_event(event)
+                key = event_key(cleaned_event)
+                # events before the overlap window were stored by an earlier sync
+                if key in seen_keys or (window_start_ms is not None and key[0] is not None and key[0] < window_start_ms):
+                    continue
+                seen_keys.add(key)
+                new_events.append(cleaned_event)
+
+            if len(events_page) < EVENTS_PAGE_SIZE:
+                break
+            first += EVENTS_PAGE_SIZE
+
+        if new_events:
+            if SIGNAL_BACKEND == 'sqlite':
+                new_events = signal_repository().insert_many('events', new_events)
+            else:
+                for i, event in enumerate(new_events, start=state['last_id'] + 1):
+                    event['ID'] = i
+                append_to_json_array_file(file_path, new_events)
 
-        if os.path.exists(file_path):
-            with open(file_path, 'r') as file:
-                existing_data = json.load(file)
-                if existing_data:
-                    last_entry = existing_data[-1]
-                    new_id = last_entry['ID'] + 1
+            state['last_id'] = max(event['ID'] for event in new_events)
+            event_times = [event['time'] for event in new_events if event['time'] is not None]
+            if event_times and (state['last_time'] is None or max(event_times) > state['last_time']):
+                state['last_time'] = max(event_times)
 
-        for i, event in enumerate(cleaned_data, start=new_id):
-            event_exists = False
-            for existing_event in existing_data:
-                if event['time'] == existing_event['time'] and event['user_id'] == existing_event['user_id']:
-                    event_exists = True
-                    break
+        # only the keys inside the overlap window are needed to deduplicate the next sync
+        if state['last_time'] is not None:
+            window_start_ms = state['last_time'] - EVENTS_SYNC_OVERLAP_MS
+            state['seen_keys'] = {key for key in seen_keys if key[0] is not None and key[0] >= window_start_ms}
 
-            if not event_exists:
-                event['ID'] = i
-                existing_data.append(event)
-
-        with open(file_path, 'w') as file:
-            json.dump(existing_data, file, indent=4)
+        save_events_sync_state(state_file_path, state)
+        return new_events
 
     except (json.JSONDecodeError, FileNotFoundError) as e:
         print(f"Error occurred while handling the JSON file: {e}")
@@ -209,40 +434,162 @@ def store_keycloak_events(keycloak_admin):
     except IOError as e:
         print(f"Error occurred while writing JSON data: {e}")
 
-#get the latest access request data for a particular user_id
+'''
 
-def get_latest_access_request(user_id, access_requests):
-    with open(access_requests, 'r') as file:
-        data = json.load(file)
+HANDLING STORAGE OF USER IDENTITY DATA
 
-    latest_request = None
-    for request in data:
-        if request['user_id'] == user_id:
-            if latest_request is None or request['access_request_time'] > latest_request['access_request_time']:
-                latest_request = request
+'''
 
-    return latest_request
+#merge the keycloak users into the user identity file, user_roles maps user IDs to the roles taken from their tokens
+def store_user_identity_data(all_users, user_roles, file_path):
+    # Load existing data from the file if it exists
+    existing_data = []
+    if os.path.exists(file_path):
+        with open(file_path, 'r') as json_file:
+            existing_data = json.load(json_file)
+
+    changed = False
+    existing_users = {user['user_id']: user for user in existing_data}
+
+    for user in all_users:
+        user_role = user_roles.get(user['id'], user.get('user_role'))
+        existing_user = existing_users.get(user['id'])
+
+        # Update existing records without overwriting existing roles
+        if existing_user is not None:
+            if user_role is not None and existing_user.get('user_role') != user_role:
+                existing_user['user_role'] = user_role
+                changed = True
+            continue
+
+        new_user = {
+            'user_id': user['id'],
+            'username': user['username'],
+            'email': user['email'],
+            'created_timestamp': user['createdTimestamp'],
+            'email_verified': user['emailVerified'],
+            'totp_enabled': user['totp'],
+            'user_role': user_role
+        }
+        existing_data.append(new_user)
+        existing_users[new_user['user_id']] = new_user
+        changed = True
+
+    # Store the updated and new data in the JSON file, skipping the write when nothing changed
+    if changed:
+        with open(file_path, 'w') as json_file:
+            json.dump(existing_data, json_file, indent=4)
+
+    return changed
+
+# signal store index -> (repository dataset, journal dataset) used by the other storage backends
+SIGNAL_INDEXES = {
+    'latest_access_request': ('access_requests', 'access_requests'),
+    'latest_auth_data': ('auth_data', None),
+    'user_identity': (None, None)
+}
+
+#return a function mapping a user_id to its record in the named index, resolved once for the storage backend
+def signal_lookup(index_name, file_path):
+    repository_dataset, journal_dataset = SIGNAL_INDEXES[index_name]
+    if SIGNAL_BACKEND == 'sqlite' and repository_dataset is not None:
+        repository = signal_repository()
+        return lambda user_id: repository.latest_for_user(repository_dataset, user_id)
+    if journal_dataset is not None and uses_journal(journal_dataset):
+        file_path = journal_path(file_path)
+    return signal_store.get_index(file_path, index_name).get
+
+#get the latest access request data for a particular user_id
+def get_latest_access_request(user_id, access_requests):
+    return signal_lookup('latest_access_request', access_requests)(user_id)
 
 #get the latest auth data for the particular user_id
 def get_latest_auth_data(user_id, auth_data):
-    with open(auth_data, 'r') as file:
-        data = json.load(file)
-
-    latest_data = None
-    for entry in data:
-        if entry['user_id'] == user_id:
-            if latest_data is None or entry['time'] > latest_data['time']:
-                latest_data = entry
-
-    return latest_data
+    return signal_lookup('latest_auth_data', auth_data)(user_id)
 
 #get user identity information
 def get_user_identity_data_by_id(user_id, user_data_file):
-    with open(user_data_file, 'r') as file:
-        user_data = json.load(file)
+    return signal_lookup('user_identity', user_data_file)(user_id)  # Returns None if user_id not found
+
+'''
+
+HANDLING STORAGE OF TRUST SIGNALS
+
+'''
 
-    for user in user_data:
-        if user['user_id'] == user_id:
-            return user
+#the repository used when the signals are stored in sqlite (see storage_config.py)
+def signal_repository():
+    return get_signal_repository(SIGNAL_DB_PATH)
 
-    return None  # Return None if user_id not found
\ No newline at end of file
+#check if the dataset is stored in an append-only journal (see storage_config.py)
+def uses_journal(dataset):
+    return SIGNAL_BACKEND == 'jsonl' and dataset in JOURNAL_DATASETS
+
+#the journal file kept next to the json file of a dataset, e.g. access_requests.json -> access_requests.jsonl
+def journal_path(file_path):
+    return os.path.splitext(file_path)[0] + '.jsonl'
+
+# Serializes the read-modify-write of the json signal files within this process
+json_file_lock = threading.Lock()
+
+#append records to a signal dataset ('access_requests', 'auth_data', 'events', 'access_decisions')
+#in one write and return the stored records with their new IDs placed first
+def append_signal_records(dataset, file_path, records):
+    if SIGNAL_BACKEND == 'sqlite':
+        return signal_repository().insert_many(dataset, records)
+    if uses_journal(dataset):
+        return get_signal_journal(journal_path(file_path)).append_many(records)
+
+    # the message handlers can run concurrently (asyncio transport), appends to a json file are serialized
+    with json_file_lock:
+        existing_data = []
+        new_id = 1
+
+        if os.path.exists(file_path):
+            with open(file_path, 'r') as file:
+                existing_data = json.load(file)
+                if existing_data:
+                    last_entry = existing_data[-1]
+                    new_id = last_entry['ID'] + 1
+
+        stored_records = []
+        for record in records:
+            stored_record = {'ID': new_id, **{key: value for key, value in record.items() if key != 'ID'}}
+            new_id += 1
+            stored_records.append(stored_record)
+        existing_data.extend(stored_records)
+
+        # replace the file in one step so readers never load a half written file
+        temp_file_path = file_path + '.tmp'
+        with open(temp_file_path, 'w') as file:
+            json.dump(existing_data, file, indent=4)
+        os.replace(temp_file_path, file_path)
+
+    return stored_records
+
+#append a record to a signal dataset and return the stored record with its new ID placed first
+def append_signal_record(dataset, file_path, record):
+    return append_signal_records(dataset, file_path, [record])[0]
+
+#load all the records of a signal dataset
+def load_signal_records(dataset, file_path):
+    if SIGNAL_BACKEND == 'sqlite':
+        return signal_repository().all_records(dataset)
+    if uses_journal(dataset):
+        return read_journal_records(journal_path(file_path))
+    return load_events_data(file_path)
+
+#get the most recently stored record of a signal dataset
+def get_latest_signal_record(dataset, file_path):
+    if SIGNAL_BACKEND == 'sqlite':
+        return signal_repository().latest(dataset)
+    if uses_journal(dataset):
+        return read_last_record(journal_path(file_path))
+
+    latest_record = None
+    if os.path.exists(file_path):
+        with open(file_path, 'r') as file:
+            records = json.load(file)
+            if records:
+                latest_record = max(records, key=lambda x: x['ID'])
+    return latest_record
@@ -0,0 +1,92 @@
+'''
+Worker pool used by the nodes to handle their messages off the connection threads.
+
+The work is partitioned by a key (the user_id of the message): all the work of one key goes to the same worker so
+the messages of a subject are handled in the order they arrived, while different subjects are handled in parallel.
+Every worker has a bounded queue, submit() does not block and returns False when the queue of the partition is full
+so the node can tell the sender to back off instead of queueing without limit.
+
+'''
+
+import os
+import queue
+import threading
+import zlib
+
+class PartitionedWorkerPool:
+    def __init__(self, workers=None, queue_limit=1000, name='worker'):
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_limit = queue_limit
+        self._queues = [queue.Queue(maxsize=queue_limit) for _ in range(self.workers)]
+        self._threads = []
+        self._counts_lock = threading.Lock()
+        self._closed = threading.Event()
+        self.submitted = 0
+        self.rejected = 0
+        for index, work_queue in enumerate(self._queues):
+            thread = threading.Thread(target=self._work_loop, args=(work_queue,), name=f"{name}-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    #the partition of a key, crc32 is used as it is stable across processes unlike hash()
+    def partition(self, key):
+        return zlib.crc32(str(key).encode('utf-8')) % self.workers
+
+    #queue function(*args) on the worker of the key, returns False when that worker's queue is full
+    def submit(self, key, function, *args):
+        if self._closed.is_set():
+            return False
+        try:
+            self._queues[self.partition(key)].put_nowait((function, args))
+        except queue.Full:
+            with self._counts_lock:
+                self.rejected += 1
+            return False
+        with self._counts_lock:
+            self.submitted += 1
+        return True
+
+    def queue_depth(self, key):
+        return self._queues[self.partition(key)].qsize()
+
+    def _work_loop(self, work_queue):
+        while True:
+            item = work_queue.get()
+            if item is None:
+                break
+            function, args = item
+            try:
+                function(*args)
+            except Exception as e:
+                print(f"Worker {threading.current_thread().name} failed: {type(e).__name__}: {e}")
+
+    def get_stats(self):
+        with self._counts_lock:
+            return {
+                'workers': self.workers,
+                'queue_limit': self.queue_limit,
+                'queue_depths': [work_queue.qsize() for work_queue in self._queues],
+                'submitted': self.submitted,
+                'rejected': self.rejected
+            }
+
+    #stop the workers, wait=True lets them handle the work already queued and waits for them, wait=False drops the
+    #queued work so a full queue cannot hold up the shutdown of the node
+    def close(self, wait=True):
+        self._closed.set()
+        for work_queue in self._queues:
+            if wait:
+                work_queue.put(None)
+                continue
+            while True:
+                try:
+                    work_queue.put_nowait(None)
+                    break
+                except queue.Full:
+                    try:
+                        work_queue.get_nowait()
+                    except queue.Empty:
+                        pass
+        if wait:
+            for thread in self._threads:
+                thread.join()
@@ -0,0 +1,53 @@
+'''
+Helpers shared by the pipeline benchmarks: the topology of a benchmark mesh, the latency percentiles, and the CPU
+time and memory of the node processes read from /proc.
+
+'''
+
+import os
+
+PROJECT_DIRECTORY = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+ROLES = ('access_proxy', 'trust_engine', 'policy_engine', 'web_ui')
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+#write a topology.yml with one node of every role on the ports after port_base (ids 1 to 4 as in topology.yml)
+def write_topology(directory, port_base):
+    lines = ['nodes:']
+    for index, role in enumerate(ROLES, start=1):
+        lines.append(f"  - {{id: '{index}', role: {role}, host: 127.0.0.1, port: {port_base + index}}}")
+    file_path = os.path.join(directory, 'topology.yml')
+    with open(file_path, 'w') as file:
+        file.write('\n'.join(lines) + '\n')
+    return file_path
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+def summarize(latencies):
+    if not latencies:
+        return {'p50_ms': None, 'p95_ms': None, 'p99_ms': None, 'mean_ms': None}
+    return {
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3)
+    }
+
+#CPU time (user + system, in seconds) of a process, from /proc/<pid>/stat
+def process_cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat", 'r') as file:
+        # the command name can contain spaces, the fields are counted from the closing parenthesis
+        fields = file.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+#resident memory of a process in MiB: {'rss_mb': current, 'peak_rss_mb': high water mark}, from /proc/<pid>/status
+def process_memory(pid):
+    memory = {}
+    with open(f"/proc/{pid}/status", 'r') as file:
+        for line in file:
+            if line.startswith('VmRSS:'):
+                memory['rss_mb'] = round(int(line.split()[1]) / 1024, 1)
+            elif line.startswith('VmHWM:'):
+                memory['peak_rss_mb'] = round(int(line.split()[1]) / 1024, 1)
+    return memory
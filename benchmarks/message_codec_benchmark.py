@@ -0,0 +1,125 @@
+'''
+Benchmark of the message encodings of the inter-node envelopes.
+
+Encodes and decodes the messages of one access request (web UI -> AP -> TE -> PE -> web UI) with every encoding and
+reports the bytes on the wire and the encode/decode CPU time per message.
+
+    python3 benchmarks/message_codec_benchmark.py [--iterations 20000] [--output results.json]
+
+'''
+
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)))
+
+from ZeroTrustWebUI import message_codec
+from ZeroTrustWebUI.async_node import FRAME_HEADER
+from ZeroTrustWebUI.message_codec import MessageCodec, CODEC_JSON, CODEC_MSGPACK
+
+EOT_CHAR = b'\x04'
+
+#the envelopes of one access request, as sent by send_message_to_node
+def sample_messages():
+    request_id = uuid.uuid4().hex
+    user_id = str(uuid.uuid4())
+    access_request = {
+        'ID': 1234,
+        'request_id': request_id,
+        'user_id': user_id,
+        'intent': 'Access Request',
+        'resource_requested': 'Resource 1',
+        'access_request_time': '2024-03-12 09:41:27',
+        'public_ip_address': '156.0.232.51',
+        'location': 'Nairobi/KE',
+        'device_type': 'Desktop',
+        'browser': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36',
+        'device_mac': 'e4:aa:ea:b3:94:df',
+        'device_vendor': 'Liteon Technology Corporation',
+        'device_OS': 'Linux x86_64'
+    }
+    contents = [
+        ('4', access_request),
+        ('1', {'user_id': user_id, 'intent': 'request_trust_score', 'request_id': request_id}),
+        ('2', {'user_id': user_id, 'intent': 'request_access_decision', 'user_trust_score': 0.6940000000000001,
+               'policy_version': '1464575da927', 'request_id': request_id}),
+        ('3', {'ID': 49, 'user_id': user_id, 'intent': 'request_access_decision', 'user_trust_score': 0.6940000000000001,
+               'access_decision': 1, 'request_id': request_id})
+    ]
+    return [{'senderID': sender_id, 'requestID': request_id, 'messageContent': content} for sender_id, content in contents]
+
+#the encodings compared, each one is (name, encode, decode) and encode returns the bytes written on the socket
+def encodings():
+    yield ('p2pnetwork json (EOT)',
+           lambda data: json.dumps(data).encode('utf-8') + EOT_CHAR,
+           lambda frame: json.loads(frame[:-1].decode('utf-8')))
+
+    def framed(codec):
+        return (lambda data: FRAME_HEADER.pack(0) + codec.encode(data),
+                lambda frame: MessageCodec.decode(frame[FRAME_HEADER.size:]))
+
+    yield ('json',) + framed(MessageCodec(CODEC_JSON, compression_threshold=None))
+    yield ('json + zlib',) + framed(MessageCodec(CODEC_JSON, compression_threshold=0))
+
+    if message_codec.msgpack is None:
+        print("msgpack is not installed, skipping the msgpack encodings")
+        return
+    msgpack = message_codec.msgpack
+    yield ('msgpack (field names)',
+           lambda data: FRAME_HEADER.pack(0) + msgpack.packb(data, use_bin_type=True),
+           lambda frame: msgpack.unpackb(frame[FRAME_HEADER.size:], raw=False))
+    yield ('msgpack + interned fields',) + framed(MessageCodec(CODEC_MSGPACK, compression_threshold=None))
+    yield ('msgpack + interned fields + zlib',) + framed(MessageCodec(CODEC_MSGPACK, compression_threshold=0))
+
+def run_benchmark(iterations):
+    messages = sample_messages()
+    results = []
+    for name, encode, decode in encodings():
+        frames = [encode(message) for message in messages]
+        for message, frame in zip(messages, frames):
+            assert decode(frame) == message, f"{name} does not round trip"
+
+        started = time.process_time()
+        for _ in range(iterations):
+            for message in messages:
+                encode(message)
+        encode_time = time.process_time() - started
+
+        started = time.process_time()
+        for _ in range(iterations):
+            for frame in frames:
+                decode(frame)
+        decode_time = time.process_time() - started
+
+        message_count = iterations * len(messages)
+        results.append({
+            'encoding': name,
+            'bytes_per_message': sum(len(frame) for frame in frames) / len(frames),
+            'bytes_per_message_type': [len(frame) for frame in frames],
+            'encode_us_per_message': encode_time / message_count * 1e6,
+            'decode_us_per_message': decode_time / message_count * 1e6
+        })
+    return results
+
+def print_results(results):
+    baseline = results[0]['bytes_per_message']
+    print(f"{'encoding':<34}{'bytes/msg':>10}{'vs json':>9}{'encode us':>11}{'decode us':>11}  bytes per message type")
+    for result in results:
+        print(f"{result['encoding']:<34}{result['bytes_per_message']:>10.1f}{result['bytes_per_message'] / baseline:>9.2f}"
+              f"{result['encode_us_per_message']:>11.2f}{result['decode_us_per_message']:>11.2f}  {result['bytes_per_message_type']}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the encodings of the inter-node messages')
+    parser.add_argument('--iterations', type=int, default=20000)
+    parser.add_argument('--output', help='write the results to this json file')
+    args = parser.parse_args()
+
+    results = run_benchmark(args.iterations)
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'iterations': args.iterations, 'results': results}, file, indent=4)
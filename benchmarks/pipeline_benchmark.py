@@ -0,0 +1,323 @@
+'''
+End-to-end latency benchmark of the access decision pipeline on a local node mesh.
+
+Generates synthetic users, auth data and access requests in a temporary working directory, starts the access proxy,
+trust engine and policy engine as separate processes on loopback ports, and drives concurrent access requests from a
+web UI node in this process through process_message_from_web_ui of the access proxy, as the /resource-selection route
+does. Reports the p50/p95/p99 decision latency, the throughput, and the CPU time and resident memory of every node,
+and writes them to a json file so the results of two versions can be compared.
+
+    python3 benchmarks/pipeline_benchmark.py [--users 1000] [--requests 2000] [--concurrency 32]
+                                             [--transport p2pnetwork] [--batching] [--output pipeline_benchmark.json]
+
+'''
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from benchmark_utils import PROJECT_DIRECTORY, write_topology, summarize, process_cpu_seconds, process_memory
+
+DECISION_TIMEOUT = 30
+READY_TIMEOUT = 60
+PORT_BASE = 9400
+
+USER_ROLES = ('Policy Administrator', 'Approver', 'Security Viewer')
+LOCATIONS = ('Nairobi/KE', 'Kampala/UG', 'Kigali/RW', 'Lagos/NG', 'Berlin/DE')
+DEVICES = (('Desktop', 'Linux x86_64'), ('Desktop', 'Windows'), ('Mobile', 'Android'), ('Mobile', 'iOS'))
+RESOURCES = ('Resource 1', 'Resource 2', 'Resource 3')
+
+# The peers every engine connects with, as in AccessProxy.py, TrustEngine.py and PolicyEngine.py
+NODE_PEERS = {
+    'access_proxy': ('trust_engine', 'policy_engine', 'web_ui'),
+    'trust_engine': ('policy_engine', 'access_proxy'),
+    'policy_engine': ('trust_engine', 'web_ui', 'access_proxy')
+}
+
+#write the signal files of users synthetic users to the directory, returns the user ids
+def generate_signals(directory, users, access_requests_per_user, auth_records_per_user, seed):
+    generator = random.Random(seed)
+    now = int(time.time() * 1000)
+    user_data, access_requests, auth_data = [], [], []
+
+    for index in range(users):
+        user_id = str(uuid.UUID(int=generator.getrandbits(128), version=4))
+        user_data.append({
+            'user_id': user_id,
+            'username': f"benchmark_user{index}",
+            'email': f"benchmark.user{index}@example.com",
+            'created_timestamp': now - generator.randint(0, 365) * 24 * 60 * 60 * 1000,
+            'email_verified': generator.random() < 0.8,
+            'totp_enabled': generator.random() < 0.5,
+            'user_role': generator.choice(USER_ROLES)
+        })
+        for _ in range(access_requests_per_user):
+            device_type, device_os = generator.choice(DEVICES)
+            access_request_time = datetime.datetime(2023, 12, 1) + datetime.timedelta(seconds=generator.randint(0, 30 * 24 * 60 * 60))
+            access_requests.append({
+                'ID': len(access_requests) + 1,
+                'user_id': user_id,
+                'intent': 'Access Request',
+                'resource_requested': generator.choice(RESOURCES),
+                'access_request_time': access_request_time.strftime('%Y-%m-%d %H:%M:%S'),
+                'public_ip_address': f"105.{generator.randint(0, 255)}.{generator.randint(0, 255)}.{generator.randint(1, 254)}",
+                'location': generator.choice(LOCATIONS),
+                'device_type': device_type,
+                'browser': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36',
+                'device_mac': ':'.join(f"{generator.randint(0, 255):02x}" for _ in range(6)),
+                'device_vendor': 'Liteon Technology Corporation',
+                'device_OS': device_os
+            })
+        for _ in range(auth_records_per_user):
+            auth_data.append({
+                'time': now - generator.randint(0, 30 * 24 * 60 * 60 * 1000),
+                'type': 'LOGIN',
+                'user_id': user_id,
+                'ip_address': '172.17.0.1',
+                'auth_type': generator.choice(('code', 'password')),
+                'auth_status': 1,
+                'sign_in_risk': round(generator.uniform(0.0, 1.5), 3),
+                'ID': len(auth_data) + 1
+            })
+
+    signal_files = {
+        'user_data.json': user_data,
+        'access_requests.json': access_requests,
+        'auth_data.json': auth_data,
+        'events.json': [],
+        'access_decision.json': []
+    }
+    for file_name, records in signal_files.items():
+        with open(os.path.join(directory, file_name), 'w') as file:
+            json.dump(records, file)
+    return [user['user_id'] for user in user_data]
+
+#run one engine node until its stdin is closed, called in the node processes started by start_node
+def run_node(node_id, transport):
+    sys.path.insert(0, PROJECT_DIRECTORY)
+    if transport == 'asyncio':
+        from AsyncNetworking import AsyncNetworking as Networking
+    else:
+        from Networking import Networking
+
+    node = Networking(Networking.NODE_CONNECT[node_id][0], Networking.NODE_CONNECT[node_id][1], node_id)
+    node.start()
+    for role in NODE_PEERS[Networking.NODE_TYPE[node_id]]:
+        node.connect_with_role(role)
+    # tells the benchmark that the node is listening
+    with open(f"{node_id}.ready", 'w') as file:
+        file.write(str(os.getpid()))
+    try:
+        sys.stdin.read()
+    finally:
+        node.stop()
+
+def start_node(directory, node_id, transport, environment):
+    with open(os.path.join(directory, f"node-{node_id}.log"), 'w') as log_file:
+        return subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--run-node', node_id, '--transport', transport],
+            cwd=directory, env=environment, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=log_file
+        )
+
+def wait_until_ready(directory, processes):
+    deadline = time.monotonic() + READY_TIMEOUT
+    for node_id, process in processes.items():
+        while not os.path.exists(os.path.join(directory, f"{node_id}.ready")):
+            if process.poll() is not None:
+                with open(os.path.join(directory, f"node-{node_id}.log"), 'r') as log_file:
+                    raise RuntimeError(f"Node {node_id} exited with {process.returncode}:\n{log_file.read()}")
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Node {node_id} did not start within {READY_TIMEOUT}s")
+            time.sleep(0.05)
+
+#send access requests from the web UI node, returns [(latency in seconds, outcome)]
+def drive_requests(web_ui, user_ids, requests, concurrency):
+    from ZeroTrustWebUI.topology import ACCESS_PROXY, POLICY_ENGINE
+
+    results = []
+    results_lock = threading.Lock()
+    next_request = iter(range(requests))
+    next_request_lock = threading.Lock()
+
+    def access_request(index):
+        request_id = uuid.uuid4().hex
+        user_id = user_ids[index % len(user_ids)]
+        started = time.perf_counter()
+        web_ui.ensure_connected_to_role(POLICY_ENGINE)
+        decision_future = web_ui.expect_decision(request_id)
+        message = {'request_id': request_id, 'user_id': user_id, 'intent': 'Access Request'}
+        decision = None
+        if web_ui.send_message_to_role(ACCESS_PROXY, user_id, message, request_id):
+            decision = web_ui.wait_for_decision(request_id, decision_future, DECISION_TIMEOUT)
+        else:
+            web_ui.cancel_decision(request_id)
+
+        if decision is None:
+            outcome = 'timeout'
+        elif decision.get('intent') == 'backpressure':
+            outcome = 'backpressure'
+        else:
+            outcome = 'decision'
+        return time.perf_counter() - started, outcome
+
+    def client():
+        while True:
+            with next_request_lock:
+                index = next(next_request, None)
+            if index is None:
+                return
+            result = access_request(index)
+            with results_lock:
+                results.append(result)
+
+    clients = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    return results
+
+def get_git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_DIRECTORY, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmark(args):
+    with tempfile.TemporaryDirectory(prefix='zta-pipeline-benchmark-') as directory:
+        user_ids = generate_signals(directory, args.users, args.access_requests_per_user, args.auth_records_per_user, args.seed)
+        environment = dict(
+            os.environ,
+            ZTA_TOPOLOGY_FILE=write_topology(directory, args.port_base),
+            ZTA_NODE_TRANSPORT=args.transport,
+            ZTA_REQUEST_BATCHING='1' if args.batching else '0'
+        )
+        # the web UI node of this process reads the same configuration as the engines
+        os.environ.update(environment)
+        os.chdir(directory)
+        sys.path.insert(0, PROJECT_DIRECTORY)
+        # the web UI modules import each other by name
+        sys.path.append(os.path.join(PROJECT_DIRECTORY, 'ZeroTrustWebUI'))
+        if args.transport == 'asyncio':
+            from ZeroTrustWebUI.AsyncNetworking import AsyncNetworking as WebUINetworking
+        else:
+            from ZeroTrustWebUI.Networking import Networking as WebUINetworking
+        from ZeroTrustWebUI.topology import ACCESS_PROXY, TRUST_ENGINE, POLICY_ENGINE, WEB_UI
+
+        topology = WebUINetworking.TOPOLOGY
+        web_ui_id = topology.nodes_with_role(WEB_UI)[0]
+        web_ui = WebUINetworking(*WebUINetworking.NODE_CONNECT[web_ui_id], web_ui_id)
+        web_ui.daemon = True
+        web_ui.start()
+
+        processes = {}
+        try:
+            for role in (POLICY_ENGINE, TRUST_ENGINE, ACCESS_PROXY):
+                node_id = topology.nodes_with_role(role)[0]
+                processes[node_id] = start_node(directory, node_id, args.transport, environment)
+            wait_until_ready(directory, processes)
+
+            # until every node is connected, then the caches and the indexes of the signal files are warm
+            drive_requests(web_ui, user_ids, args.warmup, min(args.concurrency, args.warmup))
+
+            cpu_before = {node_id: process_cpu_seconds(process.pid) for node_id, process in processes.items()}
+            cpu_before[web_ui_id] = process_cpu_seconds(os.getpid())
+            started = time.perf_counter()
+            results = drive_requests(web_ui, user_ids, args.requests, args.concurrency)
+            elapsed = time.perf_counter() - started
+
+            nodes = {}
+            for node_id, pid in [(node_id, process.pid) for node_id, process in processes.items()] + [(web_ui_id, os.getpid())]:
+                cpu_seconds = process_cpu_seconds(pid) - cpu_before[node_id]
+                nodes[node_id] = dict(
+                    {
+                        'role': topology.get(node_id).role,
+                        'cpu_seconds': round(cpu_seconds, 3),
+                        'cpu_percent': round(cpu_seconds / elapsed * 100, 1)
+                    },
+                    **process_memory(pid)
+                )
+            # the web UI node shares its process with the request threads of the benchmark
+            nodes[web_ui_id]['includes_benchmark_driver'] = True
+        finally:
+            for process in processes.values():
+                process.stdin.close()
+            for process in processes.values():
+                try:
+                    process.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+            web_ui.stop()
+            os.chdir(PROJECT_DIRECTORY)
+
+    outcomes = [outcome for _, outcome in results]
+    return {
+        'benchmark': 'pipeline',
+        'revision': get_git_revision(),
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'configuration': {
+            'transport': args.transport,
+            'batching': args.batching,
+            'users': args.users,
+            'access_requests_per_user': args.access_requests_per_user,
+            'auth_records_per_user': args.auth_records_per_user,
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'seed': args.seed
+        },
+        'latency': summarize([latency for latency, outcome in results if outcome == 'decision']),
+        'throughput_per_s': round(outcomes.count('decision') / elapsed, 1),
+        'elapsed_s': round(elapsed, 3),
+        'decisions': outcomes.count('decision'),
+        'backpressure': outcomes.count('backpressure'),
+        'timeouts': outcomes.count('timeout'),
+        'nodes': nodes
+    }
+
+def print_results(result):
+    latency = result['latency']
+    print(f"{result['decisions']}/{result['configuration']['requests']} decisions ({result['backpressure']} backpressure, "
+          f"{result['timeouts']} timeouts) in {result['elapsed_s']}s: {result['throughput_per_s']} decisions/s")
+    print(f"latency p50 {latency['p50_ms']} ms, p95 {latency['p95_ms']} ms, p99 {latency['p99_ms']} ms")
+    print(f"{'node':<6} {'role':<14} {'cpu s':>8} {'cpu %':>7} {'rss MiB':>8} {'peak MiB':>9}")
+    for node_id, node in result['nodes'].items():
+        print(f"{node_id:<6} {node['role']:<14} {node['cpu_seconds']:>8} {node['cpu_percent']:>7} {node.get('rss_mb', ''):>8} {node.get('peak_rss_mb', ''):>9}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure the decision latency and throughput of the node pipeline')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--access-requests-per-user', type=int, default=5)
+    parser.add_argument('--auth-records-per-user', type=int, default=5)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--warmup', type=int, default=50)
+    parser.add_argument('--transport', choices=('p2pnetwork', 'asyncio'), default=os.environ.get('ZTA_NODE_TRANSPORT', 'p2pnetwork'))
+    parser.add_argument('--batching', action='store_true', help='micro-batch the access requests (ZTA_REQUEST_BATCHING)')
+    parser.add_argument('--port-base', type=int, default=PORT_BASE)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default='pipeline_benchmark.json', help='json file the results are written to')
+    parser.add_argument('--run-node', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_node:
+        run_node(args.run_node, args.transport)
+        sys.exit(0)
+
+    # the web UI node logs every message it receives
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = run_benchmark(args)
+    print_results(result)
+    output = os.path.abspath(args.output)
+    with open(output, 'w') as file:
+        json.dump(result, file, indent=4)
+    print(f"Results written to {output}")
@@ -0,0 +1,174 @@
+'''
+Benchmark of the all-in-one pipeline mode (AllInOne.py) against the networked mode (AccessProxy.py, TrustEngine.py
+and PolicyEngine.py as separate nodes on loopback sockets).
+
+Every mode runs in its own process with its own ports and a copy of the signal files, so the decisions it stores do
+not end up in the files of the project. A web UI node sends the access requests and waits for their decisions, as
+the /resource-selection route does.
+
+    python3 benchmarks/pipeline_mode_benchmark.py [--requests 500] [--concurrency 16] [--transport p2pnetwork] [--output results.json]
+
+'''
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from benchmark_utils import PROJECT_DIRECTORY, write_topology, summarize
+
+SIGNAL_FILES = ('user_data.json', 'access_requests.json', 'auth_data.json', 'events.json', 'access_decision.json')
+MODES = {'network': 9100, 'all-in-one': 9200}
+DECISION_TIMEOUT = 30
+
+#run the pipeline of one mode in this process, called in the child process with the topology of the mode
+def run_mode(mode, transport, requests, concurrency):
+    sys.path.insert(0, PROJECT_DIRECTORY)
+    # the web UI modules import each other by name, after the engines so Networking is the engine transport
+    sys.path.append(os.path.join(PROJECT_DIRECTORY, 'ZeroTrustWebUI'))
+    from ZeroTrustWebUI.local_link import link_nodes
+    from ZeroTrustWebUI.topology import ACCESS_PROXY, TRUST_ENGINE, POLICY_ENGINE, WEB_UI
+    from ZeroTrustWebUI.trust_score_cache import trust_score_cache
+    if transport == 'asyncio':
+        from AsyncNetworking import AsyncNetworking as Networking
+        from ZeroTrustWebUI.AsyncNetworking import AsyncNetworking as WebUINetworking
+    else:
+        from Networking import Networking
+        from ZeroTrustWebUI.Networking import Networking as WebUINetworking
+
+    topology = Networking.TOPOLOGY
+    node_ids = [topology.nodes_with_role(role)[0] for role in (ACCESS_PROXY, TRUST_ENGINE, POLICY_ENGINE, WEB_UI)]
+    access_proxy, trust_engine, policy_engine = [Networking(*Networking.NODE_CONNECT[node_id], node_id) for node_id in node_ids[:3]]
+    web_ui = WebUINetworking(*Networking.NODE_CONNECT[node_ids[3]], node_ids[3])
+    web_ui.daemon = True
+    for node in (access_proxy, trust_engine, policy_engine, web_ui):
+        node.start()
+    try:
+        if mode == 'all-in-one':
+            link_nodes(access_proxy, trust_engine)
+            link_nodes(access_proxy, policy_engine)
+            link_nodes(trust_engine, policy_engine)
+        access_proxy.connect_with_role(TRUST_ENGINE)
+        access_proxy.connect_with_role(POLICY_ENGINE)
+        trust_engine.connect_with_role(POLICY_ENGINE)
+        policy_engine.connect_with_role(WEB_UI)
+        web_ui.ensure_connected_to_role(POLICY_ENGINE)
+
+        # the users whose trust score can be calculated from the signal files, the others get no decision
+        with open('user_data.json', 'r') as file:
+            user_ids = [user['user_id'] for user in json.load(file)]
+        user_trust_scores = trust_score_cache.get_trust_scores(user_ids)
+        user_ids = [user_id for user_id in user_ids if user_trust_scores.get(user_id) is not None]
+
+        def access_request(index):
+            request_id = uuid.uuid4().hex
+            user_id = user_ids[index % len(user_ids)]
+            started = time.perf_counter()
+            decision_future = web_ui.expect_decision(request_id)
+            message = {'request_id': request_id, 'user_id': user_id, 'intent': 'Access Request'}
+            decision = None
+            if web_ui.send_message_to_role(ACCESS_PROXY, user_id, message, request_id):
+                decision = web_ui.wait_for_decision(request_id, decision_future, DECISION_TIMEOUT)
+            else:
+                web_ui.cancel_decision(request_id)
+            return time.perf_counter() - started, decision is not None
+
+        for index in range(min(20, requests)):
+            access_request(index)
+
+        # one request at a time: the latency of a decision
+        sequential = [access_request(index) for index in range(requests)]
+
+        # concurrency requests in flight: the throughput of the pipeline
+        concurrent = []
+        concurrent_lock = threading.Lock()
+        next_index = iter(range(requests))
+        next_index_lock = threading.Lock()
+
+        def client():
+            while True:
+                with next_index_lock:
+                    index = next(next_index, None)
+                if index is None:
+                    return
+                result = access_request(index)
+                with concurrent_lock:
+                    concurrent.append(result)
+
+        started = time.perf_counter()
+        clients = [threading.Thread(target=client) for _ in range(concurrency)]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        return {
+            'mode': mode,
+            'transport': transport,
+            'users': len(user_ids),
+            'sequential': dict(summarize([latency for latency, _ in sequential]), decisions=sum(ok for _, ok in sequential), requests=requests),
+            'concurrent': dict(summarize([latency for latency, _ in concurrent]), decisions=sum(ok for _, ok in concurrent), requests=requests,
+                               concurrency=concurrency, throughput_per_s=round(requests / elapsed, 1))
+        }
+    finally:
+        for node in (access_proxy, trust_engine, policy_engine, web_ui):
+            node.stop()
+
+#run every mode in a child process with its own working directory and ports
+def run_benchmark(requests, concurrency, transport):
+    results = []
+    for mode, port_base in MODES.items():
+        with tempfile.TemporaryDirectory(prefix='zta-benchmark-') as directory:
+            for file_name in SIGNAL_FILES:
+                shutil.copy(os.path.join(PROJECT_DIRECTORY, file_name), directory)
+            environment = dict(os.environ, ZTA_TOPOLOGY_FILE=write_topology(directory, port_base), ZTA_NODE_TRANSPORT=transport)
+            child = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--run-mode', mode, '--requests', str(requests),
+                 '--concurrency', str(concurrency), '--transport', transport],
+                cwd=directory, env=environment, capture_output=True, text=True
+            )
+            if child.returncode != 0:
+                raise RuntimeError(f"The {mode} mode failed:\n{child.stderr}")
+            with open(os.path.join(directory, 'result.json'), 'r') as file:
+                results.append(json.load(file))
+    return results
+
+def print_results(results):
+    print(f"{'mode':<12} {'decisions':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'conc. p50':>10} {'conc. p99':>10} {'req/s':>9}")
+    for result in results:
+        sequential, concurrent = result['sequential'], result['concurrent']
+        decisions = f"{sequential['decisions'] + concurrent['decisions']}/{sequential['requests'] + concurrent['requests']}"
+        print(f"{result['mode']:<12} {decisions:>10} {sequential['p50_ms']:>9} {sequential['p95_ms']:>9} {sequential['p99_ms']:>9} "
+              f"{concurrent['p50_ms']:>10} {concurrent['p99_ms']:>10} {concurrent['throughput_per_s']:>9}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the all-in-one pipeline mode with the networked mode')
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--transport', choices=('p2pnetwork', 'asyncio'), default=os.environ.get('ZTA_NODE_TRANSPORT', 'p2pnetwork'))
+    parser.add_argument('--output', help='write the results to this json file')
+    parser.add_argument('--run-mode', choices=tuple(MODES), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_mode:
+        # the nodes log every message, the result is written to the working directory of the mode
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = run_mode(args.run_mode, args.transport, args.requests, args.concurrency)
+        with open('result.json', 'w') as file:
+            json.dump(result, file)
+        sys.exit(0)
+
+    results = run_benchmark(args.requests, args.concurrency, args.transport)
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=4)